@@ -2,6 +2,7 @@ from flask import Flask, request, jsonify
 import os
 import datetime
 import uuid
+import sys
 import numpy as np
 import onnxruntime as ort
 from PIL import Image
@@ -10,6 +11,10 @@ from flask_cors import CORS
 
 # Get absolute path to project directory
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)  # Navigate to the root directory
+sys.path.insert(0, ROOT_DIR)  # the speckle filters and the model metadata readers are shared with training
+from src.speckle import apply_speckle_filter
+from onnx_inference import input_normalization, speckle_filter
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend communication
@@ -25,7 +30,6 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
 # Load the ONNX model
-ROOT_DIR = os.path.dirname(BASE_DIR)  # Navigate to the root directory
 model_path = os.path.join(ROOT_DIR, 'sar2rgb.onnx')
 print(f"Loading model from: {model_path}")
 
@@ -45,10 +49,18 @@ def generate_unique_filename(original_filename):
     return f"{timestamp}_{uuid.uuid4().hex[:8]}{ext}"
 
 def predict(image, sess):
+    # Match the channels the model was exported with, single-channel models take the SAR image as is
+    channels = sess.get_inputs()[0].shape[1]
+    image = image.convert("L" if channels == 1 else "RGB")
+    input_mean, input_std = input_normalization(sess)
+    image = Image.fromarray(apply_speckle_filter(np.array(image), speckle_filter(sess)))  # same filter as the training images, at native resolution
     image = image.resize((256, 256))  # Resize to model input size
-    image = np.array(image).transpose(2, 0, 1)  # Convert HWC to CHW
+    image = np.array(image)
+    if image.ndim == 2:
+        image = image[..., None]  # Convert HW to HWC
+    image = image.transpose(2, 0, 1)  # Convert HWC to CHW
     image = image.astype(np.float32) / 255.0  # Normalize to [0,1]
-    image = (image - 0.5) / 0.5  # Normalize to [-1,1]
+    image = (image - input_mean) / input_std  # Normalize to [-1,1], or with the dataset statistics
     image = np.expand_dims(image, axis=0)  # Add batch dimension
     
     input_name = sess.get_inputs()[0].name
@@ -82,7 +94,7 @@ def process_image():
 
     try:
         file.save(input_path)
-        input_image = Image.open(input_path).convert("RGB")  # Ensure it's 3-channel
+        input_image = Image.open(input_path)  # predict() converts it to the model's channels
         output_image = predict(input_image, session)
         output_image.save(output_path)
 
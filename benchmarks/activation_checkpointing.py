@@ -0,0 +1,48 @@
+"""
+Measures the step time and peak memory of Pix2Pix training steps for
+several activation checkpointing settings of the generator
+(`model.checkpoint`).
+
+Checkpointed blocks only keep their inputs and recompute their inner
+activations (and the skip concatenations of the decoder) in backward, so
+memory goes down and step time goes up. The 1024-channel decoder blocks
+at high resolution hold most of the activations.
+
+    python -m benchmarks.activation_checkpointing --batch-size 8
+    python -m benchmarks.activation_checkpointing --settings none decoder enc1,enc2,dec7,dec8
+"""
+import argparse
+
+from benchmarks.common import measure_train_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generator activation checkpointing.")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--settings", type=str, nargs='+', default=['none', 'encoder', 'decoder', 'all'],
+                        help="'none', 'encoder', 'decoder', 'all' or comma-separated block names")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--sar-channels", type=int, default=3, choices=(1, 3))
+    parser.add_argument("--precision", type=str, default="fp32", choices=("fp32", "bf16"))
+    parser.add_argument("--num-steps", type=int, default=5, help="Number of steps to time")
+    parser.add_argument("--warmup", type=int, default=1, help="Number of untimed steps")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    results = {}
+    for setting in args.settings:
+        checkpoint = setting.split(',') if ',' in setting else setting
+        result = results[setting] = measure_train_steps(
+            {'c_in': args.sar_channels, 'precision': args.precision, 'checkpoint': checkpoint},
+            args.batch_size, args.image_size, args.num_steps, args.warmup, args.device)
+        print(f"{setting:>24}: {result['step_ms']:8.1f} ms/step {result['samples_per_sec']:8.1f} samples/sec "
+              f"{result['peak_mb']:8.1f} MB peak")
+
+    reference = results[args.settings[0]]
+    for setting in args.settings[1:]:
+        print(f"{setting:>24}: {results[setting]['peak_mb'] / max(reference['peak_mb'], 1e-6):.2f}x memory, "
+              f"{results[setting]['step_ms'] / reference['step_ms']:.2f}x step time of {args.settings[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares per-sample torchvision v2 augmentation (as it would run in the
+dataloader workers) with the batched `PairedBatchAugment` stage.
+
+Both pipelines normalize a uint8 (SAR, optical) batch to [-1, 1] and apply
+paired flips, 90° rotations, a resized crop and a brightness/contrast jitter
+of the SAR image. Only the transforms are timed, not the image decoding.
+
+    python -m benchmarks.augmentation_throughput --device cuda
+"""
+import argparse
+import time
+
+import torch
+from torchvision import tv_tensors
+from torchvision.transforms import v2
+
+from src.transforms import BatchNormalize, PairedBatchAugment
+
+
+def time_batches(fn, batches, warmup: int = 2):
+    """Returns the samples/sec of `fn` over `batches`, skipping the first `warmup` batches."""
+    for batch in batches[:warmup]:
+        fn(*batch)
+    seen = 0
+    start = time.perf_counter()
+    for batch in batches[warmup:]:
+        out = fn(*batch)
+        seen += len(batch[0])
+    if out[0].is_cuda:
+        torch.cuda.synchronize()
+    return seen / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-sample vs. batched paired augmentation.")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--sar-channels", type=int, default=3, choices=(1, 3))
+    parser.add_argument("--num-batches", type=int, default=20, help="Number of batches to time")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    size = args.image_size
+    batches = [(torch.randint(0, 256, (args.batch_size, args.sar_channels, size, size), dtype=torch.uint8),
+                torch.randint(0, 256, (args.batch_size, 3, size, size), dtype=torch.uint8))
+               for _ in range(args.num_batches + 2)]
+
+    # Per-sample: paired geometry on uint8 images, then the usual normalization and a SAR-only jitter
+    geometry = v2.Compose([
+        v2.RandomHorizontalFlip(),
+        v2.RandomVerticalFlip(),
+        v2.RandomChoice([v2.RandomRotation((angle, angle)) for angle in (0, 90, 180, 270)]),
+        v2.RandomResizedCrop(size, scale=(0.64, 1.0), ratio=(1.0, 1.0), antialias=True),
+    ])
+    normalize = v2.Compose([v2.ToDtype(torch.float32, scale=True), v2.Normalize(mean=[0.5], std=[0.5])])
+    jitter = v2.ColorJitter(brightness=0.1, contrast=0.1)
+
+    def per_sample(real_images, target_images):
+        real_out, target_out = [], []
+        for s1, s2 in zip(real_images, target_images):
+            s1, s2 = geometry(tv_tensors.Image(s1), tv_tensors.Image(s2))
+            real_out.append(normalize(jitter(s1)))
+            target_out.append(normalize(s2))
+        return torch.stack(real_out).to(device), torch.stack(target_out).to(device)
+
+    # Batched: uint8 copy to the device, one normalization and one augmentation call per batch
+    batch_normalize = BatchNormalize(mean=[0.5], std=[0.5], device=device)
+    augment = PairedBatchAugment(crop_scale=(0.8, 1.0), brightness=0.1, contrast=0.1)
+
+    def batched(real_images, target_images):
+        return augment(batch_normalize(real_images), batch_normalize(target_images))
+
+    results = {
+        'per-sample': time_batches(per_sample, batches),
+        'batched': time_batches(batched, batches),
+    }
+    for name, result in results.items():
+        print(f"{name:>10}: {result:10.1f} samples/sec")
+    print(f"   speedup: {results['batched'] / results['per-sample']:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
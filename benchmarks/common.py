@@ -0,0 +1,111 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks are run from the repository root, e.g.
+    python -m benchmarks.dataset_throughput --help
+"""
+import multiprocessing as mp
+import resource
+import time
+from typing import Iterable
+
+
+def _train_steps(model_kwargs: dict, batch_size: int, image_size: int, num_steps: int, warmup: int,
+                 device: str, results: mp.Queue):
+    """Times training steps of a Pix2Pix model built from `model_kwargs`, see `measure_train_steps`."""
+    import torch
+    from src.pix2pix import Pix2Pix
+
+    torch.manual_seed(0)
+    device = torch.device(device)
+    model = Pix2Pix(**model_kwargs).to(device)
+    c_in = model_kwargs.get('c_in', 3)
+    real_images = torch.rand(batch_size, c_in, image_size, image_size, device=device) * 2 - 1
+    target_images = torch.rand(batch_size, 3, image_size, image_size, device=device) * 2 - 1
+
+    # The first steps include one-off allocations, the peak is measured from before them
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = torch.cuda.memory_allocated(device)
+    else:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kB on Linux
+    for _ in range(warmup):
+        model.train_step(real_images, target_images)
+
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        losses = model.train_step(real_images, target_images)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated(device)
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    results.put({
+        'step_ms': 1000 * elapsed / num_steps,
+        'samples_per_sec': num_steps * batch_size / elapsed,
+        'peak_mb': (peak - baseline) / 2**20,
+        'loss_G_L1': float(losses['loss_G_L1']),
+    })
+
+
+def measure_train_steps(model_kwargs: dict, batch_size: int, image_size: int = 256, num_steps: int = 10,
+                        warmup: int = 2, device: str = 'cpu') -> dict:
+    """
+    Times Pix2Pix training steps on random batches in a fresh process.
+
+    Each call runs in its own process, so the peak memory of one
+    configuration does not hide another. On CPU the peak is the growth of
+    the resident set size during the steps, on CUDA the peak of allocated
+    memory.
+
+    Args:
+        model_kwargs (dict): Arguments of `Pix2Pix`
+        batch_size (int): Batch size
+        image_size (int, optional): Side of the images. Default is 256.
+        num_steps (int, optional): Number of steps to time. Default is 10.
+        warmup (int, optional): Number of untimed steps. Default is 2.
+        device (str, optional): Device to train on. Default is 'cpu'.
+
+    Returns:
+        dict: 'step_ms', 'samples_per_sec', 'peak_mb' and the last 'loss_G_L1'
+    """
+    context = mp.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_train_steps, args=(model_kwargs, batch_size, image_size, num_steps,
+                                                         warmup, device, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def measure_throughput(loader: Iterable, num_samples: int, warmup: int = 1):
+    """
+    Iterates over `loader` until `num_samples` samples are seen and reports samples/sec.
+
+    Args:
+        loader: Iterable yielding batches whose first element is a batched tensor
+        num_samples (int): Number of samples to time
+        warmup (int, optional): Number of batches to skip before timing. Default is 1.
+
+    Returns:
+        Tuple[float, int]: (samples per second, number of samples timed)
+    """
+    seen = 0
+    start = None
+    for i, batch in enumerate(loader):
+        if i == warmup:
+            start = time.perf_counter()
+        elif i < warmup:
+            continue
+        seen += len(batch[0])
+        if seen >= num_samples:
+            break
+    if start is None or seen == 0:
+        raise ValueError("Not enough samples to time, lower `warmup` or use a larger dataset")
+    elapsed = time.perf_counter() - start
+    return seen / elapsed, seen
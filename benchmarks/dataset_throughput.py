@@ -0,0 +1,47 @@
+"""
+Compares the loading throughput of the PNG `Sentinel` dataset and the
+memory-mapped `ShardedSentinel` dataset.
+
+    python -m benchmarks.dataset_throughput --root-dir ./data/v_2/ --shard-dir ./data/v_2_shards/
+"""
+import argparse
+
+import torch
+from torch.utils.data import DataLoader
+from torchvision.transforms import v2
+
+from src.dataset import Sentinel, ShardedSentinel
+from benchmarks.common import measure_throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PNG vs. shard loading throughput.")
+    parser.add_argument("--root-dir", type=str, required=True, help="Root directory of the PNG dataset")
+    parser.add_argument("--shard-dir", type=str, required=True, help="Directory written by utils/pack_shards.py")
+    parser.add_argument("--num-samples", type=int, default=2048, help="Number of samples to time")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    # Same per-sample transforms as train.py
+    transforms = v2.Compose([
+        v2.ToImage(),
+        v2.ToDtype(torch.float32, scale=True),
+        v2.Normalize(mean=[0.5], std=[0.5]),
+    ])
+
+    datasets = {
+        'png': Sentinel(args.root_dir, input_transform=transforms),
+        'shards': ShardedSentinel(args.shard_dir, input_transform=transforms),
+    }
+    results = {}
+    for name, dataset in datasets.items():
+        loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
+        results[name], seen = measure_throughput(loader, args.num_samples)
+        print(f"{name:>8}: {results[name]:10.1f} samples/sec ({seen} samples)")
+
+    print(f" speedup: {results['shards'] / results['png']:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Compares the training step time and peak memory of Pix2Pix with the
+discriminator run once per pair and once on the stacked real and fake
+pairs (`model.fused_disc`), for the patch and pixel discriminators.
+
+Both modes compute the same losses, the fused one runs fewer, larger
+convolutions, at the cost of holding both pairs in one batch.
+
+    python -m benchmarks.fused_discriminator --device cpu --batch-size 8
+"""
+import argparse
+
+from benchmarks.common import measure_train_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark separate vs. fused discriminator passes.")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--sar-channels", type=int, default=3, choices=(1, 3))
+    parser.add_argument("--netD", type=str, nargs='+', default=['patch', 'pixel'], choices=('patch', 'pixel'))
+    parser.add_argument("--num-steps", type=int, default=10, help="Number of steps to time")
+    parser.add_argument("--warmup", type=int, default=2, help="Number of untimed steps")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    for netD in args.netD:
+        results = {}
+        for fused in (False, True):
+            name = 'fused' if fused else 'separate'
+            result = results[name] = measure_train_steps(
+                {'c_in': args.sar_channels, 'netD': netD, 'fused_disc': fused}, args.batch_size, args.image_size,
+                args.num_steps, args.warmup, args.device)
+            print(f"{netD:>5} {name:>8}: {result['step_ms']:8.1f} ms/step {result['samples_per_sec']:8.1f} samples/sec "
+                  f"{result['peak_mb']:8.1f} MB peak, L1 loss {result['loss_G_L1']:.4f}")
+
+        print(f"{netD:>5} speedup: {results['separate']['step_ms'] / results['fused']['step_ms']:8.2f}x, "
+              f"memory: {results['fused']['peak_mb'] / max(results['separate']['peak_mb'], 1e-6):.2f}x of separate")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Measures the step time and peak memory of Pix2Pix training steps over
+one effective batch split into micro-batches of decreasing size
+(`training.micro_batch_size`).
+
+The peak memory follows the micro-batch size, the step time grows with
+the extra generator forward pass replayed per micro-batch.
+
+    python -m benchmarks.micro_batching --batch-size 16 --micro-batch-sizes 16 8 4 2
+"""
+import argparse
+
+from benchmarks.common import measure_train_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gradient accumulation over micro-batches.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Effective batch size")
+    parser.add_argument("--micro-batch-sizes", type=int, nargs='+', default=[16, 8, 4, 2])
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--sar-channels", type=int, default=3, choices=(1, 3))
+    parser.add_argument("--precision", type=str, default="fp32", choices=("fp32", "bf16"))
+    parser.add_argument("--num-steps", type=int, default=5, help="Number of steps to time")
+    parser.add_argument("--warmup", type=int, default=1, help="Number of untimed steps")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    # None is the plain full-batch step, for reference
+    for micro_batch_size in [None] + args.micro_batch_sizes:
+        result = measure_train_steps(
+            {'c_in': args.sar_channels, 'precision': args.precision, 'micro_batch_size': micro_batch_size},
+            args.batch_size, args.image_size, args.num_steps, args.warmup, args.device)
+        name = 'full' if micro_batch_size is None else str(micro_batch_size)
+        print(f"micro-batch {name:>4}: {result['step_ms']:8.1f} ms/step {result['samples_per_sec']:8.1f} samples/sec "
+              f"{result['peak_mb']:8.1f} MB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Compares the training step time and peak memory of Pix2Pix in fp32 and
+bf16 (`training.precision`).
+
+bf16 only pays off on CPUs with native bfloat16 instructions
+(AVX512-BF16, AMX) and on Ampere or newer GPUs, elsewhere it is emulated
+and slower.
+
+    python -m benchmarks.precision --device cpu --batch-size 8
+"""
+import argparse
+
+from benchmarks.common import measure_train_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fp32 vs. bf16 autocast training steps.")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--sar-channels", type=int, default=3, choices=(1, 3))
+    parser.add_argument("--num-steps", type=int, default=10, help="Number of steps to time")
+    parser.add_argument("--warmup", type=int, default=2, help="Number of untimed steps")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    results = {}
+    for precision in ('fp32', 'bf16'):
+        result = results[precision] = measure_train_steps(
+            {'c_in': args.sar_channels, 'precision': precision}, args.batch_size, args.image_size,
+            args.num_steps, args.warmup, args.device)
+        print(f"{precision:>6}: {result['step_ms']:8.1f} ms/step {result['samples_per_sec']:8.1f} samples/sec "
+              f"{result['peak_mb']:8.1f} MB peak, L1 loss {result['loss_G_L1']:.4f}")
+
+    print(f"speedup: {results['fp32']['step_ms'] / results['bf16']['step_ms']:8.2f}x, "
+          f"memory: {results['bf16']['peak_mb'] / max(results['fp32']['peak_mb'], 1e-6):.2f}x of fp32")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,17 @@ Inference Script
 
 from pathlib import Path
 
+import numpy as np
 import torch
 from torchvision.transforms import v2
 
 from PIL import Image
 
 from utils.config import Config
+from utils.dataset_stats import config_normalization
+from src.dataset import open_image
 from src.pix2pix import Pix2Pix
+from src.speckle import apply_speckle_filter
 
 
 def main():
@@ -47,14 +51,17 @@ def main():
             f"A valid image file not found: {img_path}\nPlease check config.yaml"
         )
 
-    img = Image.open(img_path).convert("RGB")
+    # Single-channel models (c_in: 1) take the SAR image as is
+    img = open_image(img_path, "L" if config["model"]["c_in"] == 1 else "RGB")
+    # Same speckle filter as the training images, if any, at their native resolution
+    img = Image.fromarray(apply_speckle_filter(np.asarray(img), config["dataset"].get("speckle_filter")))
 
     transforms = v2.Compose(
         [
             v2.ToImage(),
             v2.Resize((256, 256)),
             v2.ToDtype(torch.float32, scale=True),
-            v2.Normalize(mean=[0.5], std=[0.5]),
+            v2.Normalize(*config_normalization(config)),  # dataset statistics if `dataset.stats_file` is set
         ]
     )
 
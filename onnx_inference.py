@@ -1,17 +1,44 @@
 import argparse
+import json
 import numpy as np
 import onnxruntime as ort
 from PIL import Image
 import os
 from pathlib import Path
 
+from src.speckle import apply_speckle_filter
+
+
+def input_normalization(sess):
+    """Returns the input (mean, std) stored by torch2onnx.py, as (C, 1, 1) arrays. Defaults to 0.5, 0.5."""
+    metadata = sess.get_modelmeta().custom_metadata_map
+    mean = np.array(json.loads(metadata.get("input_mean", "[0.5]")), dtype=np.float32)
+    std = np.array(json.loads(metadata.get("input_std", "[0.5]")), dtype=np.float32)
+    return mean.reshape(-1, 1, 1), std.reshape(-1, 1, 1)
+
+
+def speckle_filter(sess):
+    """Returns the speckle filter spec stored by torch2onnx.py, None if the model was trained without one."""
+    return json.loads(sess.get_modelmeta().custom_metadata_map.get("speckle_filter", "null"))
+
 
 def predict(input_image, sess):
+    # Match the channels the model was exported with, single-channel models take the SAR image as is
+    channels = sess.get_inputs()[0].shape[1]
+    input_image = input_image.convert("L" if channels == 1 else "RGB")
+    input_mean, input_std = input_normalization(sess)
+
+    # Same filter as the training images, at their native resolution
+    input_image = Image.fromarray(apply_speckle_filter(np.array(input_image), speckle_filter(sess)))
+
     # Preprocess the input image (e.g., resize, normalize)
     input_image = input_image.resize((256, 256))  # Adjust size as needed
-    input_image = np.array(input_image).transpose(2, 0, 1)  # HWC to CHW
+    input_image = np.array(input_image)
+    if input_image.ndim == 2:
+        input_image = input_image[..., None]  # HW to HWC
+    input_image = input_image.transpose(2, 0, 1)  # HWC to CHW
     input_image = input_image.astype(np.float32) / 255.0  # Normalize to [0,1]
-    input_image = (input_image - 0.5) / 0.5  # Normalize to [-1,1]
+    input_image = (input_image - input_mean) / input_std  # Normalize to [-1,1], or with the dataset statistics
     input_image = np.expand_dims(input_image, axis=0)  # Add batch dimension
 
     # Run the model
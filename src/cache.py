@@ -0,0 +1,127 @@
+import math
+import multiprocessing
+from typing import Optional, Sequence, Tuple
+
+import torch
+
+
+class SharedSampleCache:
+    """
+    A fixed-budget cache of decoded uint8 image pairs shared by all DataLoader workers.
+
+    The arena and its bookkeeping live in shared-memory tensors, so every
+    worker (forked or spawned) reads and fills the same cache. The arena is
+    divided into equally sized slots, one per image pair, and the least
+    recently used slot is evicted when the byte budget is exhausted.
+    Hit/miss/eviction counters are shared as well, so the main process can
+    report them.
+
+    Note:
+        Shared memory is backed by ``/dev/shm``; containers often limit it
+        (e.g. docker's ``--shm-size``), so keep the budget below that limit.
+
+    Args:
+        num_samples (int): Number of samples that can be cached, keys are in [0, num_samples)
+        budget_bytes (int): Size of the arena in bytes
+        shapes (Sequence[Tuple[int, ...]]): Shapes of the (SAR, optical) uint8 tensors of a sample
+        mp_context (optional): multiprocessing context the DataLoader uses. Default is the default context.
+    """
+    # indices into the `counters` tensor
+    HITS, MISSES, EVICTIONS, CLOCK, USED = range(5)
+
+    def __init__(self,
+                 num_samples: int,
+                 budget_bytes: int,
+                 shapes: Sequence[Tuple[int, ...]],
+                 mp_context=None):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.numels = [math.prod(shape) for shape in self.shapes]
+        slot_bytes = sum(self.numels)
+        self.num_slots = min(budget_bytes // slot_bytes, num_samples)
+        if self.num_slots < 1:
+            raise ValueError(f"Cache budget of {budget_bytes} bytes cannot hold a single sample of {slot_bytes} bytes")
+
+        self.arena = torch.empty((self.num_slots, slot_bytes), dtype=torch.uint8).share_memory_()
+        self.slot_key = torch.full((self.num_slots,), -1, dtype=torch.int64).share_memory_() # sample id of each slot
+        self.slot_tick = torch.zeros(self.num_slots, dtype=torch.int64).share_memory_() # last access of each slot
+        self.key_slot = torch.full((num_samples,), -1, dtype=torch.int64).share_memory_() # slot of each sample id
+        self.counters = torch.zeros(5, dtype=torch.int64).share_memory_()
+
+        mp_context = mp_context if mp_context else multiprocessing
+        self.lock = mp_context.Lock()
+
+    def _split(self, buffer: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Splits a flat slot buffer into the (SAR, optical) tensors."""
+        s1_image, s2_image = buffer.split(self.numels)
+        return s1_image.view(self.shapes[0]), s2_image.view(self.shapes[1])
+
+    def get(self, key: int) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Returns a copy of the cached pair for `key`, or None on a miss.
+
+        Args:
+            key (int): Sample id
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor] | None: uint8 (SAR image, optical image) pair
+        """
+        with self.lock:
+            slot = int(self.key_slot[key])
+            if slot < 0:
+                self.counters[self.MISSES] += 1
+                return None
+            self.counters[self.HITS] += 1
+            self.counters[self.CLOCK] += 1
+            self.slot_tick[slot] = self.counters[self.CLOCK]
+            # copy while holding the lock, the slot may be evicted right after
+            buffer = self.arena[slot].clone()
+        return self._split(buffer)
+
+    def put(self, key: int, s1_image: torch.Tensor, s2_image: torch.Tensor):
+        """
+        Stores a decoded pair, evicting the least recently used pair if the cache is full.
+        Pairs whose shapes differ from the cache's slot shapes are not cached.
+
+        Args:
+            key (int): Sample id
+            s1_image (torch.Tensor): uint8 SAR image
+            s2_image (torch.Tensor): uint8 optical image
+        """
+        if [tuple(s1_image.shape), tuple(s2_image.shape)] != self.shapes:
+            return
+
+        with self.lock:
+            if self.key_slot[key] >= 0: # filled by another worker meanwhile
+                return
+            used = int(self.counters[self.USED])
+            if used < self.num_slots:
+                slot = used
+                self.counters[self.USED] += 1
+            else:
+                slot = int(torch.argmin(self.slot_tick))
+                self.key_slot[self.slot_key[slot]] = -1
+                self.counters[self.EVICTIONS] += 1
+
+            s1_slot, s2_slot = self._split(self.arena[slot])
+            s1_slot.copy_(s1_image)
+            s2_slot.copy_(s2_image)
+            self.counters[self.CLOCK] += 1
+            self.slot_tick[slot] = self.counters[self.CLOCK]
+            self.slot_key[slot] = key
+            self.key_slot[key] = slot
+
+    def stats(self) -> dict:
+        """Returns the cache counters since the last `reset_stats` call."""
+        hits, misses, evictions, _, used = self.counters.tolist()
+        return {
+            'cache_hits': hits,
+            'cache_misses': misses,
+            'cache_evictions': evictions,
+            'cache_hit_rate': hits / max(hits + misses, 1),
+            'cache_fill': used / self.num_slots,
+        }
+
+    def reset_stats(self):
+        """Resets the hit/miss/eviction counters, cached samples are kept."""
+        with self.lock:
+            self.counters[[self.HITS, self.MISSES, self.EVICTIONS]] = 0
@@ -0,0 +1,138 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+CATALOG_VERSION = 1
+
+
+def sar_to_optical_name(s1_name: str) -> str:
+    """
+    Converts a SAR (s1) filename to the filename of its optical (s2) counterpart.
+    e.g. 'ROIs1970_fall_s1_13_p265.png' -> 'ROIs1970_fall_s2_13_p265.png'
+    """
+    s2_name = s1_name.split('_')
+    s2_name[2] = 's2'
+    return '_'.join(s2_name)
+
+
+class PairCatalog:
+    """
+    A persistent catalog of the Sentinel-1&2 image pairs of a dataset.
+
+    The catalog is stored next to the dataset and holds, per category, the
+    modification times of its ``s1``/``s2`` directories and the paired files
+    with their sizes and modification times. On `refresh`, only categories
+    whose directories changed are rescanned, so building the pair list of a
+    large dataset costs a few `stat` calls instead of a filesystem walk.
+
+    Note:
+        Directory modification times change when files are added, removed or
+        renamed, not when a file is rewritten in place. Use ``force=True`` to
+        pick up in-place edits.
+
+    Args:
+        root_dir (str | Path): Dataset root directory (see `Sentinel`)
+        catalog_file (str | Path, optional): Where to store the catalog. Defaults to
+            ``root_dir/.sentinel_catalog.json``
+
+    Attributes:
+        records (List[Tuple]): (SAR path, optical path, category, SAR size, SAR mtime,
+            optical size, optical mtime) per pair; paths are POSIX-style and relative to `root_dir`
+    """
+    FILE_NAME = '.sentinel_catalog.json'
+
+    def __init__(self, root_dir: Union[str, Path], catalog_file: Optional[Union[str, Path]] = None):
+        self.root_dir = Path(root_dir)
+        self.catalog_file = Path(catalog_file) if catalog_file else self.root_dir / self.FILE_NAME
+        self._categories: Dict[str, dict] = {}
+        self.records: List[Tuple] = []
+
+        if self.catalog_file.exists():
+            try:
+                with open(self.catalog_file, 'r') as f:
+                    content = json.load(f)
+                if content.get('version') == CATALOG_VERSION:
+                    self._categories = content['categories']
+            except (OSError, ValueError) as e:
+                print(f'Could not read catalog, rebuilding it\n\t{e}')
+
+    @staticmethod
+    def _scan_category(category: Path) -> List[list]:
+        """Collects the pairs of a category, same rules as `Sentinel._collect_images`."""
+        s1_path = category / 's1'
+        s2_path = category / 's2'
+        pairs = []
+        for s1_file in s1_path.glob('*.png'):
+            s2_name = sar_to_optical_name(s1_file.name)
+            try:
+                s1_stat = s1_file.stat()
+                s2_stat = (s2_path / s2_name).stat()
+            except FileNotFoundError: # missing optical image
+                continue
+            pairs.append([s1_file.name, s2_name,
+                          s1_stat.st_size, s1_stat.st_mtime_ns,
+                          s2_stat.st_size, s2_stat.st_mtime_ns])
+        return pairs
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Brings the catalog up to date with the dataset directory and saves it if it changed.
+
+        Args:
+            force (bool, optional): Rescan every category. Default is False.
+
+        Returns:
+            bool: True if any category was rescanned or removed
+        """
+        categories = {}
+        changed = False
+        for category in self.root_dir.iterdir():
+            try:
+                s1_mtime = (category / 's1').stat().st_mtime_ns
+                s2_mtime = (category / 's2').stat().st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError): # not a category directory
+                continue
+
+            cached = self._categories.get(category.name)
+            if not force and cached and cached['s1_mtime'] == s1_mtime and cached['s2_mtime'] == s2_mtime:
+                categories[category.name] = cached
+            else:
+                categories[category.name] = {
+                    's1_mtime': s1_mtime,
+                    's2_mtime': s2_mtime,
+                    'pairs': self._scan_category(category),
+                }
+                changed = True
+
+        changed = changed or categories.keys() != self._categories.keys()
+        self._categories = categories
+        # Sorted by SAR path, the directory listing order is arbitrary
+        self.records = sorted(
+            (f'{name}/s1/{s1_name}', f'{name}/s2/{s2_name}', name, *stats)
+            for name, content in categories.items()
+            for s1_name, s2_name, *stats in content['pairs']
+        )
+        if changed:
+            self.save()
+        return changed
+
+    def save(self):
+        """Writes the catalog atomically. Read-only datasets simply keep an in-memory catalog."""
+        tmp_file = self.catalog_file.with_name(f'{self.catalog_file.name}.{os.getpid()}.tmp')
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'version': CATALOG_VERSION, 'categories': self._categories}, f)
+            os.replace(tmp_file, self.catalog_file)
+        except OSError as e:
+            print(f'Could not save catalog to {self.catalog_file}\n\t{e}')
+
+    @property
+    def pairs(self) -> List[Tuple[str, str]]:
+        """(SAR path, optical path) pairs, relative to `root_dir`."""
+        return [record[:2] for record in self.records]
+
+    @property
+    def categories(self) -> List[str]:
+        """Category of every pair."""
+        return [record[2] for record in self.records]
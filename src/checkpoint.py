@@ -0,0 +1,121 @@
+"""
+Training checkpoints written in the background.
+
+`AsyncCheckpointer.save` copies the state to CPU memory, which is all the
+training loop waits for, then a background thread serializes the copy.
+Every file is written under a temporary name and renamed once complete,
+so an interrupted run never leaves a truncated checkpoint behind.
+"""
+import copy
+import os
+import queue
+import random
+import threading
+from pathlib import Path
+from typing import Dict, Union
+
+import numpy as np
+import torch
+
+
+def snapshot(state):
+    """Copies a nested state (dicts, lists, tuples of tensors and Python objects) to CPU memory."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return copy.deepcopy(state) # numpy arrays, generator states, ...
+
+
+def rng_state() -> dict:
+    """Returns the state of the Python, numpy, torch and CUDA random generators of the process."""
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(state: dict):
+    """Restores a state returned by `rng_state`."""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def atomic_save(state, path: Union[str, Path]):
+    """Saves `state` with `torch.save` to a temporary file, then renames it to `path`."""
+    path = Path(path)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno()) # on disk before it replaces the previous file
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints in a background thread.
+
+    A checkpoint is a set of files (e.g. generator, discriminator and
+    training state) saved together. `save` snapshots them to CPU memory and
+    returns, the thread writes them with `atomic_save`. At most one
+    checkpoint is in flight: saving the next one first waits for the
+    previous one, which bounds the extra memory to one copy of the state.
+    Write errors are raised by the next `save`, `wait` or `close`.
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            files = self._queue.get()
+            if files is None:
+                self._queue.task_done()
+                return
+            try:
+                for path, state in files.items():
+                    atomic_save(state, path)
+            except Exception as e: # re-raised in the training loop
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
+
+    def save(self, files: Dict[Union[str, Path], dict]):
+        """
+        Snapshots the states of a checkpoint and writes them in the background.
+
+        Args:
+            files (Dict[str | Path, dict]): State to save to every file of the checkpoint
+        """
+        self.wait()
+        self._queue.put({Path(path): snapshot(state) for path, state in files.items()})
+
+    def wait(self):
+        """Blocks until the pending checkpoint is written."""
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        """Writes the pending checkpoint and stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise()
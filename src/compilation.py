@@ -0,0 +1,107 @@
+"""
+Compilation of the Pix2Pix training step with `torch.compile`.
+
+`compile_train_step` compiles the parts of `Pix2Pix.train_step` doing the
+work: the generator forward pass, the discriminator and generator losses
+(with their discriminator passes), the backward graphs of both, and both
+Adam updates. The method itself stays eager: its fakes feed the
+discriminator update, then the generator update after a discriminator
+step, which one compiled autograd graph cannot express (the discriminator
+backward would free the generator graph the generator backward needs).
+
+Compiled kernels are cached on disk, in a directory keyed by the model
+settings and the torch version (see `enable_compile_cache`), so a
+restarted run loads them instead of compiling again.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import torch
+import torch._dynamo
+import torch._functorch.config
+import torch._inductor.config
+from torch._dynamo.utils import counters
+
+
+def compile_cache_key(settings: dict) -> str:
+    """Returns a key of the model settings and the torch version, for the compile cache."""
+    key = json.dumps({'settings': settings, 'torch': torch.__version__}, sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def enable_compile_cache(cache_dir: Union[str, Path], settings: dict) -> Path:
+    """
+    Persists the compiled kernels in a subdirectory of `cache_dir` keyed by `settings` and the torch version.
+
+    Must be called before anything is compiled. Runs with other settings or
+    another torch version use their own subdirectory, stale kernels are
+    never loaded.
+
+    Args:
+        cache_dir (str | Path): Root directory of the compile caches
+        settings (dict): Settings the compiled graphs depend on, e.g. the model config
+
+    Returns:
+        Path: Cache directory of these settings
+    """
+    path = Path(cache_dir) / compile_cache_key(settings)
+    path.mkdir(parents=True, exist_ok=True)
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = str(path.resolve()) # read by inductor at every lookup
+    torch._inductor.config.fx_graph_cache = True # forward and backward kernels
+    torch._functorch.config.enable_autograd_cache = True # joint forward-backward graphs
+    return path
+
+
+def compile_report() -> dict:
+    """Returns the graphs compiled so far, the reasons of the graph breaks and the compile cache hits and misses."""
+    return {
+        'graphs': counters['stats']['unique_graphs'],
+        'graph_breaks': dict(counters['graph_break']),
+        'cache_hits': counters['inductor']['fxgraph_cache_hit'],
+        'cache_misses': counters['inductor']['fxgraph_cache_miss'],
+    }
+
+
+def compile_train_step(model: torch.nn.Module, mode: Optional[str] = None,
+                       on_compiled: Optional[Callable[[float], None]] = None) -> bool:
+    """
+    Compiles the training step of a Pix2Pix model in place.
+
+    Compilation happens on the first training step. A part that fails to
+    compile runs eagerly instead of stopping the training, with a warning
+    from torch.
+
+    Args:
+        model (nn.Module): Pix2Pix model in training mode
+        mode (str, optional): `torch.compile` mode, e.g. 'max-autotune'. Default is None.
+        on_compiled (Callable[[float], None], optional): Called with the duration of the first
+            training step, which includes compiling, e.g. to log `compile_report()`. Default is None.
+
+    Returns:
+        bool: False if torch cannot compile on this platform, the model is left eager
+    """
+    if not torch._dynamo.is_dynamo_supported():
+        return False
+    torch._dynamo.config.suppress_errors = True # eager fallback per compiled function
+
+    model.gen.compile(mode=mode)
+    model.step_discriminator = torch.compile(model.step_discriminator, mode=mode)
+    model.step_generator = torch.compile(model.step_generator, mode=mode)
+    for optimizer in (model.gen_optimizer, model.disc_optimizer):
+        # A single fused update of all the parameters, the step hooks still run
+        optimizer.step = torch.compile(optimizer.step, mode=mode)
+
+    if on_compiled is not None:
+        train_step = model.train_step
+        def first_train_step(*args, **kwargs):
+            del model.train_step # the next steps call the method directly
+            start = time.perf_counter()
+            losses = train_step(*args, **kwargs)
+            on_compiled(time.perf_counter() - start)
+            return losses
+        model.train_step = first_train_step
+    return True
@@ -2,12 +2,49 @@ import json
 import random
 from pathlib import Path
 from enum import Enum
-from typing import Tuple, List, Optional, Callable, Union, Literal
+from typing import Tuple, List, Optional, Callable, Union, Literal, Dict
 
+import numpy as np
 import torch
 from PIL import Image
 from torch.utils.data import Dataset
 from torchvision.transforms import v2
+from torchvision.transforms.v2 import functional as F
+
+from .cache import SharedSampleCache
+from .catalog import PairCatalog, sar_to_optical_name
+from .speckle import filter_tag, filtered_path
+
+
+# PIL modes of single-channel 16-bit images, PNGs open as 'I;16' or, with older Pillow versions, 'I'
+SIXTEEN_BIT_MODES = ('I', 'I;16', 'I;16L', 'I;16B', 'I;16N')
+GRAYSCALE_MODES = ('1', 'L', 'P', 'F', *SIXTEEN_BIT_MODES)
+
+
+def open_image(source, mode: Optional[str] = None) -> Image.Image:
+    """
+    Decodes an image to 8 bits per channel.
+
+    PIL clips 16-bit pixels to 255 when converting them to 'L', so 16-bit
+    images are rescaled from [0, 65535] to [0, 255] instead. Float images
+    have no known range and are rejected.
+
+    Args:
+        source: Path or file object of the image
+        mode (str, optional): 'L' or 'RGB'. Defaults to 'L' for single-channel images and 'RGB' otherwise.
+
+    Returns:
+        Image.Image: The decoded image, in `mode`
+    """
+    with Image.open(source) as image:
+        if mode is None:
+            mode = 'L' if image.mode in GRAYSCALE_MODES else 'RGB'
+        if image.mode == 'F':
+            raise ValueError("Float images are not supported, write them as 8 or 16-bit PNGs")
+        if image.mode in SIXTEEN_BIT_MODES:
+            pixels = np.clip(np.asarray(image, dtype=np.float64), 0, 65535) / 257 # 65535 / 255
+            image = Image.fromarray(np.round(pixels).astype(np.uint8))
+        return image.convert(mode)
 
 
 class SplitType(Enum):
@@ -17,6 +54,96 @@ class SplitType(Enum):
     TEST = 'test'
 
 
+def random_split_indices(num_samples: int,
+                         split_ratio: Tuple[float, float, float],
+                         seed: int,
+                         split_type: SplitType) -> List[int]:
+    """
+    Randomly splits the sample indices according to the given ratios.
+
+    Args:
+        num_samples: Number of samples to split
+        split_ratio: Tuple of (train, val, test) ratios
+        seed: Random seed for reproducibility
+        split_type: Which split to return
+
+    Returns:
+        List[int]: Indices of the samples in the split
+    """
+    if sum(split_ratio) != 1:
+        raise ValueError("Split ratios must sum to 1")
+    
+    # Shuffle indices, a dedicated generator gives the same order as seeding `random`
+    indices = list(range(num_samples))
+    random.Random(seed).shuffle(indices)
+    
+    # Calculate split points
+    train_end = int(len(indices) * split_ratio[0])
+    val_end = train_end + int(len(indices) * split_ratio[1])
+    
+    # Select appropriate slice based on split type
+    if split_type == SplitType.TRAIN:
+        return indices[:train_end]
+    elif split_type == SplitType.VAL:
+        return indices[train_end:val_end]
+    else:  # TEST
+        return indices[val_end:]
+
+
+def read_split(split_file: Union[str, Path], split_type: SplitType) -> set:
+    """
+    Reads the relative image paths of a split from a JSON split file.
+
+    Args:
+        split_file: Path to JSON file containing split definitions
+        split_type: Which split to read
+
+    Returns:
+        set: Relative paths (with '/' separators) of the images in the split
+    """
+    with open(split_file, 'r') as f: # get the split content
+        splits = json.load(f)
+        
+    if split_type.value not in splits['data']: # check if it helds
+        raise ValueError(f"Split type {split_type.value} not found in split file")
+    
+    # split files may use either separator
+    return {name.replace('\\', '/') for name in splits['data'][split_type.value]} # data['split']
+
+
+def write_split(output_file: Union[str, Path], split_type: SplitType, names: List[str], is_exists: bool = False):
+    """
+    Writes the relative image paths of a split to a JSON split file.
+
+    Args:
+        output_file: Path to save the split configuration
+        split_type: Which split the names belong to
+        names: Relative paths of the images in the split
+        is_exists: If file exist, add new split data
+    """
+    split = split_type.value
+    split_info = {
+        'data' : {
+            split: names
+        }
+    }
+    # Check if the file exists
+    if is_exists and Path(output_file).exists():
+        # Read the existing content
+        with open(output_file, 'r') as f:
+            existing_data = json.load(f)
+        # Check if 'data' is already in the existing content, if not, create it
+        if 'data' not in existing_data:
+            existing_data['data'] = {}
+        
+        # Add or update the split information
+        existing_data['data'][split] = split_info['data'][split]
+        split_info = existing_data
+    
+    with open(output_file, 'w') as f:
+        json.dump(split_info, f, indent=2)
+
+
 class Sentinel(Dataset):
     """
     A PyTorch Dataset for handling Sentinel-1&2 Image Pairs.
@@ -48,11 +175,22 @@ class Sentinel(Dataset):
         split_ratio (Tuple[float, float, float], optional): Ratio for train/val/test splits
         split_file (str | Path, optional): predefined the splits
         seed (int, optional): Random seed for reproducible splitting
+        cache_bytes (int, optional): Budget of the shared-memory decoded-sample cache, 0 disables it
+        use_catalog (bool, optional): Collect the pairs from a persistent `PairCatalog` stored
+            in `root_dir`, only changed categories are rescanned
+        sar_channels (int, optional): Channels of the decoded SAR images, 1 keeps Sentinel-1 single-channel
+            instead of replicating it to RGB. Default is 3.
+        return_index (bool, optional): Also return the sample index, e.g. to record per-sample
+            losses (see `SampleLossTable`). Default is False.
+        speckle_filter (dict, optional): Speckle filter spec (see `src.speckle`), the SAR images are
+            read from the ``s1_<tag>`` directories written by ``utils/speckle_filter.py``
         
     Attributes:
         root_dir (Path): Path to the dataset root directory
         transform (callable): Transform pipeline for the images
         image_pairs (List[Tuple[Path, Path]]): List of paired image paths (SAR, optical)
+        all_pair_keys (List[Tuple[str, str]]): (SAR, optical) paths of `all_image_pairs`, relative to `root_dir`
+        cache (SharedSampleCache | None): Decoded-sample cache shared by the DataLoader workers
     """
     def __init__(self,
                  root_dir: Union[str, Path],
@@ -62,13 +200,23 @@ class Sentinel(Dataset):
                  split_mode: Literal['random', 'split'] = 'random',
                  split_ratio: Tuple[float, float, float] = (0.7, 0.15, 0.15),
                  split_file: Optional[Union[str, Path]] = None,
-                 seed: int = 42):
+                 seed: int = 42,
+                 cache_bytes: int = 0,
+                 use_catalog: bool = False,
+                 sar_channels: int = 3,
+                 return_index: bool = False,
+                 speckle_filter: Optional[dict] = None):
         self.root_dir = Path(root_dir)
         if not self.root_dir.exists():
             raise FileNotFoundError(f"Dataset root directory not found: {self.root_dir}")
         
         # Convert string split_type to enum if provided
         self.split_type = SplitType(split_type) if split_type else None
+        if sar_channels not in (1, 3):
+            raise ValueError(f"SAR images can be decoded to 1 or 3 channels, got {sar_channels}")
+        self.sar_channels = sar_channels
+        self.return_index = return_index
+        self.speckle_filter = speckle_filter
 
         # Default transform pipeline
         self.input_transform = input_transform if input_transform else v2.Compose([
@@ -78,6 +226,8 @@ class Sentinel(Dataset):
         self.target_transform = target_transform if target_transform else self.input_transform
 
         # Collect image pairs
+        self.use_catalog = use_catalog
+        self.catalog = None
         self.all_image_pairs = self._collect_images()
 
         # Apply split if specified
@@ -92,6 +242,16 @@ class Sentinel(Dataset):
             # If no split type specified, use all images
             self.image_pairs = self.all_image_pairs
 
+        if self.speckle_filter and self.image_pairs and not self._sar_path(0).exists():
+            raise FileNotFoundError(f"Speckle-filtered image not found: {self._sar_path(0)}\n"
+                                    f"Please run utils/speckle_filter.py for s1_{filter_tag(self.speckle_filter)}")
+
+        # The cache is created before the DataLoader starts its workers, so they all share it
+        self.cache = None
+        if cache_bytes and len(self):
+            shapes = [image.shape for image in self._load_pair(0)]
+            self.cache = SharedSampleCache(len(self), cache_bytes, shapes)
+
         print(f'Total image pairs found: {len(self)}')
 
     def _collect_images(self) -> List[Tuple[Path, Path]]:
@@ -101,7 +261,14 @@ class Sentinel(Dataset):
         Returns:
             List[Tuple[Path, Path]]: List of (SAR image path, optical image path) pairs
         """
+        if self.use_catalog:
+            self.catalog = PairCatalog(self.root_dir)
+            self.catalog.refresh()
+            self.all_pair_keys = self.catalog.pairs
+            return [(self.root_dir / s1, self.root_dir / s2) for s1, s2 in self.all_pair_keys]
+
         image_pairs = []
+        self.all_pair_keys = []
         
         # Iterate through category subdirectories
         for category in self.root_dir.iterdir():
@@ -120,17 +287,20 @@ class Sentinel(Dataset):
             for s1_file in s1_path.glob('*.png'):
                 # Convert SAR filename to optical filename
                 # e.g. 'ROIs1970_fall_s1_13_p265.png' -> 'ROIs1970_fall_s2_13_p265.png'
-                s2_filename = list(s1_file.name.split('_'))
-                s2_filename[2] = 's2'
-                s2_file = s2_path / '_'.join(s2_filename)
+                s2_file = s2_path / sar_to_optical_name(s1_file.name)
 
                 if not s2_file.exists():
                     # print(f"Missing optical image for SAR image: {s1_file.name} - {s2_file.name}")
                     continue
 
                 image_pairs.append((s1_file, s2_file))
-        
-        return image_pairs
+                self.all_pair_keys.append((f'{category.name}/s1/{s1_file.name}', f'{category.name}/s2/{s2_file.name}'))
+
+        # Sorted by SAR key, so random splits do not depend on the directory listing order
+        # and select the same pairs as `PairCatalog` and `StreamingSentinel`
+        order = sorted(range(len(image_pairs)), key=lambda i: self.all_pair_keys[i][0])
+        self.all_pair_keys = [self.all_pair_keys[i] for i in order]
+        return [image_pairs[i] for i in order]
     
     def _apply_predefined_split(self, split_file: Union[str, Path]) -> List[Tuple[Path, Path]]:
         """
@@ -143,15 +313,10 @@ class Sentinel(Dataset):
             List[Tuple[Path, Path]]: Image pairs for the specified split
         """
         try:
-            with open(split_file, 'r') as f: # get the split content
-                splits = json.load(f)
-                
-            if self.split_type.value not in splits['data']: # check if it helds
-                raise ValueError(f"Split type {self.split_type.value} not found in split file")
-            
-            split_filenames = set(splits['data'][self.split_type.value]) # data['split']
-            return [pair for pair in self.all_image_pairs # collect and return split
-                if any(str(p.relative_to(self.root_dir)) in split_filenames for p in pair[:2])]
+            # Hashed lookup of the precomputed relative paths
+            split_filenames = read_split(split_file, self.split_type)
+            return [pair for pair, keys in zip(self.all_image_pairs, self.all_pair_keys) # collect and return split
+                if keys[0] in split_filenames or keys[1] in split_filenames]
         except Exception as e:
             print(f'Could not open split file\n\t{e}')
             raise
@@ -171,28 +336,7 @@ class Sentinel(Dataset):
         Returns:
             List[Tuple[Path, Path]]: Image pairs for the specified split
         """
-        if sum(split_ratio) != 1:
-            raise ValueError("Split ratios must sum to 1")
-        
-        # Set random seed for reproducibility
-        random.seed(seed)
-        
-        # Shuffle indices
-        indices = list(range(len(self.all_image_pairs)))
-        random.shuffle(indices)
-        
-        # Calculate split points
-        train_end = int(len(indices) * split_ratio[0])
-        val_end = train_end + int(len(indices) * split_ratio[1])
-        
-        # Select appropriate slice based on split type
-        if self.split_type == SplitType.TRAIN:
-            split_indices = indices[:train_end]
-        elif self.split_type == SplitType.VAL:
-            split_indices = indices[train_end:val_end]
-        else:  # TEST
-            split_indices = indices[val_end:]
-            
+        split_indices = random_split_indices(len(self.all_image_pairs), split_ratio, seed, self.split_type)
         return [self.all_image_pairs[i] for i in split_indices]
     
     def save_split(self, output_file: Union[str, Path], is_exists: bool = False):
@@ -204,32 +348,48 @@ class Sentinel(Dataset):
             is_exists: If file exist, add new split data
         """
         if self.split_type:
-            split = self.split_type.value
-            split_info = {
-                'data' : {
-                    split: [str(p[0].relative_to(self.root_dir)) for p in self.image_pairs]
-                }
-            }
-            # Check if the file exists
-            if is_exists and Path(output_file).exists():
-                # Read the existing content
-                with open(output_file, 'r') as f:
-                    existing_data = json.load(f)
-                # Check if 'data' is already in the existing content, if not, create it
-                if 'data' not in existing_data:
-                    existing_data['data'] = {}
-                
-                # Add or update the split information
-                existing_data['data'][split] = split_info['data'][split]
-                split_info = existing_data
-            
-            with open(output_file, 'w') as f:
-                json.dump(split_info, f, indent=2)
+            write_split(output_file, self.split_type,
+                        [str(p[0].relative_to(self.root_dir)) for p in self.image_pairs], is_exists)
     
+    def categories(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Returns the category names and the category id of every image pair.
+
+        Returns:
+            Tuple[List[str], np.ndarray]: Sorted category names and one id (index into the names) per pair
+        """
+        names = [s1_path.parent.parent.name for s1_path, _ in self.image_pairs]
+        categories = sorted(set(names))
+        lookup = {name: i for i, name in enumerate(categories)}
+        return categories, np.fromiter((lookup[name] for name in names), dtype=np.int64, count=len(names))
+
     def __len__(self):
         """Returns the total number of image pairs in the dataset."""
         return len(self.image_pairs)
     
+    def _sar_path(self, idx: int) -> Path:
+        """Returns the SAR image to read for a sample, its speckle-filtered variant if enabled."""
+        s1_path = self.image_pairs[idx][0]
+        return filtered_path(s1_path, self.speckle_filter) if self.speckle_filter else s1_path
+
+    def _load_pair(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Decodes the image pair at the given index.
+
+        Args:
+            idx (int): Index of the image pair to decode
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: uint8 (C, H, W) (SAR image, optical image) pair
+        """
+        # Get paths for SAR and optical images
+        s1_path, s2_path = self._sar_path(idx), self.image_pairs[idx][1]
+
+        # Load images
+        s1_image = F.pil_to_tensor(open_image(s1_path, 'L' if self.sar_channels == 1 else 'RGB'))
+        s2_image = F.pil_to_tensor(open_image(s2_path, 'RGB'))
+        return s1_image, s2_image
+
     def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
         """
         Retrieves the image pair at the given index.
@@ -238,17 +398,100 @@ class Sentinel(Dataset):
             idx (int): Index of the image pair to retrieve
             
         Returns:
-            Tuple[torch.Tensor, torch.Tensor]: Processed (SAR image, optical image) pair
+            Tuple[torch.Tensor, torch.Tensor]: Processed (SAR image, optical image) pair,
+                followed by `idx` if `return_index` is set
         """
-        # Get paths for SAR and optical images
-        s1_path, s2_path = self.image_pairs[idx]
-        
-        # Load images
-        s1_image = Image.open(s1_path).convert('RGB')
-        s2_image = Image.open(s2_path).convert('RGB')
+        pair = self.cache.get(idx) if self.cache is not None else None
+        if pair is None:
+            pair = self._load_pair(idx)
+            if self.cache is not None:
+                self.cache.put(idx, *pair)
+        s1_image, s2_image = pair
         
         # Apply transforms
         s1_image = self.input_transform(s1_image)
         s2_image = self.target_transform(s2_image)
         
-        return s1_image, s2_image
\ No newline at end of file
+        if self.return_index:
+            return s1_image, s2_image, idx
+        return s1_image, s2_image
+
+
+class ShardedSentinel(Sentinel):
+    """
+    A `Sentinel` dataset that reads image pairs from packed uint8 shards.
+
+    Shards are written once by ``utils/pack_shards.py`` and hold the decoded
+    pairs as fixed-shape (N, H, W, C) uint8 arrays. They are memory-mapped
+    lazily in every process, so retrieving a sample is a zero-copy slice
+    instead of two PNG decodes. The layout is:
+    shard_dir/
+        index.json
+        s1_00000.npy
+        s2_00000.npy
+        ...
+
+    ``index.json`` keeps the pair paths relative to the original ``root_dir``,
+    so split files written by `Sentinel.save_split` work with both classes.
+
+    Args:
+        shard_dir (str | Path): Directory written by ``utils/pack_shards.py``
+        **kwargs: Same arguments as `Sentinel`, except ``root_dir``
+    """
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, shard_dir: Union[str, Path], **kwargs):
+        shard_dir = Path(shard_dir)
+        index_file = shard_dir / self.INDEX_FILE
+        if not index_file.exists():
+            raise FileNotFoundError(f"Shard index not found: {index_file}\nPlease run utils/pack_shards.py first")
+
+        with open(index_file, 'r') as f:
+            self.index = json.load(f)
+
+        self._arrays: Dict[Tuple[str, int], np.ndarray] = {} # opened lazily, per process
+        self._rows: Optional[List[int]] = None # shard position of every selected pair, see `_load_pair`
+        packed_channels = self.index['shape']['s1'][-1]
+        if kwargs.setdefault('sar_channels', packed_channels) != packed_channels:
+            raise ValueError(f"Shards hold {packed_channels}-channel SAR images, repack them with "
+                             f"--sar-channels {kwargs['sar_channels']}")
+        # The shards already hold the filtered images if they were packed with a speckle filter
+        packed_filter = self.index.get('speckle_filter')
+        if (kwargs.pop('speckle_filter', None) or None) != packed_filter:
+            raise ValueError(f"Shards were packed with speckle filter {packed_filter}, "
+                             f"set dataset.speckle_filter accordingly or repack them")
+        super().__init__(root_dir=shard_dir, **kwargs)
+
+    def _collect_images(self) -> List[Tuple[Path, Path]]:
+        """
+        Collects the image pairs from the shard index.
+
+        Returns:
+            List[Tuple[Path, Path]]: List of (SAR image path, optical image path) pairs
+        """
+        self.all_pair_keys = [(s1, s2) for s1, s2, _ in self.index['pairs']]
+        image_pairs = [(self.root_dir / s1, self.root_dir / s2) for s1, s2 in self.all_pair_keys]
+        self._pair_ids = {s1_path: i for i, (s1_path, _) in enumerate(image_pairs)}
+        return image_pairs
+
+    def _array(self, modality: str, shard: int) -> np.ndarray:
+        """Returns the memory-mapped array of a shard, opening it on first use."""
+        key = (modality, shard)
+        if key not in self._arrays:
+            # Copy-on-write keeps the pages shared while giving writable (warning free) tensors
+            self._arrays[key] = np.load(self.root_dir / self.index['shards'][shard][modality], mmap_mode='c')
+        return self._arrays[key]
+
+    def _load_pair(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self._rows is None: # built on first use, the sample cache loads a pair before __init__ returns
+            self._rows = [self._pair_ids[s1_path] for s1_path, _ in self.image_pairs]
+        shard, row = divmod(self._rows[idx], self.index['shard_size'])
+        s1_image = torch.from_numpy(self._array('s1', shard)[row]).permute(2, 0, 1) # HWC -> CHW
+        s2_image = torch.from_numpy(self._array('s2', shard)[row]).permute(2, 0, 1)
+        return s1_image, s2_image
+
+    def __getstate__(self):
+        # Memory maps are reopened in each DataLoader worker instead of being pickled
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
@@ -0,0 +1,316 @@
+"""
+Multi-process data-parallel training, on CPUs with the gloo backend.
+
+Every rank holds a full copy of the model and trains on its shard of each
+batch. `GradientBucketer` averages the gradients of a network across the
+ranks before its optimizer steps, and `SyncBatchNorm2d`
+(``src/layers.py``) normalizes with the statistics of the whole batch, so
+N ranks with batches of B / N samples train like one process with batches
+of B samples.
+
+Ranks are either spawned on the local machine (`launch_local`, used by
+``train.py`` with ``distributed.enabled``) or started by torchrun, which
+also spans machines:
+
+    torchrun --nnodes 2 --nproc-per-node 4 --rdzv-endpoint host:29500 train.py
+"""
+import os
+from datetime import timedelta
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from .layers import convert_sync_batchnorm
+
+
+def is_distributed() -> bool:
+    """Returns True in a process group of more than one rank."""
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank() -> int:
+    """Returns the rank of the calling process, 0 outside of a process group."""
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def get_world_size() -> int:
+    """Returns the number of ranks, 1 outside of a process group."""
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def is_main_process() -> bool:
+    """Returns True on rank 0, which alone writes checkpoints and logs metrics."""
+    return get_rank() == 0
+
+
+def init_distributed(backend: str = 'gloo', threads_per_rank: int = None, timeout_min: float = 30) -> Tuple[int, int, int]:
+    """
+    Joins the process group described by the torchrun environment variables.
+
+    RANK, WORLD_SIZE, LOCAL_RANK, LOCAL_WORLD_SIZE, MASTER_ADDR and
+    MASTER_PORT are set by torchrun or `launch_local`. Without WORLD_SIZE
+    (or with a single rank) nothing is initialized. The intra-op threads of
+    every rank are limited so the ranks of a machine share its cores
+    instead of oversubscribing them.
+
+    Args:
+        backend (str, optional): Process group backend. Default is 'gloo'.
+        threads_per_rank (int, optional): Intra-op threads per rank. Defaults to the cores of the
+            machine divided by its number of ranks.
+        timeout_min (float, optional): Timeout of the collectives, in minutes. Default is 30.
+
+    Returns:
+        Tuple[int, int, int]: (rank, world size, local rank)
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size <= 1:
+        return 0, 1, 0
+    rank, local_rank = int(os.environ['RANK']), int(os.environ.get('LOCAL_RANK', 0))
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+    torch.set_num_threads(threads_per_rank or max(1, (os.cpu_count() or 1) // local_world_size))
+    dist.init_process_group(backend, init_method='env://', rank=rank, world_size=world_size,
+                            timeout=timedelta(minutes=timeout_min))
+    return rank, world_size, local_rank
+
+
+def _run_rank(local_rank: int, fn: Callable, world_size: int, master_port: int, args: tuple):
+    """Entry point of a spawned rank: sets the torchrun environment, then runs `fn(*args)`."""
+    os.environ.update({
+        'RANK': str(local_rank),
+        'LOCAL_RANK': str(local_rank),
+        'WORLD_SIZE': str(world_size),
+        'LOCAL_WORLD_SIZE': str(world_size),
+        'MASTER_ADDR': os.environ.get('MASTER_ADDR', '127.0.0.1'),
+        'MASTER_PORT': str(master_port),
+    })
+    try:
+        fn(*args)
+    finally:
+        if dist.is_initialized():
+            dist.destroy_process_group()
+
+
+def launch_local(fn: Callable, world_size: int, *args, master_port: int = 29500):
+    """
+    Runs `fn(*args)` in `world_size` processes of this machine, each a rank of one process group.
+
+    `fn` (and `args`) must be picklable, and call `init_distributed` to join the group.
+
+    Args:
+        fn (Callable): Function run by every rank
+        world_size (int): Number of ranks to spawn
+        *args: Arguments of `fn`
+        master_port (int, optional): Free TCP port of the rendezvous. Default is 29500.
+    """
+    mp.spawn(_run_rank, args=(fn, world_size, master_port, args), nprocs=world_size, join=True)
+
+
+def broadcast_module(module: nn.Module, src: int = 0):
+    """Copies the parameters and buffers of rank `src` to every rank, e.g. after a random initialization."""
+    if not is_distributed():
+        return
+    with torch.no_grad():
+        for tensor in [*module.parameters(), *module.buffers()]:
+            dist.broadcast(tensor.data, src)
+
+
+def average_buffers(module: nn.Module):
+    """Averages the floating point buffers (BatchNorm running statistics) of `module` across the ranks."""
+    if not is_distributed():
+        return
+    buffers = [b for b in module.buffers() if b.is_floating_point()]
+    if not buffers:
+        return
+    with torch.no_grad():
+        flat = torch.cat([b.reshape(-1) for b in buffers])
+        dist.all_reduce(flat)
+        flat /= dist.get_world_size()
+        offset = 0
+        for b in buffers:
+            b.copy_(flat[offset:offset + b.numel()].view_as(b))
+            offset += b.numel()
+
+
+def gather_objects(obj) -> list:
+    """Returns the picklable `obj` of every rank, in rank order (`[obj]` outside of a process group)."""
+    if not is_distributed():
+        return [obj]
+    objects = [None] * dist.get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
+
+
+def even_batches(loader: Iterable) -> Iterator:
+    """
+    Yields the batches of `loader` while every rank still has one.
+
+    Streamed shards do not split into the same number of batches on every
+    rank, and a rank that stops early would leave the others waiting in
+    their collectives. One tiny all-reduce per batch lets all ranks stop
+    together.
+    """
+    iterator = iter(loader)
+    while True:
+        batch = next(iterator, None)
+        if is_distributed():
+            more = torch.tensor(int(batch is not None))
+            dist.all_reduce(more, dist.ReduceOp.MIN)
+            if not more:
+                return
+        elif batch is None:
+            return
+        yield batch
+
+
+class GradientBucketer:
+    """
+    Averages the gradients of a set of parameters across the ranks, in buckets overlapping backward.
+
+    The parameters are grouped in buckets of about `bucket_mb` MB, in the
+    reverse order of their registration, roughly the order in which
+    backward produces their gradients. Once `arm` is called, every bucket
+    whose gradients are all accumulated is flattened and its all-reduce
+    starts asynchronously while backward carries on with the other layers.
+    Buckets are always launched in the same order, so the collectives of
+    all ranks match. `synchronize` launches what is left, waits and writes
+    the averaged gradients back. `attach` calls it before every step of an
+    optimizer.
+
+    Only the last backward pass before a step is armed: the discriminator
+    also receives gradients in the generator update, and micro-batches
+    accumulate several backward passes before the step.
+
+    Args:
+        parameters (Iterable[nn.Parameter]): Parameters whose gradients are averaged
+        bucket_mb (float, optional): Size of a bucket in MB. Default is 25.
+    """
+    def __init__(self, parameters: Iterable[nn.Parameter], bucket_mb: float = 25.0):
+        params = [p for p in parameters if p.requires_grad]
+        limit = bucket_mb * 2**20
+        self.buckets: List[List[nn.Parameter]] = []
+        size = 0
+        for p in reversed(params):
+            nbytes = p.numel() * p.element_size()
+            bucket = self.buckets[-1] if self.buckets else None
+            if bucket is None or size + nbytes > limit or p.dtype != bucket[0].dtype or p.device != bucket[0].device:
+                self.buckets.append([])
+                size = 0
+            self.buckets[-1].append(p)
+            size += nbytes
+        self._bucket_of = {p: i for i, bucket in enumerate(self.buckets) for p in bucket}
+        self._flat: List[torch.Tensor] = [None] * len(self.buckets) # allocated on first use
+        self._works = []
+        self._ready = [0] * len(self.buckets)
+        self._next = 0 # next bucket to launch
+        self._armed = False
+        for p in params:
+            p.register_post_accumulate_grad_hook(self._on_grad_ready)
+
+    def attach(self, optimizer: torch.optim.Optimizer):
+        """Synchronizes the gradients before every step of `optimizer`."""
+        optimizer.register_step_pre_hook(lambda optimizer, args, kwargs: self.synchronize())
+
+    def arm(self):
+        """Reduces the gradients of the next backward pass as they become ready."""
+        self._reset()
+        self._armed = True
+
+    def _reset(self):
+        for work in self._works: # left over from an interrupted step
+            work.wait()
+        self._works = []
+        self._ready = [0] * len(self.buckets)
+        self._next = 0
+        self._armed = False
+
+    def _on_grad_ready(self, param: nn.Parameter):
+        if not self._armed:
+            return
+        self._ready[self._bucket_of[param]] += 1
+        while self._next < len(self.buckets) and self._ready[self._next] == len(self.buckets[self._next]):
+            self._launch(self._next)
+            self._next += 1
+
+    def _launch(self, index: int):
+        """Flattens the gradients of a bucket and starts their all-reduce."""
+        bucket = self.buckets[index]
+        if self._flat[index] is None:
+            self._flat[index] = torch.empty(sum(p.numel() for p in bucket), dtype=bucket[0].dtype,
+                                            device=bucket[0].device)
+        flat, offset = self._flat[index], 0
+        for p in bucket:
+            view = flat[offset:offset + p.numel()]
+            if p.grad is None: # unused in this backward pass on this rank
+                view.zero_()
+            else:
+                view.copy_(p.grad.reshape(-1))
+            offset += p.numel()
+        self._works.append(dist.all_reduce(flat, async_op=True))
+
+    def synchronize(self):
+        """Finishes the all-reduces of all buckets and replaces the gradients by their average."""
+        if not is_distributed():
+            return
+        while self._next < len(self.buckets):
+            self._launch(self._next)
+            self._next += 1
+        for work in self._works:
+            work.wait()
+        world_size = dist.get_world_size()
+        with torch.no_grad():
+            for bucket, flat in zip(self.buckets, self._flat):
+                flat /= world_size
+                offset = 0
+                for p in bucket:
+                    grad = flat[offset:offset + p.numel()].view_as(p)
+                    if p.grad is None:
+                        p.grad = grad.clone()
+                    else:
+                        p.grad.copy_(grad)
+                    offset += p.numel()
+        self._works = []
+        self._reset()
+
+
+SYNC_BATCHNORM = ('none', 'generator', 'discriminator', 'all')
+
+
+def data_parallel(model: nn.Module, sync_batchnorm: str = 'all', bucket_mb: float = 25.0) -> nn.Module:
+    """
+    Prepares a `Pix2Pix` model for data-parallel training in the current process group.
+
+    The BatchNorm layers of the selected networks are synchronized across
+    the ranks, rank 0's weights are copied to every rank, and the gradients
+    of the generator and the discriminator are averaged in buckets before
+    each step of their optimizer. The 'auto' micro-batch size no longer
+    shrinks on CUDA out-of-memory errors, as all ranks must keep the same
+    micro-batches.
+
+    Args:
+        model (Pix2Pix): Model in training mode, on its device
+        sync_batchnorm (str, optional): Networks whose BatchNorm layers use the statistics of the whole
+            batch: 'none', 'generator', 'discriminator' or 'all'. Unsynchronized layers normalize with
+            the local batch and their running statistics are averaged with `average_buffers`. Default is 'all'.
+        bucket_mb (float, optional): Size of the gradient buckets in MB. Default is 25.
+
+    Returns:
+        nn.Module: `model`, converted in place
+    """
+    if sync_batchnorm not in SYNC_BATCHNORM:
+        raise ValueError(f"Unknown sync_batchnorm {sync_batchnorm}, use one of {SYNC_BATCHNORM}")
+    if sync_batchnorm in ('generator', 'all'):
+        convert_sync_batchnorm(model.gen)
+    if sync_batchnorm in ('discriminator', 'all'):
+        convert_sync_batchnorm(model.disc)
+    broadcast_module(model)
+    model._oom_backoff = False # a rank cannot shrink its micro-batches alone
+
+    for name, network, optimizer in (('gen', model.gen, model.gen_optimizer),
+                                     ('disc', model.disc, model.disc_optimizer)):
+        bucketer = GradientBucketer(network.parameters(), bucket_mb)
+        bucketer.attach(optimizer)
+        model.gradient_sync[name] = bucketer
+    return model
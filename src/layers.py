@@ -1,6 +1,175 @@
+from contextlib import contextmanager
+
+import torch
+import torch.distributed as dist
 import torch.nn as nn
 
 
+def _tracking_batchnorms(module: nn.Module) -> list:
+    """BatchNorm layers of `module` keeping running statistics."""
+    return [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+
+
+def batchnorm_stats(module: nn.Module) -> list:
+    """Returns copies of the running statistics of the BatchNorm layers of `module`, see `restore_batchnorm_stats`."""
+    with torch.no_grad():
+        return [(m.running_mean.clone(), m.running_var.clone(), m.num_batches_tracked.clone())
+                for m in _tracking_batchnorms(module)]
+
+
+def restore_batchnorm_stats(module: nn.Module, stats: list):
+    """Restores the running statistics of the BatchNorm layers of `module` saved by `batchnorm_stats`."""
+    with torch.no_grad():
+        for layer, (mean, var, count) in zip(_tracking_batchnorms(module), stats):
+            layer.running_mean.copy_(mean)
+            layer.running_var.copy_(var)
+            layer.num_batches_tracked.copy_(count)
+
+
+@contextmanager
+def freeze_batchnorm_stats(module: nn.Module):
+    """
+    Restores the running statistics of the BatchNorm layers of `module` on exit.
+
+    Forward passes inside the context run exactly as usual (layers in
+    training mode normalize with the batch statistics and save the same
+    tensors for backward), but leave the running statistics as they were.
+    Used to replay a forward pass (a recomputed micro-batch or checkpointed
+    block) without counting its batch twice.
+
+    Args:
+        module (nn.Module): Module whose BatchNorm layers are frozen
+    """
+    saved = batchnorm_stats(module)
+    try:
+        yield
+    finally:
+        restore_batchnorm_stats(module, saved)
+
+
+@contextmanager
+def split_batchnorm(module: nn.Module, num_groups: int):
+    """
+    Makes the BatchNorm layers of `module` normalize `num_groups` equal slices of the batch separately.
+
+    A forward pass inside the context on a batch of concatenated inputs
+    gives the outputs, gradients and running statistics of one forward pass
+    per input, in order: every other layer runs once on the whole batch, but
+    a BatchNorm layer in training mode normalizes each slice with its own
+    statistics (layers using their running statistics are left as they are).
+
+    Args:
+        module (nn.Module): Module whose BatchNorm layers are split, e.g. the discriminator
+        num_groups (int): Number of inputs in the batch
+    """
+    def split_forward(layer, x):
+        if layer.training or not layer.track_running_stats: # normalizes with the batch statistics
+            return torch.cat([type(layer).forward(layer, group) for group in x.chunk(num_groups)])
+        return type(layer).forward(layer, x)
+
+    layers = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    for layer in layers:
+        layer.forward = split_forward.__get__(layer)
+    try:
+        yield
+    finally:
+        for layer in layers:
+            del layer.forward
+
+
+class _SyncBatchNorm(torch.autograd.Function):
+    """Normalizes (N, C, H, W) inputs with the statistics of the batches of all ranks."""
+    @staticmethod
+    def forward(ctx, x, weight, bias, eps):
+        xf = x.float()
+        var, mean = torch.var_mean(xf, dim=(0, 2, 3), unbiased=False)
+        count = torch.full_like(mean, x.numel() // x.size(1))
+        # Counts, means and variances of every rank, merged with the parallel variance formula
+        stats = [torch.empty(3, x.size(1), device=x.device) for _ in range(dist.get_world_size())]
+        dist.all_gather(stats, torch.stack([count, mean, var]))
+        counts, means, variances = torch.stack(stats).unbind(1) # (ranks, C) each
+        total = counts.sum(dim=0)
+        mean = (counts * means).sum(dim=0) / total
+        var = (counts * (variances + (means - mean) ** 2)).sum(dim=0) / total
+        invstd = torch.rsqrt(var + eps)
+
+        out = (xf - mean[:, None, None]) * invstd[:, None, None]
+        if weight is not None:
+            out = out * weight[:, None, None] + bias[:, None, None]
+        ctx.save_for_backward(x, weight, mean, invstd, total)
+        ctx.mark_non_differentiable(mean, var, total)
+        return out.to(x.dtype), mean, var, total
+
+    @staticmethod
+    def backward(ctx, grad_out, *_):
+        x, weight, mean, invstd, total = ctx.saved_tensors
+        dy, xmu = grad_out.float(), x.float() - mean[:, None, None]
+        sum_dy, sum_dy_xmu = dy.sum(dim=(0, 2, 3)), (dy * xmu).sum(dim=(0, 2, 3))
+        grad_weight = sum_dy_xmu * invstd if weight is not None else None
+        grad_bias = sum_dy if weight is not None else None
+
+        # The input gradients depend on the output gradients of the whole batch
+        sums = torch.cat([sum_dy, sum_dy_xmu])
+        dist.all_reduce(sums)
+        mean_dy, mean_dy_xmu = (sums / total.repeat(2)).chunk(2)
+        scale = invstd if weight is None else invstd * weight
+        grad_x = (dy - mean_dy[:, None, None] - xmu * (invstd * invstd * mean_dy_xmu)[:, None, None]) * scale[:, None, None]
+        return grad_x.to(x.dtype), grad_weight, grad_bias, None
+
+
+class SyncBatchNorm2d(nn.BatchNorm2d):
+    """
+    BatchNorm2d normalizing with the statistics of the whole distributed batch.
+
+    `nn.SyncBatchNorm` only runs on GPUs, this layer works with any backend
+    (gloo on CPUs). The means and variances of the local batches are
+    gathered and merged in forward, and the sums of the output gradients
+    are all-reduced in backward, so outputs and gradients are those of a
+    BatchNorm over the global batch. Outside of training, or without a
+    process group, it is a plain BatchNorm2d.
+    """
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if not (self.training and dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1):
+            return super().forward(x)
+        out, mean, var, total = _SyncBatchNorm.apply(x, self.weight if self.affine else None,
+                                                     self.bias if self.affine else None, self.eps)
+        if self.track_running_stats:
+            with torch.no_grad():
+                self.num_batches_tracked += 1
+                momentum = 1.0 / self.num_batches_tracked.item() if self.momentum is None else self.momentum
+                self.running_mean.lerp_(mean, momentum)
+                self.running_var.lerp_(var * total / (total - 1).clamp_min(1), momentum) # unbiased
+        return out
+
+
+def convert_sync_batchnorm(module: nn.Module) -> nn.Module:
+    """
+    Replaces the BatchNorm2d layers of `module` by `SyncBatchNorm2d` layers with the same state.
+
+    The new layers share the parameters and buffers of the old ones, so
+    optimizers built on `module` keep working.
+
+    Args:
+        module (nn.Module): Module to convert in place, e.g. the generator or the discriminator
+
+    Returns:
+        nn.Module: The converted module (a new layer if `module` itself is a BatchNorm2d)
+    """
+    if type(module) is nn.BatchNorm2d:
+        converted = SyncBatchNorm2d(module.num_features, module.eps, module.momentum, module.affine,
+                                    module.track_running_stats)
+        if module.affine:
+            converted.weight, converted.bias = module.weight, module.bias
+        if module.track_running_stats:
+            converted.running_mean, converted.running_var = module.running_mean, module.running_var
+            converted.num_batches_tracked = module.num_batches_tracked
+        converted.train(module.training)
+        return converted
+    for name, child in module.named_children():
+        setattr(module, name, convert_sync_batchnorm(child))
+    return module
+
+
 class DownsamplingBlock(nn.Module):
     """Defines the Unet downsampling block. 
     
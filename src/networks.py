@@ -1,14 +1,63 @@
+from contextlib import nullcontext
+from typing import Optional, Sequence, Set, Union
+
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from .layers import DownsamplingBlock, UpsamplingBlock, freeze_batchnorm_stats
+
+ENCODER_BLOCKS = tuple(f'enc{i}' for i in range(1, 9))
+DECODER_BLOCKS = tuple(f'dec{i}' for i in range(1, 9))
+
+
+def checkpoint_blocks(spec: Optional[Union[str, Sequence[str]]]) -> Set[str]:
+    """
+    Resolves an activation checkpointing setting to the names of the Unet blocks to recompute.
+
+    Args:
+        spec (str | Sequence[str] | None): None or 'none', 'encoder', 'decoder', 'all',
+            or block names such as ['enc1', 'enc2', 'dec7', 'dec8']
+
+    Returns:
+        Set[str]: Names of the checkpointed blocks
+    """
+    presets = {'none': (), 'encoder': ENCODER_BLOCKS, 'decoder': DECODER_BLOCKS,
+               'all': ENCODER_BLOCKS + DECODER_BLOCKS}
+    if spec is None:
+        return set()
+    if isinstance(spec, str):
+        if spec not in presets:
+            raise ValueError(f"Unknown checkpointing setting {spec}, use one of {list(presets)} or a list of blocks")
+        return set(presets[spec])
+    unknown = set(spec) - set(ENCODER_BLOCKS + DECODER_BLOCKS)
+    if unknown:
+        raise ValueError(f"Unknown Unet blocks {sorted(unknown)}, use enc1-enc8 and dec1-dec8")
+    return set(spec)
+
+
+def run_block(block: nn.Module, function, *inputs, checkpointed: bool = False):
+    """
+    Runs `function(*inputs)`, a forward pass through `block`, optionally with activation checkpointing.
+
+    A checkpointed block only keeps its inputs for backward, its inner
+    activations are recomputed during backward. The recomputation replays
+    the RNG state (same dropout masks) and does not update the BatchNorm
+    running statistics a second time, so gradients and buffers are the same
+    as without checkpointing.
+    """
+    if not checkpointed or not torch.is_grad_enabled():
+        return function(*inputs)
+    return checkpoint(function, *inputs, use_reentrant=False,
+                      context_fn=lambda: (nullcontext(), freeze_batchnorm_stats(block)))
 
-from .layers import DownsamplingBlock, UpsamplingBlock
 
 class UnetEncoder(nn.Module):
     """Create the Unet Encoder Network.
     
     C64-C128-C256-C512-C512-C512-C512-C512
     """
-    def __init__(self, c_in=3, c_out=512):
+    def __init__(self, c_in=3, c_out=512, checkpointed=()):
         """
         Constructs the Unet Encoder Network.
 
@@ -17,8 +66,11 @@ class UnetEncoder(nn.Module):
         Args:
             c_in (int, optional): Number of input channels.
             c_out (int, optional): Number of output channels. Default is 512.
+            checkpointed (Iterable[str], optional): Blocks ('enc1'-'enc8') whose activations are
+                recomputed in backward instead of stored. Default is none.
         """
         super(UnetEncoder, self).__init__()
+        self.checkpointed = set(checkpointed)
         self.enc1 = DownsamplingBlock(c_in, 64, use_norm=False) # C64
         self.enc2 = DownsamplingBlock(64, 128) # C128
         self.enc3 = DownsamplingBlock(128, 256) # C256
@@ -28,15 +80,19 @@ class UnetEncoder(nn.Module):
         self.enc7 = DownsamplingBlock(512, 512) # C512
         self.enc8 = DownsamplingBlock(512, c_out) # C512
 
+    def _run(self, name, x):
+        block = getattr(self, name)
+        return run_block(block, block, x, checkpointed=name in self.checkpointed)
+
     def forward(self, x):
-        x1 = self.enc1(x)
-        x2 = self.enc2(x1)
-        x3 = self.enc3(x2)
-        x4 = self.enc4(x3)
-        x5 = self.enc5(x4)
-        x6 = self.enc6(x5)
-        x7 = self.enc7(x6)
-        x8 = self.enc8(x7)
+        x1 = self._run('enc1', x)
+        x2 = self._run('enc2', x1)
+        x3 = self._run('enc3', x2)
+        x4 = self._run('enc4', x3)
+        x5 = self._run('enc5', x4)
+        x6 = self._run('enc6', x5)
+        x7 = self._run('enc7', x6)
+        x8 = self._run('enc8', x7)
         out = [x8, x7, x6, x5, x4, x3, x2, x1] # latest activation is the first element
         return out
     
@@ -44,7 +100,7 @@ class UnetEncoder(nn.Module):
 class UnetDecoder(nn.Module):
     """Creates the Unet Decoder Network.
     """
-    def __init__(self, c_in=512, c_out=64, use_upsampling=False, mode='nearest'):
+    def __init__(self, c_in=512, c_out=64, use_upsampling=False, mode='nearest', checkpointed=()):
         """
         Constructs the Unet Decoder Network.
 
@@ -60,8 +116,12 @@ class UnetDecoder(nn.Module):
                 If False, use transpose convolution. Default is False
             mode (str, optional): the upsampling algorithm: one of 'nearest', 
                 'bilinear', 'bicubic'. Default: 'nearest'
+            checkpointed (Iterable[str], optional): Blocks ('dec1'-'dec8') whose activations are
+                recomputed in backward instead of stored, including the concatenation of their
+                skip connection. Default is none.
         """
         super(UnetDecoder, self).__init__()
+        self.checkpointed = set(checkpointed)
         self.dec1 = UpsamplingBlock(c_in, 512, use_dropout=True, use_upsampling=use_upsampling, mode=mode) # CD512
         self.dec2 = UpsamplingBlock(1024, 512, use_dropout=True, use_upsampling=use_upsampling, mode=mode) # CD1024
         self.dec3 = UpsamplingBlock(1024, 512, use_dropout=True, use_upsampling=use_upsampling, mode=mode) # CD1024
@@ -72,21 +132,31 @@ class UnetDecoder(nn.Module):
         self.dec8 = UpsamplingBlock(128, c_out, use_upsampling=use_upsampling, mode=mode) # C128
     
 
+    def _run(self, name, x, skip=None):
+        """Runs a decoder block on `x`, concatenated with the skip connection `skip` if given."""
+        block = getattr(self, name)
+        if skip is None:
+            return run_block(block, block, x, checkpointed=name in self.checkpointed)
+        # The concatenation is part of the block, so a checkpointed block does not keep it
+        return run_block(block, lambda skip, x: block(torch.cat([skip, x], 1)), skip, x,
+                         checkpointed=name in self.checkpointed)
+
     def forward(self, x):
-        x9 = torch.cat([x[1], self.dec1(x[0])], 1) # (N,1024,H,W)
-        x10 = torch.cat([x[2], self.dec2(x9)], 1) # (N,1024,H,W)
-        x11 = torch.cat([x[3], self.dec3(x10)], 1) # (N,1024,H,W)
-        x12 = torch.cat([x[4], self.dec4(x11)], 1) # (N,1024,H,W)
-        x13 = torch.cat([x[5], self.dec5(x12)], 1) # (N,512,H,W)
-        x14 = torch.cat([x[6], self.dec6(x13)], 1) # (N,256,H,W)
-        x15 = torch.cat([x[7], self.dec7(x14)], 1) # (N,128,H,W)
-        out = self.dec8(x15) # (N,64,H,W)
+        # Every block after the first takes the previous output concatenated with a skip connection
+        x9 = self._run('dec1', x[0]) # (N,512,H,W)
+        x10 = self._run('dec2', x9, x[1]) # (N,1024,H,W) -> (N,512,H,W)
+        x11 = self._run('dec3', x10, x[2]) # (N,1024,H,W) -> (N,512,H,W)
+        x12 = self._run('dec4', x11, x[3]) # (N,1024,H,W) -> (N,512,H,W)
+        x13 = self._run('dec5', x12, x[4]) # (N,1024,H,W) -> (N,256,H,W)
+        x14 = self._run('dec6', x13, x[5]) # (N,512,H,W) -> (N,128,H,W)
+        x15 = self._run('dec7', x14, x[6]) # (N,256,H,W) -> (N,64,H,W)
+        out = self._run('dec8', x15, x[7]) # (N,128,H,W) -> (N,64,H,W)
         return out
     
 
 class UnetGenerator(nn.Module):
     """Create a Unet-based generator"""
-    def __init__(self, c_in=3, c_out=3, use_upsampling=False, mode='nearest'):
+    def __init__(self, c_in=3, c_out=3, use_upsampling=False, mode='nearest', checkpoint=None):
         """
         Constructs a Unet generator
         Args:
@@ -97,10 +167,14 @@ class UnetGenerator(nn.Module):
                 If False, use transpose convolution. Default is False
             mode (str, optional): the upsampling algorithm: one of 'nearest', 
                 'bilinear', 'bicubic'. Default: 'nearest'
+            checkpoint (str | Sequence[str], optional): Activation checkpointing of the encoder and
+                decoder blocks, trading recomputation for memory (see `checkpoint_blocks`). Default is None.
         """
         super(UnetGenerator, self).__init__()
-        self.encoder = UnetEncoder(c_in=c_in)
-        self.decoder = UnetDecoder(use_upsampling=use_upsampling, mode=mode)
+        blocks = checkpoint_blocks(checkpoint)
+        self.encoder = UnetEncoder(c_in=c_in, checkpointed=blocks & set(ENCODER_BLOCKS))
+        self.decoder = UnetDecoder(use_upsampling=use_upsampling, mode=mode,
+                                   checkpointed=blocks & set(DECODER_BLOCKS))
         # In the paper, the authors state:
         #   """
         #       After the last layer in the decoder, a convolution is applied
@@ -1,8 +1,43 @@
+import os
+from contextlib import nullcontext
+from typing import List, Optional, Sequence, Tuple, Union
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
+from .layers import batchnorm_stats, freeze_batchnorm_stats, restore_batchnorm_stats, split_batchnorm
 from .networks import UnetGenerator, PatchGAN
 
+
+def _rng_state(device: torch.device) -> tuple:
+    """Returns the torch RNG state of the CPU and, for a CUDA `device`, of the device."""
+    return torch.get_rng_state(), torch.cuda.get_rng_state(device) if device.type == 'cuda' else None
+
+
+def _set_rng_state(device: torch.device, state: tuple):
+    """Restores an RNG state returned by `_rng_state`."""
+    torch.set_rng_state(state[0])
+    if state[1] is not None:
+        torch.cuda.set_rng_state(state[1], device)
+
+
+def _available_memory(device: torch.device) -> int:
+    """Returns the memory in bytes a training step can still use on `device`, available RAM for the CPU."""
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        # Memory cached by the allocator but not in use is available as well
+        return free + torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
 class Pix2Pix(nn.Module):
     """Create a Pix2Pix class. It is a model for image to image translation tasks.
     By default, the model uses a Unet architecture for generator with transposed
@@ -21,7 +56,12 @@ class Pix2Pix(nn.Module):
                  n_layers: int = 3,
                  lr: float = 0.0002,
                  beta1: float = 0.5,
-                 beta2: float = 0.999
+                 beta2: float = 0.999,
+                 precision: str = 'fp32',
+                 micro_batch_size: Optional[Union[int, str]] = None,
+                 memory_fraction: float = 0.8,
+                 checkpoint: Optional[Union[str, Sequence[str]]] = None,
+                 fused_disc: bool = False
                  ):
         """Constructs the Pix2Pix class.
         
@@ -39,13 +79,35 @@ class Pix2Pix(nn.Module):
             lr: Learning rate
             beta1: Beta1 parameter for Adam optimizer
             beta2: Beta2 parameter for Adam optimizer
+            precision: 'fp32', or 'bf16' to run the forward passes and losses under bfloat16 autocast.
+                Parameters, gradients and optimizer states stay in float32.
+            micro_batch_size: Split every training batch into micro-batches of at most this many samples,
+                at least 2, with gradients accumulated over the whole batch (see `_accumulated_train_step`). 'auto'
+                fits it to the free memory on the first step and halves it whenever CUDA runs out of memory.
+                None trains on whole batches.
+            memory_fraction: Share of the free device memory the 'auto' micro-batch size may use
+            checkpoint: Generator blocks whose activations are recomputed in backward instead of
+                stored: 'encoder', 'decoder', 'all' or block names (see `networks.checkpoint_blocks`)
+            fused_disc: Run the discriminator once on the real and fake pairs stacked in one batch instead of
+                once per pair, with the same losses (see `step_discriminator`)
         """
         super(Pix2Pix, self).__init__()
+        if precision not in ('fp32', 'bf16'):
+            raise ValueError(f"Unknown precision {precision}, use 'fp32' or 'bf16'")
+        self.precision = precision
+        # BatchNorm needs 2 samples at the 1x1 bottleneck of the generator
+        if micro_batch_size is not None and micro_batch_size != 'auto' and int(micro_batch_size) < 2:
+            raise ValueError("micro_batch_size must be an integer of at least 2, 'auto' or None")
+        self.micro_batch_size = micro_batch_size
+        self.memory_fraction = memory_fraction
+        self.fused_disc = fused_disc
+        self._oom_backoff = micro_batch_size == 'auto'
         self.is_CGAN = is_CGAN
         self.lambda_L1 = lambda_L1
         self.is_train = is_train
 
-        self.gen = UnetGenerator(c_in=c_in, c_out=c_out, use_upsampling=use_upsampling, mode=mode)
+        self.gen = UnetGenerator(c_in=c_in, c_out=c_out, use_upsampling=use_upsampling, mode=mode,
+                                 checkpoint=checkpoint)
         self.gen = self.gen.apply(self.weights_init)
         
         if self.is_train:
@@ -63,9 +125,30 @@ class Pix2Pix(nn.Module):
             # Initialize loss functions
             self.criterion = nn.BCEWithLogitsLoss()
             self.criterion_L1 = nn.L1Loss()
+
+        # Gradient synchronizers of a distributed run, per network ('gen', 'disc'), see `distributed.data_parallel`
+        self.gradient_sync = {}
+        # Times the phases of the training steps if set, see `timing.PhaseTimer`
+        self.timer = None
     
     def forward(self, x: torch.Tensor):
         return self.gen(x)
+
+    def _backward(self, loss: torch.Tensor, network: str, last: bool = True):
+        """Backward pass of a 'gen' or 'disc' update, the `last` one before its optimizer step
+        starts averaging the gradients across the ranks of a distributed run as they are ready."""
+        if last and network in self.gradient_sync:
+            self.gradient_sync[network].arm()
+        loss.backward()
+
+    def _timed(self, phase: str):
+        """Times a phase of the training step with `timer`, a no-op without one."""
+        return self.timer.phase(phase) if self.timer is not None else nullcontext()
+
+    def _autocast(self, device: torch.device):
+        """Autocast context of the configured precision, a no-op in fp32."""
+        # bfloat16 has the exponent range of float32, so no loss scaling is needed
+        return torch.autocast(device.type, dtype=torch.bfloat16, enabled=self.precision == 'bf16')
     
     @staticmethod    
     def weights_init(m):
@@ -85,9 +168,25 @@ class Pix2Pix(nn.Module):
     def _get_disc_inputs(self, 
                          real_images: torch.Tensor,
                          target_images: torch.Tensor, 
-                         fake_images: torch.Tensor
+                         fake_images: torch.Tensor,
+                         stacked: bool = False
                          ):
-        """Prepare discriminator inputs based on conditional/unconditional setup."""
+        """Prepare discriminator inputs based on conditional/unconditional setup.
+
+        With `stacked`, returns a single batch of the real pairs followed by the fake pairs instead."""
+        if stacked:
+            # Written into one batch, rather than concatenating the separate pairs again
+            c_in, n = real_images.size(1), len(real_images)
+            dtype = torch.promote_types(target_images.dtype, fake_images.dtype)
+            if self.is_CGAN:
+                dtype = torch.promote_types(real_images.dtype, dtype)
+                AB = real_images.new_empty((2 * n, c_in + target_images.size(1), *real_images.shape[2:]), dtype=dtype)
+                AB[:n, :c_in] = real_images
+                AB[n:, :c_in] = real_images
+                AB[:n, c_in:] = target_images
+                AB[n:, c_in:] = fake_images.detach()
+                return AB
+            return torch.cat([target_images.to(dtype), fake_images.detach().to(dtype)])
         if self.is_CGAN:
             # Conditional GANs need both input and output together, 
             # Therefore, the total input channel is c_in+c_out
@@ -116,10 +215,34 @@ class Pix2Pix(nn.Module):
         return fake_AB
     
     
+    def _disc_predictions(self, 
+                          real_images: torch.Tensor, 
+                          target_images: torch.Tensor, 
+                          fake_images: torch.Tensor
+                          ):
+        """Discriminator predictions D(x, y) and D(x, G(x)) of the real and fake pairs, in float32."""
+        if self.fused_disc:
+            # One pass over both pairs, BatchNorm layers normalize the real and fake halves separately
+            # as in two passes, so the predictions and running statistics are the same
+            with split_batchnorm(self.disc, 2):
+                pred_real, pred_fake = self.disc(self._get_disc_inputs(real_images, target_images, fake_images,
+                                                                       stacked=True)).float().chunk(2)
+            return pred_real, pred_fake
+
+        # Prepare inputs
+        real_AB, fake_AB = self._get_disc_inputs(real_images, target_images, 
+                                                fake_images)
+          
+        # Forward pass through the discriminator
+        pred_real = self.disc(real_AB).float() # D(x, y), losses are computed in float32 under autocast
+        pred_fake = self.disc(fake_AB).float() # D(x, G(x))
+        return pred_real, pred_fake
+
     def step_discriminator(self, 
                            real_images: torch.Tensor, 
                            target_images: torch.Tensor, 
-                           fake_images: torch.Tensor
+                           fake_images: torch.Tensor,
+                           return_fake: bool = False
                            ):
         """Discriminator forward/backward pass.
         
@@ -127,28 +250,27 @@ class Pix2Pix(nn.Module):
             real_images: Input images
             target_images: Ground truth images
             fake_images: Generated images
+            return_fake: If True, also return the predictions D(x, G(x))
             
         Returns:
             Discriminator loss value
         """
-        # Prepare inputs
-        real_AB, fake_AB = self._get_disc_inputs(real_images, target_images, 
-                                                fake_images)
-          
-        # Forward pass through the discriminator
-        pred_real = self.disc(real_AB) # D(x, y)
-        pred_fake = self.disc(fake_AB) # D(x, G(x))
+        pred_real, pred_fake = self._disc_predictions(real_images, target_images, fake_images)
 
         # Compute the losses
         lossD_real = self.criterion(pred_real, torch.ones_like(pred_real)) # (D(x, y), 1)
         lossD_fake = self.criterion(pred_fake, torch.zeros_like(pred_fake)) # (D(x, y), 0)
         lossD = (lossD_real + lossD_fake) * 0.5 # Combined Loss
+        if return_fake:
+            return lossD, pred_fake
         return lossD
     
     def step_generator(self, 
                        real_images: torch.Tensor, 
                        target_images: torch.Tensor, 
-                       fake_images: torch.Tensor
+                       fake_images: torch.Tensor,
+                       per_sample: bool = False,
+                       pred_fake: Optional[torch.Tensor] = None
                        ):
         """Discriminator forward/backward pass.
         
@@ -156,61 +278,273 @@ class Pix2Pix(nn.Module):
             real_images: Input images
             target_images: Ground truth images
             fake_images: Generated images
+            per_sample: If True, also return the detached per-sample GAN and L1 losses
+            pred_fake: Predictions D(x, G(x)) of the current discriminator to reuse, None runs it
             
         Returns:
             Discriminator loss value
         """
-        # Prepare input
-        fake_AB = self._get_gen_inputs(real_images, fake_images)
+        if pred_fake is None:
+            # Prepare input
+            fake_AB = self._get_gen_inputs(real_images, fake_images)
           
-        # Forward pass through the discriminator
-        pred_fake = self.disc(fake_AB)
+            # Forward pass through the discriminator
+            pred_fake = self.disc(fake_AB).float() # losses are computed in float32 under autocast
+        fake_images = fake_images.float()
 
         # Compute the losses
-        lossG_GaN = self.criterion(pred_fake, torch.ones_like(pred_fake)) # GAN Loss
-        lossG_L1 = self.criterion_L1(fake_images, target_images)           # L1 Loss
+        if per_sample:
+            # Same losses, averaged per sample first (every sample has the same number of elements)
+            sample_GAN = F.binary_cross_entropy_with_logits(
+                pred_fake, torch.ones_like(pred_fake), reduction='none').flatten(1).mean(dim=1)
+            sample_L1 = F.l1_loss(fake_images, target_images, reduction='none').flatten(1).mean(dim=1)
+            lossG_GaN, lossG_L1 = sample_GAN.mean(), sample_L1.mean()
+        else:
+            lossG_GaN = self.criterion(pred_fake, torch.ones_like(pred_fake)) # GAN Loss
+            lossG_L1 = self.criterion_L1(fake_images, target_images)           # L1 Loss
         lossG = lossG_GaN + self.lambda_L1 * lossG_L1                      # Combined Loss
-        # Return total loss and individual components
-        return lossG, {
-            'loss_G': lossG.item(),
-            'loss_G_GAN': lossG_GaN.item(),
-            'loss_G_L1': lossG_L1.item()
+        # Return total loss and individual components, detached on the device (reading them syncs the host)
+        losses = {
+            'loss_G': lossG.detach(),
+            'loss_G_GAN': lossG_GaN.detach(),
+            'loss_G_L1': lossG_L1.detach()
         }
+        if per_sample:
+            losses['sample_GAN'] = sample_GAN.detach()
+            losses['sample_L1'] = sample_L1.detach()
+        return lossG, losses
     
     def train_step(self, 
                    real_images: torch.Tensor, 
-                   target_images: torch.Tensor
+                   target_images: torch.Tensor,
+                   per_sample: bool = False
                    ):
         """Performs a single training step.
         
         Args:
             real_images: Input images
             target_images: Ground truth images
+            per_sample: If True, also return the per-sample generator losses as
+                'sample_GAN' and 'sample_L1' tensors of shape (N,)
             
         Returns:
-            Dictionary containing all loss values from this step
+            Dictionary containing all loss values from this step, as detached 0-dim tensors on the device
         """
-        # Forward pass through the generator
-        fake_images = self.forward(real_images)
-        
-        # Update discriminator
+        if self.micro_batch_size is not None:
+            return self._accumulated_train_step(real_images, target_images, per_sample)
+
+        # Forward passes run under autocast in bf16 mode, backward passes outside of it
         self.disc_optimizer.zero_grad() # Reset the gradients for D
-        lossD = self.step_discriminator(real_images, target_images, fake_images) # Compute the loss
-        lossD.backward()
-        self.disc_optimizer.step() # Update D
+        with self._timed('g_forward'), self._autocast(real_images.device):
+            # Forward pass through the generator
+            fake_images = self.forward(real_images)
+
+        # Update discriminator
+        with self._timed('d_step'):
+            with self._autocast(real_images.device):
+                lossD = self.step_discriminator(real_images, target_images, fake_images) # Compute the loss
+            self._backward(lossD, 'disc')
+        with self._timed('d_optimizer'):
+            self.disc_optimizer.step() # Update D
 
         # Update generator
         self.gen_optimizer.zero_grad() # Reset the gradients for D
-        lossG, G_losses = self.step_generator(real_images, target_images, fake_images) # Compute the loss
-        lossG.backward()
-        self.gen_optimizer.step() # Update D
+        with self._timed('g_step'):
+            with self._autocast(real_images.device):
+                lossG, G_losses = self.step_generator(real_images, target_images, fake_images, per_sample) # Compute the loss
+            self._backward(lossG, 'gen')
+        with self._timed('g_optimizer'):
+            self.gen_optimizer.step() # Update D
 
         # Return all losses
         return {
-            'loss_D': lossD.item(),
+            'loss_D': lossD.detach(),
             **G_losses
         }
     
+    def _micro_batches(self,
+                       real_images: torch.Tensor,
+                       target_images: torch.Tensor
+                       ) -> List[Tuple[torch.Tensor, torch.Tensor, float]]:
+        """Splits a batch into near-equal micro-batches of `micro_batch_size` samples, with their share of the batch.
+
+        No micro-batch gets fewer than 2 samples, BatchNorm cannot normalize a single
+        sample at the 1x1 bottleneck of the generator. When at most `micro_batch_size`
+        samples would leave a 1-sample chunk (5 samples in micro-batches of 2), the
+        batch is split into fewer, slightly larger micro-batches instead (3 and 2).
+        """
+        num_chunks = max(min(-(-len(real_images) // self.micro_batch_size), len(real_images) // 2), 1)
+        return [(real, target, len(real) / len(real_images)) for real, target in
+                zip(real_images.tensor_split(num_chunks), target_images.tensor_split(num_chunks))]
+
+    def _retry_on_oom(self, phase, *args):
+        """Runs a step phase, halving the 'auto' micro-batch size and retrying it while CUDA runs out of memory."""
+        while True:
+            stats = batchnorm_stats(self) if self._oom_backoff else None
+            try:
+                return phase(*args)
+            except torch.cuda.OutOfMemoryError:
+                if not self._oom_backoff or self.micro_batch_size <= 2:
+                    raise
+                # Phases restart from zeroed gradients, only the optimizer steps are never repeated,
+                # and the forward passes of the failed attempt must not count in the running statistics
+                restore_batchnorm_stats(self, stats)
+                self.micro_batch_size = max(self.micro_batch_size // 2, 2)
+                torch.cuda.empty_cache()
+                print(f'Out of memory, retrying with micro-batches of {self.micro_batch_size} samples')
+
+    def _discriminator_phase(self,
+                             real_images: torch.Tensor,
+                             target_images: torch.Tensor,
+                             rng_state: tuple
+                             ) -> Tuple[float, List[torch.Tensor]]:
+        """Accumulates the discriminator gradients over the micro-batches, returns the loss and the kept fakes."""
+        _set_rng_state(real_images.device, rng_state) # replays the same dropout masks on a retry
+        self.disc_optimizer.zero_grad() # Reset the gradients for D
+        micro_batches = self._micro_batches(real_images, target_images)
+        keep = len(micro_batches) == 1 # a single micro-batch keeps the generator graph, as in a full-batch step
+        lossD, fakes = 0.0, []
+        for i, (real, target, weight) in enumerate(micro_batches):
+            with self._autocast(real.device):
+                with torch.set_grad_enabled(keep):
+                    fake = self.forward(real)
+                loss = self.step_discriminator(real, target, fake) * weight
+            self._backward(loss, 'disc', last=i == len(micro_batches) - 1)
+            lossD += loss.detach()
+            if keep:
+                fakes.append(fake)
+        return lossD, fakes
+
+    def _generator_phase(self,
+                         real_images: torch.Tensor,
+                         target_images: torch.Tensor,
+                         fakes: List[torch.Tensor],
+                         rng_state: tuple,
+                         per_sample: bool
+                         ) -> dict:
+        """Accumulates the generator gradients over the micro-batches, returns the generator losses."""
+        micro_batches = self._micro_batches(real_images, target_images)
+        if len(fakes) != len(micro_batches): # the micro-batches changed after running out of memory
+            fakes.clear()
+        if not fakes:
+            # Replays the generator forward passes of the discriminator phase: same dropout masks,
+            # same micro-batch statistics, and the running statistics are only updated once
+            _set_rng_state(real_images.device, rng_state)
+        self.gen_optimizer.zero_grad() # Reset the gradients for G
+        losses = {'loss_G': 0.0, 'loss_G_GAN': 0.0, 'loss_G_L1': 0.0}
+        sample_losses = []
+        with freeze_batchnorm_stats(self.gen):
+            for i, (real, target, weight) in enumerate(micro_batches):
+                with self._autocast(real.device):
+                    fake = fakes[i] if fakes else self.forward(real)
+                    lossG, G_losses = self.step_generator(real, target, fake, per_sample)
+                self._backward(lossG * weight, 'gen', last=i == len(micro_batches) - 1)
+                for key in losses:
+                    losses[key] += weight * G_losses[key]
+                if per_sample:
+                    sample_losses.append((G_losses['sample_GAN'], G_losses['sample_L1']))
+        if per_sample:
+            losses['sample_GAN'] = torch.cat([sample_GAN for sample_GAN, _ in sample_losses])
+            losses['sample_L1'] = torch.cat([sample_L1 for _, sample_L1 in sample_losses])
+        return losses
+
+    def _accumulated_train_step(self,
+                                real_images: torch.Tensor,
+                                target_images: torch.Tensor,
+                                per_sample: bool = False
+                                ):
+        """Performs a training step over micro-batches, with the gradients of the whole batch.
+
+        Every micro-batch loss is weighted by the share of the batch it holds,
+        so the accumulated gradients are the gradients of the batch losses,
+        and each optimizer steps once per batch. Only one micro-batch holds
+        activations at a time, so the peak memory follows the micro-batch size:
+
+        1. The fakes are generated without a graph, the discriminator
+           gradients accumulate and D is updated.
+        2. The generator forward passes are replayed (same RNG state, frozen
+           BatchNorm running statistics), the generator gradients accumulate
+           against the updated D and G is updated, as in a full-batch step.
+
+        The only difference with a full-batch step is that BatchNorm layers
+        normalize with the statistics of their micro-batch. A single
+        micro-batch keeps its generator graph and runs the full-batch step.
+
+        Args:
+            real_images: Input images
+            target_images: Ground truth images
+            per_sample: If True, also return the per-sample generator losses
+
+        Returns:
+            Dictionary containing all loss values from this step, as detached 0-dim tensors on the device
+        """
+        if self.micro_batch_size == 'auto':
+            self.micro_batch_size = self.fit_micro_batch_size(real_images, target_images)
+            if self.gradient_sync: # every rank runs the same micro-batches, their BatchNorm layers may be synchronized
+                size = torch.tensor(self.micro_batch_size)
+                torch.distributed.all_reduce(size, torch.distributed.ReduceOp.MIN)
+                self.micro_batch_size = int(size)
+            print(f'Training with micro-batches of {self.micro_batch_size} samples')
+        rng_state = _rng_state(real_images.device)
+
+        # The generator forward passes are timed with the phases running them
+        with self._timed('d_step'):
+            lossD, fakes = self._retry_on_oom(self._discriminator_phase, real_images, target_images, rng_state)
+        with self._timed('d_optimizer'):
+            self.disc_optimizer.step() # Update D
+
+        with self._timed('g_step'):
+            G_losses = self._retry_on_oom(self._generator_phase, real_images, target_images, fakes, rng_state, per_sample)
+        with self._timed('g_optimizer'):
+            self.gen_optimizer.step() # Update G
+
+        # Return all losses
+        return {
+            'loss_D': lossD,
+            **G_losses
+        }
+
+    def _saved_activation_bytes(self, real_images: torch.Tensor, target_images: torch.Tensor) -> int:
+        """Measures the bytes of the activations the generator update saves for backward on a batch."""
+        storages = {}
+        def pack(tensor):
+            if not isinstance(tensor, nn.Parameter):
+                storage = tensor.untyped_storage()
+                storages[storage.data_ptr()] = storage.nbytes()
+            return tensor
+
+        devices = [real_images.device] if real_images.device.type == 'cuda' else []
+        with torch.random.fork_rng(devices=devices), freeze_batchnorm_stats(self), \
+                torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor), self._autocast(real_images.device):
+            # The generator update holds the largest graph: generator and discriminator
+            fake_images = self.forward(real_images)
+            self.step_generator(real_images, target_images, fake_images)
+        return sum(storages.values())
+
+    def fit_micro_batch_size(self, real_images: torch.Tensor, target_images: torch.Tensor) -> int:
+        """Picks the largest micro-batch size whose training step fits in `memory_fraction` of the free memory.
+
+        The activations saved for backward are measured on 2 and 4 samples of
+        the batch, which gives their fixed and per-sample sizes. Backward
+        needs about as much again for the activation gradients.
+
+        Args:
+            real_images: Input images of a training batch
+            target_images: Ground truth images of a training batch
+
+        Returns:
+            Micro-batch size, between 2 and the batch size
+        """
+        if len(real_images) < 4:
+            return len(real_images)
+        two = self._saved_activation_bytes(real_images[:2], target_images[:2])
+        four = self._saved_activation_bytes(real_images[:4], target_images[:4])
+        per_sample = max((four - two) / 2, 1)
+        fixed = max(two - 2 * per_sample, 0)
+        budget = _available_memory(real_images.device) * self.memory_fraction - fixed
+        # BatchNorm needs 2 samples at the 1x1 bottleneck of the generator
+        return int(min(max(budget // (2 * per_sample), 2), len(real_images)))
+
     def validation_step(self, 
                    real_images: torch.Tensor, 
                    target_images: torch.Tensor
@@ -222,33 +556,40 @@ class Pix2Pix(nn.Module):
             target_images: Ground truth images
             
         Returns:
-            Dictionary containing all loss values from this step
+            Dictionary containing all loss values from this step, as detached 0-dim tensors on the device
         """
-        with torch.no_grad():
+        with torch.no_grad(), self._autocast(real_images.device):
             # Forward pass through the generator
             fake_images = self.forward(real_images)
 
             # Compute the loss for D
-            lossD = self.step_discriminator(real_images, target_images, fake_images)
+            lossD, pred_fake = self.step_discriminator(real_images, target_images, fake_images, return_fake=True)
             
-            # Compute the loss for G
-            _, G_losses = self.step_generator(real_images, target_images, fake_images)
+            # Compute the loss for G, D has not changed: its predictions on the fakes are reused
+            # (in training mode, a BatchNorm layer would count the fakes once instead of twice)
+            _, G_losses = self.step_generator(real_images, target_images, fake_images,
+                                              pred_fake=pred_fake if self.fused_disc else None)
 
         # Return all losses
         return {
-            'loss_D': lossD.item(),
+            'loss_D': lossD.detach(),
             **G_losses
         }
     
     def generate(self, 
                  real_images: torch.Tensor, 
                  is_scaled: bool = False, 
-                 to_uint8: bool = False
+                 to_uint8: bool = False,
+                 mean=(0.5,),
+                 std=(0.5,)
                  ):
         if not is_scaled:
             real_images = real_images.to(dtype=torch.float32) # Make sure it's a float tensor
             real_images = real_images / 255.0 # Normalize to [0, 1]
-            real_images = (real_images - 0.5) / 0.5 # Scale to [-1, 1]
+            # Scale to [-1, 1], or standardize with the dataset statistics (see utils/dataset_stats.py)
+            mean = torch.as_tensor(mean, dtype=torch.float32, device=real_images.device).view(1, -1, 1, 1)
+            std = torch.as_tensor(std, dtype=torch.float32, device=real_images.device).view(1, -1, 1, 1)
+            real_images = (real_images - mean) / std
         # Normalization is applied unconditionally if the line below is uncommented.
         # Logically, it should be applied only when is_scaled is False. 
         # However, I might be stupid and it could be a design oversight. 
@@ -256,10 +597,10 @@ class Pix2Pix(nn.Module):
         # then we know why :)
         # THE LINE IN QUESTION IS COMMENTED OUT BELOW
         # real_images = (real_images - 0.5) / 0.5 # Scale to [-1, 1]
-        with torch.no_grad(): # generate image
+        with torch.no_grad(), self._autocast(real_images.device): # generate image
             generated_images = self.forward(real_images)
 
-        generated_images = (generated_images + 1) / 2  # Rescale to [0, 1]
+        generated_images = (generated_images.float() + 1) / 2  # Rescale to [0, 1]
         if to_uint8:
             generated_images = (generated_images* 255).to(dtype=torch.uint8)  # Scale to [0, 255] and convert to uint8
         
@@ -296,7 +637,7 @@ class Pix2Pix(nn.Module):
         self.gen.load_state_dict(torch.load(gen_path, map_location=device, weights_only=True), strict=False)
         if disc_path is not None and self.is_train:
             device = device if device else next(self.disc.parameters()).device
-            self.disc.load_state_dict(torch.load(gen_path, map_location=device, weights_only=True), strict=False)
+            self.disc.load_state_dict(torch.load(disc_path, map_location=device, weights_only=True), strict=False)
     
     def save_optimizer(self, gen_opt_path: str, disc_opt_path: str = None):
         """
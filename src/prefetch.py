@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Union
+
+import torch
+
+
+class _Slot:
+    """Staging buffers of one in-flight batch: pinned host copies and their device copies."""
+    def __init__(self, device: torch.device):
+        self.device = device
+        self.host: List[Optional[torch.Tensor]] = []
+        self.device_buffers: List[Optional[torch.Tensor]] = []
+        self.copied = torch.cuda.Event() if device.type == 'cuda' else None # H2D copy done
+        self.released = torch.cuda.Event() if device.type == 'cuda' else None # consumer done
+
+    @staticmethod
+    def _buffer(buffers: list, i: int, like: torch.Tensor, **kwargs) -> torch.Tensor:
+        """Returns a view of buffer `i` shaped like `like`, (re)allocating it if it is too small."""
+        while len(buffers) <= i:
+            buffers.append(None)
+        buffer = buffers[i]
+        if buffer is None or buffer.dtype != like.dtype or buffer.shape[1:] != like.shape[1:] \
+                or buffer.shape[0] < like.shape[0]:
+            buffer = buffers[i] = torch.empty(like.shape, dtype=like.dtype, **kwargs)
+        return buffer[:like.shape[0]] # the last batch of an epoch may be smaller
+
+    def stage(self, batch, stream: Optional['torch.cuda.Stream']):
+        """Copies the tensors of `batch` to the device through the slot's buffers."""
+        if self.device.type != 'cuda':
+            return [field.to(self.device) if isinstance(field, torch.Tensor) else field for field in batch]
+
+        self.copied.synchronize() # the previous H2D copy out of the host buffers is done
+        stream.wait_event(self.released) # the consumer no longer reads the device buffers
+        staged = []
+        with torch.cuda.stream(stream):
+            for i, field in enumerate(batch):
+                if not isinstance(field, torch.Tensor):
+                    staged.append(field)
+                    continue
+                host = self._buffer(self.host, i, field, pin_memory=True)
+                host.copy_(field)
+                out = self._buffer(self.device_buffers, i, field, device=self.device)
+                out.copy_(host, non_blocking=True)
+                staged.append(out)
+        self.copied.record(stream)
+        return staged
+
+
+class DevicePrefetcher:
+    """
+    Wraps a DataLoader and keeps the next batches staged on the training device.
+
+    A background thread pulls batches from `loader` and copies them to
+    `device` while the current step runs. On CUDA the copies go through a
+    fixed pool of pinned host buffers and device buffers (`depth` + 1
+    slots, allocated once and reused) on a side stream, so the
+    host-to-device copy overlaps the step. A yielded batch stays valid until
+    the next one is requested.
+
+    The time the step loop spends waiting for the next batch is recorded,
+    see `stats`. A large `data_wait_fraction` means training is input-bound.
+
+    Args:
+        loader (Iterable): DataLoader yielding tuples of tensors
+        device (str | torch.device): Device to stage the batches on
+        depth (int, optional): Number of batches staged ahead of the current one. Default is 2.
+        batch_transforms (Sequence[callable], optional): One transform per batch field, applied on the
+            device, e.g. a `BatchNormalize` per image batch. None entries leave their field as is.
+    """
+    def __init__(self,
+                 loader: Iterable,
+                 device: Union[str, torch.device],
+                 depth: int = 2,
+                 batch_transforms: Optional[Sequence[Optional[Callable]]] = None):
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+        self.batch_transforms = batch_transforms
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        self.slots = [_Slot(self.device) for _ in range(depth + 1)] # depth staged + 1 in use
+        self.reset_stats()
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def _produce(self, free: queue.Queue, ready: queue.Queue, stop: threading.Event):
+        """Background thread: stages batches into free slots until the loader is exhausted."""
+        try:
+            for batch in self.loader:
+                slot = None
+                while slot is None: # wait for a free slot, or for the consumer to stop
+                    if stop.is_set():
+                        return
+                    try:
+                        slot = free.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                ready.put((slot, self.slots[slot].stage(batch, self.stream)))
+            ready.put(None) # end of the epoch
+        except Exception as e: # re-raised in the step loop
+            ready.put(e)
+
+    def __iter__(self) -> Iterator[tuple]:
+        free, ready, stop = queue.Queue(), queue.Queue(), threading.Event()
+        for i in range(len(self.slots)):
+            free.put(i)
+        thread = threading.Thread(target=self._produce, args=(free, ready, stop), daemon=True)
+        thread.start()
+
+        start = time.perf_counter()
+        current = None
+        try:
+            while True:
+                if current is not None: # the previous batch is no longer used
+                    if self.stream is not None:
+                        self.slots[current].released.record(torch.cuda.current_stream(self.device))
+                    free.put(current)
+
+                wait_start = time.perf_counter()
+                item = ready.get()
+                self.wait_time += time.perf_counter() - wait_start
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                current, batch = item
+                if self.stream is not None:
+                    compute = torch.cuda.current_stream(self.device)
+                    compute.wait_event(self.slots[current].copied)
+                    # The buffers were allocated on the side stream, a buffer replaced after a shape
+                    # change must not be reused before the steps reading it are done
+                    for field in batch:
+                        if isinstance(field, torch.Tensor):
+                            field.record_stream(compute)
+                if self.batch_transforms is not None:
+                    batch = [transform(field) if transform is not None else field
+                             for field, transform in zip(batch, self.batch_transforms)] + batch[len(self.batch_transforms):]
+                self.num_batches += 1
+                yield tuple(batch)
+        finally:
+            self.total_time += time.perf_counter() - start
+            stop.set()
+            thread.join()
+
+    def stats(self) -> dict:
+        """Returns the time the step loop waited for data since the last `reset_stats`."""
+        return {
+            'data_wait_sec': self.wait_time,
+            'data_wait_ms_per_batch': 1000 * self.wait_time / max(self.num_batches, 1),
+            'data_wait_fraction': self.wait_time / self.total_time if self.total_time > 0 else 0.0,
+        }
+
+    def reset_stats(self):
+        """Resets the counters reported by `stats`."""
+        self.wait_time = 0.0
+        self.total_time = 0.0
+        self.num_batches = 0
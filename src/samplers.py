@@ -0,0 +1,266 @@
+import math
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+
+class CategoryBatchSampler(Sampler[List[int]]):
+    """
+    Yields batches with a fixed category mix, e.g. balanced over the terrain categories of `Sentinel`.
+
+    The sample ids are grouped once into a compact index (ids sorted by
+    category plus per-category offsets). Every step draws the category of
+    each batch slot from the category weights and takes the next ids from
+    per-category shuffled cursors, so a step costs O(batch_size) no matter
+    the size of the dataset. Small categories are cycled (reshuffled when
+    exhausted), large ones are visited without replacement.
+
+    The ids are partitioned deterministically across distributed ranks.
+    DataLoader workers receive whole batches, so they never overlap either.
+    With ``epoch_fraction < 1`` every epoch is a shorter partial epoch that
+    continues where the previous one stopped.
+
+    Args:
+        category_ids (Sequence[int]): Category id of every sample, see `Sentinel.categories`
+        batch_size (int): Number of samples per batch
+        categories (Sequence[str], optional): Category names, needed to use named `weights`
+        weights (Dict[str, float], optional): Relative weight of each category name, missing
+            categories get a weight of 1. Defaults to balanced categories.
+        epoch_fraction (float, optional): Fraction of the samples of a rank (the dataset size over the number
+            of ranks, rounded up) drawn per epoch. Default is 1.
+        num_replicas (int, optional): Number of distributed ranks. Defaults to the world size.
+        rank (int, optional): Rank of the current process. Defaults to the current rank.
+        seed (int, optional): Random seed, identical on every rank. Default is 0.
+    """
+    def __init__(self,
+                 category_ids: Sequence[int],
+                 batch_size: int,
+                 categories: Optional[Sequence[str]] = None,
+                 weights: Optional[Dict[str, float]] = None,
+                 epoch_fraction: float = 1.0,
+                 num_replicas: Optional[int] = None,
+                 rank: Optional[int] = None,
+                 seed: int = 0):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        if not 0 < epoch_fraction <= 1:
+            raise ValueError("epoch_fraction must be in (0, 1]")
+
+        category_ids = np.asarray(category_ids, dtype=np.int64)
+        num_categories = int(category_ids.max()) + 1 if len(category_ids) else 0
+
+        # Same permutation on every rank, each rank owns a strided slice of it
+        ids = np.random.default_rng(seed).permutation(len(category_ids))[rank::num_replicas]
+        order = np.argsort(category_ids[ids], kind='stable')
+        self.index = ids[order] # ids grouped by category
+        self.counts = np.bincount(category_ids[ids], minlength=num_categories)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+        probs = np.ones(num_categories)
+        if weights:
+            if categories is None:
+                raise ValueError("Category names are needed to use category weights")
+            probs = np.array([weights.get(name, 1.0) for name in categories], dtype=np.float64)
+        probs[self.counts == 0] = 0 # nothing to draw from
+        if probs.sum() <= 0:
+            raise ValueError("No samples left to draw from, check the category weights")
+        self.probs = probs / probs.sum()
+
+        self.batch_size = batch_size
+        # Same number of batches on every rank, the ranks run their collectives in lockstep
+        per_rank = math.ceil(len(category_ids) / num_replicas)
+        self.num_batches = max(1, math.ceil(epoch_fraction * per_rank / batch_size))
+        self.rng = np.random.default_rng([seed, rank])
+        self.cursors = self.counts.copy() # exhausted, shuffled on first use
+        self.perms = [None] * num_categories
+
+    def _take(self, category: int, k: int) -> np.ndarray:
+        """Takes the next `k` ids of a category, reshuffling it whenever it is exhausted."""
+        taken = []
+        while k > 0:
+            if self.cursors[category] >= self.counts[category]:
+                start, end = self.offsets[category], self.offsets[category + 1]
+                self.perms[category] = self.rng.permutation(self.index[start:end])
+                self.cursors[category] = 0
+            cursor = self.cursors[category]
+            chunk = self.perms[category][cursor:cursor + k]
+            self.cursors[category] += len(chunk)
+            taken.append(chunk)
+            k -= len(chunk)
+        return np.concatenate(taken)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        for _ in range(self.num_batches):
+            per_category = np.bincount(self.rng.choice(len(self.probs), size=self.batch_size, p=self.probs),
+                                       minlength=len(self.probs))
+            batch = np.concatenate([self._take(c, k) for c, k in enumerate(per_category) if k])
+            self.rng.shuffle(batch)
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        return self.num_batches
+
+    def state_dict(self) -> dict:
+        """Returns the position of the sampler, to resume it from a checkpoint."""
+        return {
+            'rng': self.rng.bit_generator.state,
+            'cursors': self.cursors.copy(),
+            'perms': [None if perm is None else perm.copy() for perm in self.perms],
+        }
+
+    def load_state_dict(self, state: dict):
+        """Restores a position returned by `state_dict`."""
+        self.rng.bit_generator.state = state['rng']
+        self.cursors = np.asarray(state['cursors']).copy()
+        self.perms = list(state['perms'])
+
+
+class SampleLossTable:
+    """
+    Per-sample generator losses of a training set, indexed by sample id.
+
+    Holds an exponential moving average of the L1 and GAN loss of every
+    sample in flat tensors on the training device, updated in place from
+    the (N,) loss tensors returned by ``Pix2Pix.train_step(..., per_sample=True)``
+    without synchronizing with the host. Samples never seen have a count of 0.
+
+    Args:
+        num_samples (int): Number of samples of the dataset
+        momentum (float, optional): Weight of the previous value in the moving average. Default is 0.5.
+        device (torch.device, optional): Device of the table, the training device. Default is the CPU.
+    """
+    LOSSES = ('l1', 'gan')
+
+    def __init__(self, num_samples: int, momentum: float = 0.5, device: Optional[torch.device] = None):
+        if not 0 <= momentum < 1:
+            raise ValueError("momentum must be in [0, 1)")
+        self.momentum = momentum
+        self.values = torch.zeros(len(self.LOSSES), num_samples, device=device) # rows follow `LOSSES`
+        self.counts = torch.zeros(num_samples, dtype=torch.int32, device=device)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def to(self, device: torch.device) -> 'SampleLossTable':
+        """Moves the table to `device`, returns itself."""
+        self.values = self.values.to(device)
+        self.counts = self.counts.to(device)
+        return self
+
+    def update(self, indices: torch.Tensor, sample_l1: torch.Tensor, sample_gan: torch.Tensor):
+        """
+        Records the losses of a batch.
+
+        Args:
+            indices (torch.Tensor): Sample ids of the batch, shape (N,)
+            sample_l1 (torch.Tensor): Per-sample L1 losses, shape (N,)
+            sample_gan (torch.Tensor): Per-sample GAN losses, shape (N,)
+        """
+        indices = indices.to(self.values.device, non_blocking=True).long()
+        losses = torch.stack([sample_l1, sample_gan]).detach().float()
+        previous = self.values[:, indices]
+        # Samples drawn several times in the batch (sampling with replacement) are averaged
+        self.values.index_reduce_(1, indices, losses, 'mean', include_self=False)
+        # First sightings take the value as is, repeated ids write the same blended value
+        momentum = torch.where(self.counts[indices] > 0, self.momentum, 0.0)
+        self.values[:, indices] = momentum * previous + (1 - momentum) * self.values[:, indices]
+        self.counts.index_add_(0, indices, torch.ones_like(indices, dtype=self.counts.dtype))
+
+    def losses(self, name: str = 'l1') -> torch.Tensor:
+        """Returns the recorded losses of every sample, 'l1' or 'gan', on the device of the table."""
+        return self.values[self.LOSSES.index(name)]
+
+    def stats(self) -> dict:
+        """Returns summary statistics of the recorded losses, for logging."""
+        counts, l1 = self.counts.cpu(), self.losses('l1').cpu()
+        seen = counts > 0
+        l1 = l1[seen]
+        stats = {'hard_examples_seen': seen.float().mean().item()}
+        if len(l1):
+            stats.update({
+                'hard_examples_l1_mean': l1.mean().item(),
+                'hard_examples_l1_p90': l1.quantile(0.9).item() if len(l1) > 1 else l1.item(),
+            })
+        return stats
+
+    def state_dict(self) -> dict:
+        """Returns a CPU copy of the table, to save it with the checkpoints."""
+        return {'momentum': self.momentum, 'values': self.values.cpu().clone(), 'counts': self.counts.cpu().clone()}
+
+    def load_state_dict(self, state: dict):
+        """Restores a table returned by `state_dict`, the dataset must have the same samples."""
+        if state['counts'].shape != self.counts.shape:
+            raise ValueError(f"The loss table holds {len(state['counts'])} samples, the dataset has {len(self)}")
+        self.momentum = state['momentum']
+        self.values = state['values'].to(self.values.device, copy=True)
+        self.counts = state['counts'].to(self.counts.device, copy=True)
+
+
+class HardExampleSampler(Sampler[int]):
+    """
+    Draws training samples in proportion to their recorded loss, see `SampleLossTable`.
+
+    The weight of a sample is its loss relative to the mean loss, raised to
+    `alpha`, so hard pairs are oversampled and easy ones subsampled. A
+    `uniform_mix` share of the draws stays uniform so every pair keeps being
+    visited, and samples without a recorded loss get the largest weight
+    until they are seen once. The weights are recomputed at the start of
+    every epoch from the current table.
+
+    Args:
+        table (SampleLossTable): Per-sample losses, updated by the training loop
+        loss (str, optional): Loss to rank the samples by, 'l1' or 'gan'. Default is 'l1'.
+        alpha (float, optional): Sharpness of the weighting, 0 samples uniformly. Default is 1.
+        uniform_mix (float, optional): Share of uniform draws, in [0, 1]. Default is 0.2.
+        epoch_fraction (float, optional): Samples drawn per epoch, relative to the dataset size. Default is 1.
+        seed (int, optional): Random seed. Default is 0.
+    """
+    def __init__(self,
+                 table: SampleLossTable,
+                 loss: str = 'l1',
+                 alpha: float = 1.0,
+                 uniform_mix: float = 0.2,
+                 epoch_fraction: float = 1.0,
+                 seed: int = 0):
+        if loss not in SampleLossTable.LOSSES:
+            raise ValueError(f"loss must be one of {SampleLossTable.LOSSES}")
+        if not 0 <= uniform_mix <= 1:
+            raise ValueError("uniform_mix must be in [0, 1]")
+        self.table = table
+        self.loss = loss
+        self.alpha = alpha
+        self.uniform_mix = uniform_mix
+        self.num_samples = max(1, round(epoch_fraction * len(table)))
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def weights(self) -> torch.Tensor:
+        """Returns the current sampling probability of every sample."""
+        losses = self.table.losses(self.loss).cpu() # once per epoch
+        seen = self.table.counts.cpu() > 0
+        weights = torch.ones(len(self.table))
+        if seen.any():
+            relative = (losses[seen] / losses[seen].mean().clamp_min(1e-12)).clamp_min(0)
+            weights[seen] = relative.pow(self.alpha)
+            weights[~seen] = weights[seen].max() if self.alpha > 0 else 1.0 # explore unseen samples first
+        weights = weights / weights.sum()
+        return (1 - self.uniform_mix) * weights + self.uniform_mix / len(weights)
+
+    def __iter__(self) -> Iterator[int]:
+        yield from torch.multinomial(self.weights(), self.num_samples, replacement=True,
+                                     generator=self.generator).tolist()
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def state_dict(self) -> dict:
+        """Returns the state of the random generator, to resume the sampler."""
+        return {'generator': self.generator.get_state()}
+
+    def load_state_dict(self, state: dict):
+        """Restores a state returned by `state_dict`."""
+        self.generator.set_state(state['generator'])
@@ -0,0 +1,500 @@
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Literal, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from PIL import TiffImagePlugin
+from torch.utils.data import Dataset
+from torchvision.transforms import v2
+
+from .catalog import sar_to_optical_name
+from .dataset import SplitType, random_split_indices, read_split, write_split
+from .speckle import apply_speckle_filter
+
+SCENE_SUFFIXES = ('.npy', '.tif', '.tiff')
+
+# (bits per sample, TIFF sample format) -> numpy type, sample format 1 is unsigned, 2 signed, 3 float
+_TIFF_TYPES = {
+    (8, 1): 'u1', (16, 1): 'u2', (32, 1): 'u4',
+    (8, 2): 'i1', (16, 2): 'i2', (32, 2): 'i4',
+    (32, 3): 'f4', (64, 3): 'f8',
+}
+
+
+def _tiff_memmap(path: Path) -> np.memmap:
+    """
+    Memory-maps an uncompressed, strip-organized TIFF image.
+
+    Only the header is parsed, the pixels are never decoded, so the image
+    can be much larger than memory (and than the decompression bomb limit
+    of PIL).
+
+    Args:
+        path (Path): Path to the TIFF image
+
+    Returns:
+        np.memmap: Read-only (H, W) or (H, W, C) array
+    """
+    with open(path, 'rb') as f:
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(f.read(8))
+        f.seek(ifd.next)
+        ifd.load(f)
+
+    if ifd.get(259, 1) != 1:
+        raise ValueError(f"{path} is compressed, scenes must be uncompressed TIFF (or .npy) to be memory-mapped")
+    if 322 in ifd: # TileWidth
+        raise ValueError(f"{path} is tiled, scenes must be strip-organized TIFF (or .npy) to be memory-mapped")
+    if ifd.get(284, 1) != 1:
+        raise ValueError(f"{path} stores its bands as separate planes, interleaved (chunky) TIFF is required")
+
+    width, height, channels = ifd[256], ifd[257], ifd.get(277, 1)
+    bits = ifd.get(258, (1,))
+    fmt = ifd.get(339, (1,))
+    key = (bits[0], fmt[0] if isinstance(fmt, tuple) else fmt)
+    if len(set(bits)) != 1 or key not in _TIFF_TYPES:
+        raise ValueError(f"{path} has unsupported samples ({bits} bits, format {fmt})")
+    dtype = np.dtype(_TIFF_TYPES[key]).newbyteorder(ifd._endian)
+
+    # Strips written one after the other are a single contiguous array
+    offsets, counts = ifd[273], ifd[279]
+    if any(offsets[i] + counts[i] != offsets[i + 1] for i in range(len(offsets) - 1)) \
+            or sum(counts) != width * height * channels * dtype.itemsize:
+        raise ValueError(f"{path} has non-contiguous strips, rewrite it or convert it to .npy")
+
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offsets[0], shape=shape)
+
+
+def open_raster(path: Union[str, Path]) -> np.ndarray:
+    """
+    Memory-maps a scene raster.
+
+    Args:
+        path (str | Path): ``.npy`` array or uncompressed TIFF image of shape (H, W) or (H, W, C)
+
+    Returns:
+        np.ndarray: Read-only memory-mapped (H, W) or (H, W, C) array
+    """
+    path = Path(path)
+    if path.suffix == '.npy':
+        return np.load(path, mmap_mode='r')
+    return _tiff_memmap(path)
+
+
+def _optical_name(s1_name: str) -> str:
+    """Name of the optical scene of a SAR scene, the SEN1-2 convention if the name follows it, else the same name."""
+    parts = s1_name.split('_')
+    return sar_to_optical_name(s1_name) if len(parts) > 3 and parts[2] == 's1' else s1_name
+
+
+def _valid_pixels(band: np.ndarray, nodata: float) -> np.ndarray:
+    """(H, W) mask of the pixels of a (H, W) or (H, W, C) band that are not no-data in every channel."""
+    invalid = (band == nodata) | np.isnan(band) if band.dtype.kind == 'f' else band == nodata
+    return ~invalid.all(axis=-1) if band.ndim == 3 else ~invalid
+
+
+def valid_fraction(s1: np.ndarray,
+                   s2: np.ndarray,
+                   block: int,
+                   nodata: float = 0,
+                   mask: Optional[np.ndarray] = None,
+                   rows: int = 2048) -> np.ndarray:
+    """
+    Fraction of valid pixels of every `block` x `block` block of a scene.
+
+    A pixel is valid if neither its SAR nor its optical value is no-data
+    (or NaN) in every channel, and if `mask`, when given, is nonzero. The
+    scene is read in bands of `rows` rows, so the memory use does not
+    depend on the size of the scene. Trailing pixels that do not fill a
+    block are ignored.
+
+    Args:
+        s1 (np.ndarray): (H, W) or (H, W, C) SAR scene
+        s2 (np.ndarray): (H, W) or (H, W, C) optical scene
+        block (int): Side of the blocks in pixels
+        nodata (float, optional): No-data value of both scenes. Default is 0.
+        mask (np.ndarray, optional): (H, W) mask, nonzero where the scene is valid
+        rows (int, optional): Rows read at once, rounded down to a multiple of `block`. Default is 2048.
+
+    Returns:
+        np.ndarray: (H // block, W // block) float32 fractions
+    """
+    block_rows, block_cols = s1.shape[0] // block, s1.shape[1] // block
+    width = block_cols * block
+    step = max(rows // block, 1) * block
+    fraction = np.empty((block_rows, block_cols), dtype=np.float32)
+    for start in range(0, block_rows * block, step):
+        stop = min(start + step, block_rows * block)
+        valid = _valid_pixels(s1[start:stop, :width], nodata) & _valid_pixels(s2[start:stop, :width], nodata)
+        if mask is not None:
+            valid &= np.asarray(mask[start:stop, :width]) != 0
+        fraction[start // block:stop // block] = valid.reshape((stop - start) // block, block, block_cols, block) \
+            .mean(axis=(1, 3))
+    return fraction
+
+
+def _window_means(fraction: np.ndarray, size: int) -> np.ndarray:
+    """Mean of every `size` x `size` window of blocks (top-left aligned), with a summed-area table."""
+    table = np.pad(fraction.astype(np.float64).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    return (table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]) / (size * size)
+
+
+class SceneSentinel(Dataset):
+    """
+    A PyTorch Dataset that cuts Sentinel-1&2 pair windows out of large co-registered scenes.
+
+    Scenes are raw ``.npy`` arrays or uncompressed TIFF images of any size,
+    memory-mapped lazily in every process, so a window read only touches
+    its own pages. The layout mirrors `Sentinel`:
+    scene_dir/
+        category1/
+            s1/
+                scene1.tif
+            s2/
+                scene1.tif
+            mask/          (optional, nonzero where the scene is valid)
+                scene1.tif
+        category2/
+            ...
+
+    Optical scenes have the same name as their SAR scene, or follow the
+    SEN1-2 ``_s1_`` -> ``_s2_`` naming. Splits are made by scene, so no
+    training window overlaps a validation or test window, and split files
+    hold the relative paths of the SAR scenes.
+
+    Every scene gets a valid-pixel mask at `block` resolution (cached in
+    ``scene_dir/.scene_masks/``, recomputed when a scene changes). Windows
+    with less than `min_valid` valid pixels are never returned:
+
+    - ``'grid'`` sampling returns the valid windows of a fixed grid of step
+      `stride`, one per index, for reproducible validation and testing.
+    - ``'random'`` sampling draws a uniformly random valid window (at pixel
+      offsets) per index from the torch RNG, so every epoch sees new windows.
+      The dataset length is `windows_per_epoch`.
+
+    Args:
+        scene_dir (str | Path): Root directory of the scenes
+        split_type (str | None): Which split to use ('train', 'val', 'test') or None for all scenes
+        input_transform (callable, optional): Transform to apply to the SAR windows
+        target_transform (callable, optional): Transform to apply to the optical windows
+        split_mode (str, optional): How to split the scenes ('random', 'split')
+        split_ratio (Tuple[float, float, float], optional): Ratio of scenes for train/val/test splits
+        split_file (str | Path, optional): predefined the splits
+        seed (int, optional): Random seed for reproducible splitting
+        patch_size (int, optional): Side of the windows. Default is 256.
+        sampling (str, optional): 'random' or 'grid' windows. Default is 'random'.
+        stride (int, optional): Step of the grid, a multiple of `block`. Defaults to `patch_size`.
+        windows_per_epoch (int, optional): Length of the dataset with random sampling. Defaults to
+            the number of valid grid windows.
+        block (int, optional): Resolution of the valid-pixel masks, divides `patch_size`. Default is 32.
+        min_valid (float, optional): Minimum fraction of valid pixels of a window. Default is 0.99.
+        nodata (float, optional): No-data value of the scenes. Default is 0.
+        value_range (Dict[str, Tuple[float, float]], optional): (low, high) values mapped to [0, 255]
+            per modality ('s1', 's2'), required for and only applied to scenes that are not uint8,
+            e.g. dB SAR scenes
+        optical_bands (Sequence[int], optional): Bands of the optical scenes used as RGB,
+            e.g. [3, 2, 1] for B4, B3, B2 of a 13-band Sentinel-2 scene
+        sar_channels (int, optional): Channels of the SAR windows, single-band scenes are
+            replicated to 3 channels. Default is 3.
+        return_index (bool, optional): Also return the window index, 'grid' sampling only. Default is False.
+        speckle_filter (dict, optional): Speckle filter spec (see `src.speckle`), applied to every SAR
+            window as it is at inference
+
+    Attributes:
+        image_pairs (List[Tuple[Path, Path]]): (SAR, optical) paths of the scenes of the split
+        windows (np.ndarray): (N, 3) (scene, top, left) grid windows
+    """
+    MASK_DIR = '.scene_masks'
+
+    def __init__(self,
+                 scene_dir: Union[str, Path],
+                 split_type: Optional[str] = None,
+                 input_transform: Optional[Callable] = None,
+                 target_transform: Optional[Callable] = None,
+                 split_mode: Literal['random', 'split'] = 'random',
+                 split_ratio: Tuple[float, float, float] = (0.7, 0.15, 0.15),
+                 split_file: Optional[Union[str, Path]] = None,
+                 seed: int = 42,
+                 patch_size: int = 256,
+                 sampling: Literal['random', 'grid'] = 'random',
+                 stride: Optional[int] = None,
+                 windows_per_epoch: Optional[int] = None,
+                 block: int = 32,
+                 min_valid: float = 0.99,
+                 nodata: float = 0,
+                 value_range: Optional[Dict[str, Tuple[float, float]]] = None,
+                 optical_bands: Optional[Sequence[int]] = None,
+                 sar_channels: int = 3,
+                 return_index: bool = False,
+                 speckle_filter: Optional[dict] = None):
+        self.root_dir = Path(scene_dir)
+        if not self.root_dir.exists():
+            raise FileNotFoundError(f"Scene directory not found: {self.root_dir}")
+        if sampling not in ('random', 'grid'):
+            raise ValueError(f"Unknown window sampling {sampling}, use 'random' or 'grid'")
+        stride = stride or patch_size
+        if patch_size % block or stride % block:
+            raise ValueError(f"patch_size ({patch_size}) and stride ({stride}) must be multiples of block ({block})")
+        if return_index and sampling != 'grid':
+            raise ValueError("Window indices are only meaningful with 'grid' sampling")
+        if sar_channels not in (1, 3):
+            raise ValueError(f"SAR images can be decoded to 1 or 3 channels, got {sar_channels}")
+
+        self.split_type = SplitType(split_type) if split_type else None
+        self.input_transform = input_transform if input_transform else v2.Compose([
+            v2.ToImage(),
+            v2.ToDtype(torch.float32, scale=True)
+        ])
+        self.target_transform = target_transform if target_transform else self.input_transform
+        self.patch_size = patch_size
+        self.sampling = sampling
+        self.block = block
+        self.min_valid = min_valid
+        self.nodata = nodata
+        self.value_range = value_range or {}
+        self.optical_bands = list(optical_bands) if optical_bands is not None else None
+        self.sar_channels = sar_channels
+        self.return_index = return_index
+        self.speckle_filter = speckle_filter
+        self._rasters: Dict[Tuple[int, str], np.ndarray] = {} # opened lazily, per process
+
+        # Collect scenes
+        self.all_image_pairs, self._masks = self._collect_scenes()
+
+        # Apply split if specified, by scene
+        if split_type:
+            if split_mode == 'split' and split_file:
+                split_filenames = read_split(split_file, self.split_type)
+                selected = [i for i, keys in enumerate(self.all_pair_keys)
+                            if keys[0] in split_filenames or keys[1] in split_filenames]
+            elif split_mode == 'random':
+                selected = random_split_indices(len(self.all_image_pairs), split_ratio, seed, self.split_type)
+            else:
+                raise ValueError("Invalid split configuration. Use either 'split' with a split_file or 'random' with split_ratio")
+        else:
+            selected = list(range(len(self.all_image_pairs)))
+        self.image_pairs = [self.all_image_pairs[i] for i in selected]
+        self.pair_keys = [self.all_pair_keys[i] for i in selected]
+        self.mask_paths = [self._masks[i] for i in selected]
+
+        for scene in range(len(self.image_pairs)):
+            self._check_scene(scene)
+        self.windows, self.candidates = self._index_windows(stride)
+        self.windows_per_epoch = windows_per_epoch or len(self.windows)
+        if sampling == 'random' and self.windows_per_epoch and not len(self.candidates):
+            raise ValueError(f"No scene has a {patch_size}x{patch_size} window with {min_valid:.0%} valid pixels")
+
+        print(f'Total scenes found: {len(self.image_pairs)}, {len(self.windows)} grid windows, '
+              f'{len(self)} {sampling} windows per epoch')
+
+    def _collect_scenes(self) -> Tuple[List[Tuple[Path, Path]], List[Optional[Path]]]:
+        """
+        Collects paired SAR (s1) and optical (s2) scenes, with their optional masks.
+
+        Returns:
+            Tuple[List[Tuple[Path, Path]], List[Optional[Path]]]: (SAR scene, optical scene) pairs and
+                the mask of every pair (None if it has none)
+        """
+        image_pairs, masks = [], []
+        self.all_pair_keys = []
+        for category in sorted(self.root_dir.iterdir()):
+            s1_path, s2_path = category / 's1', category / 's2'
+            if not (s1_path.is_dir() and s2_path.is_dir()):
+                continue
+            for s1_file in sorted(s1_path.iterdir()):
+                if s1_file.suffix.lower() not in SCENE_SUFFIXES:
+                    continue
+                s2_file = s2_path / _optical_name(s1_file.name)
+                if not s2_file.exists(): # missing optical scene
+                    continue
+                mask_file = category / 'mask' / s1_file.name
+                image_pairs.append((s1_file, s2_file))
+                masks.append(mask_file if mask_file.exists() else None)
+                self.all_pair_keys.append((f'{category.name}/s1/{s1_file.name}', f'{category.name}/s2/{s2_file.name}'))
+        return image_pairs, masks
+
+    def _raster(self, scene: int, modality: str) -> np.ndarray:
+        """Returns the memory-mapped raster of a scene ('s1', 's2' or 'mask'), opening it on first use."""
+        key = (scene, modality)
+        if key not in self._rasters:
+            path = self.mask_paths[scene] if modality == 'mask' else self.image_pairs[scene][modality == 's2']
+            self._rasters[key] = open_raster(path)
+        return self._rasters[key]
+
+    def _check_scene(self, scene: int):
+        """Checks that a scene pair is co-registered and can be converted to the model channels."""
+        s1, s2 = self._raster(scene, 's1'), self._raster(scene, 's2')
+        name = self.pair_keys[scene][0]
+        if s1.shape[:2] != s2.shape[:2] or \
+                (self.mask_paths[scene] is not None and self._raster(scene, 'mask').shape[:2] != s1.shape[:2]):
+            raise ValueError(f"Scene {name} is not co-registered: SAR {s1.shape[:2]}, optical {s2.shape[:2]}")
+        sar_bands = s1.shape[2] if s1.ndim == 3 else 1
+        if sar_bands != self.sar_channels and sar_bands != 1:
+            raise ValueError(f"Scene {name} has {sar_bands} SAR bands, expected 1 or {self.sar_channels}")
+        optical_bands = s2.shape[2] if s2.ndim == 3 else 1
+        if self.optical_bands is None and optical_bands != 3:
+            raise ValueError(f"Scene {name} has {optical_bands} optical bands, set optical_bands to pick 3 of them")
+        for modality, raster in (('s1', s1), ('s2', s2)):
+            if raster.dtype != np.uint8 and modality not in self.value_range:
+                raise ValueError(f"Scene {name} has {raster.dtype} {modality} pixels, "
+                                 f"set value_range[{modality!r}] to scale them to uint8")
+
+    def _valid_fraction(self, scene: int) -> np.ndarray:
+        """Returns the block valid-pixel fractions of a scene, from the cache if the scene did not change."""
+        paths = [*self.image_pairs[scene], self.mask_paths[scene]]
+        stamp = np.array([self.block, self.nodata] + [value for path in paths for value in
+                          ((path.stat().st_size, path.stat().st_mtime_ns) if path is not None else (-1, -1))],
+                         dtype=np.float64)
+        cache_file = self.root_dir / self.MASK_DIR / (self.pair_keys[scene][0].replace('/', '__') + '.npz')
+        if cache_file.exists():
+            try:
+                with np.load(cache_file) as cached:
+                    if np.array_equal(cached['stamp'], stamp):
+                        return cached['fraction']
+            except (OSError, ValueError, KeyError) as e:
+                print(f'Could not read valid-pixel mask, recomputing it\n\t{e}')
+
+        print(f'Computing the valid-pixel mask of {self.pair_keys[scene][0]}')
+        mask = self._raster(scene, 'mask') if self.mask_paths[scene] is not None else None
+        fraction = valid_fraction(self._raster(scene, 's1'), self._raster(scene, 's2'),
+                                  self.block, self.nodata, mask)
+        cache_file.parent.mkdir(exist_ok=True)
+        tmp = cache_file.with_name(f'{cache_file.stem}.{os.getpid()}.tmp.npz')
+        np.savez(tmp, fraction=fraction, stamp=stamp)
+        os.replace(tmp, cache_file) # readers never see a partial file
+        return fraction
+
+    def _index_windows(self, stride: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Lists the valid windows of the scenes of the split.
+
+        Args:
+            stride (int): Step of the grid windows
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (N, 3) (scene, top, left) grid windows in pixels, and
+                (M, 3) (scene, block row, block column) origins of the random windows
+        """
+        size, step = self.patch_size // self.block, stride // self.block
+        # A random window starts anywhere in its origin block, so it lies in the (size + 1)-block window of
+        # that block. It cannot hold more invalid pixels than this larger window, which is checked instead.
+        max_invalid = (1 - self.min_valid) * size * size + 1e-6
+        windows, candidates = [], []
+        for scene in range(len(self.image_pairs)):
+            fraction = self._valid_fraction(scene)
+            if min(fraction.shape) < size:
+                continue # smaller than a window
+            grid = _window_means(fraction, size)[::step, ::step] >= self.min_valid - 1e-6
+            rows, cols = np.nonzero(grid)
+            windows.append(np.stack([np.full_like(rows, scene), rows * stride, cols * stride], axis=1))
+
+            if min(fraction.shape) > size:
+                enlarged = (1 - _window_means(fraction, size + 1)) * (size + 1) ** 2 <= max_invalid
+                rows, cols = np.nonzero(enlarged)
+                candidates.append(np.stack([np.full_like(rows, scene), rows, cols], axis=1))
+        empty = np.empty((0, 3), dtype=np.int64)
+        return (np.concatenate(windows).astype(np.int64) if windows else empty,
+                np.concatenate(candidates).astype(np.int64) if candidates else empty)
+
+    def _to_uint8(self, window: np.ndarray, modality: str) -> np.ndarray:
+        """Scales a window that is not uint8 to uint8 with the value range of its modality."""
+        if window.dtype == np.uint8:
+            return np.asarray(window)
+        low, high = self.value_range[modality]
+        scaled = (np.nan_to_num(window.astype(np.float32), nan=low) - low) * (255.0 / (high - low))
+        return np.clip(np.rint(scaled), 0, 255).astype(np.uint8)
+
+    def _load_window(self, scene: int, top: int, left: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Reads a window of a scene pair.
+
+        Args:
+            scene (int): Index of the scene in the split
+            top (int): Top row of the window
+            left (int): Left column of the window
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: uint8 (C, H, W) (SAR window, optical window) pair
+        """
+        rows, cols = slice(top, top + self.patch_size), slice(left, left + self.patch_size)
+        s1 = self._to_uint8(self._raster(scene, 's1')[rows, cols], 's1')
+        s2 = self._raster(scene, 's2')[rows, cols]
+        if self.optical_bands is not None:
+            s2 = s2[..., self.optical_bands]
+        s2 = self._to_uint8(s2, 's2')
+
+        if s1.ndim == 2:
+            s1 = s1[..., None]
+        if s1.shape[2] != self.sar_channels:
+            s1 = np.repeat(s1, self.sar_channels, axis=2) # single-band SAR, as PIL converts 'L' to 'RGB'
+        if s2.ndim == 2:
+            s2 = np.repeat(s2[..., None], 3, axis=2)
+        s1 = apply_speckle_filter(s1, self.speckle_filter) if self.speckle_filter else s1
+
+        s1_image = torch.from_numpy(np.ascontiguousarray(s1)).permute(2, 0, 1) # HWC -> CHW
+        s2_image = torch.from_numpy(np.ascontiguousarray(s2)).permute(2, 0, 1)
+        return s1_image, s2_image
+
+    def save_split(self, output_file: Union[str, Path], is_exists: bool = False):
+        """
+        Saves the scenes of the current split to a JSON file.
+
+        Args:
+            output_file: Path to save the split configuration
+            is_exists: If file exist, add new split data
+        """
+        if self.split_type:
+            write_split(output_file, self.split_type, [s1 for s1, _ in self.pair_keys], is_exists)
+
+    def categories(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Returns the category names and the category id of every grid window.
+
+        Returns:
+            Tuple[List[str], np.ndarray]: Sorted category names and one id (index into the names) per window
+        """
+        if self.sampling != 'grid':
+            raise ValueError("Window categories are only defined with 'grid' sampling")
+        names = [s1.split('/')[0] for s1, _ in self.pair_keys]
+        categories = sorted(set(names))
+        scene_ids = np.array([categories.index(name) for name in names], dtype=np.int64)
+        return categories, scene_ids[self.windows[:, 0]] if len(self.windows) else np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        """Returns the number of windows per epoch."""
+        return len(self.windows) if self.sampling == 'grid' else self.windows_per_epoch
+
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Retrieves a window pair.
+
+        Args:
+            idx (int): Index of the grid window, ignored with random sampling
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Processed (SAR window, optical window) pair,
+                followed by `idx` if `return_index` is set
+        """
+        if self.sampling == 'grid':
+            scene, top, left = self.windows[idx].tolist()
+        else:
+            # Drawn from the torch RNG, which the DataLoader seeds differently in every worker and epoch
+            scene, row, col = self.candidates[torch.randint(len(self.candidates), ()).item()].tolist()
+            offset_y, offset_x = torch.randint(self.block, (2,)).tolist()
+            top, left = row * self.block + offset_y, col * self.block + offset_x
+        s1_image, s2_image = self._load_window(scene, top, left)
+
+        # Apply transforms
+        s1_image = self.input_transform(s1_image)
+        s2_image = self.target_transform(s2_image)
+
+        if self.return_index:
+            return s1_image, s2_image, idx
+        return s1_image, s2_image
+
+    def __getstate__(self):
+        # Memory maps are reopened in each DataLoader worker instead of being pickled
+        state = self.__dict__.copy()
+        state['_rasters'] = {}
+        return state
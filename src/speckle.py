@@ -0,0 +1,133 @@
+"""
+Vectorized speckle filters for SAR images.
+
+The filters work on whole numpy batches, so the same code preprocesses the
+dataset once (``utils/speckle_filter.py``) and filters inputs at inference
+time (``inference.py``, ``onnx_inference.py``, ``backend/app.py``). A filter
+is described by a spec such as ``{'name': 'lee', 'size': 7, 'looks': 4}``,
+as in `dataset.speckle_filter` of config.yaml.
+"""
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+FILTERS = ('lee', 'median')
+
+
+def _pad(images: np.ndarray, size: int) -> np.ndarray:
+    """Reflect-pads the spatial axes (1 and 2) of a (N, H, W) batch for a `size` x `size` window."""
+    radius = size // 2
+    return np.pad(images, ((0, 0), (radius, radius), (radius, radius)), mode='reflect')
+
+
+def box_mean(images: np.ndarray, size: int) -> np.ndarray:
+    """Mean over a `size` x `size` window around every pixel of a (N, H, W) batch, with summed-area tables."""
+    padded = _pad(images.astype(np.float64), size)
+    table = np.pad(padded.cumsum(axis=1).cumsum(axis=2), ((0, 0), (1, 0), (1, 0)))
+    height, width = images.shape[1:]
+    total = table[:, size:size + height, size:size + width] - table[:, :height, size:size + width] \
+        - table[:, size:size + height, :width] + table[:, :height, :width]
+    return total / (size * size)
+
+
+def lee_filter(images: np.ndarray, size: int = 7, looks: float = 4.0) -> np.ndarray:
+    """
+    Lee filter of a (N, H, W) batch, for multiplicative speckle of `looks` looks.
+
+    Every pixel is pulled towards its local mean, less so where the local
+    variance is above what speckle alone explains (edges, point targets).
+    The speckle model expects intensity-like pixels. Use the median filter
+    for log-scaled (dB) images.
+
+    Args:
+        images (np.ndarray): Batch of shape (N, H, W)
+        size (int, optional): Odd window size. Default is 7.
+        looks (float, optional): Equivalent number of looks of the images. Default is 4.
+
+    Returns:
+        np.ndarray: Filtered float64 batch
+    """
+    images = images.astype(np.float64)
+    mean = box_mean(images, size)
+    variance = np.maximum(box_mean(images * images, size) - mean * mean, 0)
+    noise = 1.0 / looks # squared coefficient of variation of the speckle
+    signal_variance = np.maximum((variance - mean * mean * noise) / (1 + noise), 0)
+    weight = signal_variance / np.maximum(signal_variance + mean * mean * noise, 1e-12)
+    return mean + weight * (images - mean)
+
+
+def median_filter(images: np.ndarray, size: int = 5, chunk: int = 8) -> np.ndarray:
+    """
+    Median filter of a (N, H, W) batch.
+
+    Args:
+        images (np.ndarray): Batch of shape (N, H, W)
+        size (int, optional): Odd window size. Default is 5.
+        chunk (int, optional): Images processed at once, bounds the memory of the window view. Default is 8.
+
+    Returns:
+        np.ndarray: Filtered batch, same dtype as `images`
+    """
+    out = np.empty_like(images)
+    middle = size * size // 2
+    for start in range(0, len(images), chunk):
+        windows = np.lib.stride_tricks.sliding_window_view(_pad(images[start:start + chunk], size),
+                                                           (size, size), axis=(1, 2))
+        windows = windows.reshape(*windows.shape[:3], -1)
+        out[start:start + chunk] = np.partition(windows, middle, axis=-1)[..., middle]
+    return out
+
+
+def filter_tag(spec: dict) -> str:
+    """Returns a short name of a filter spec, e.g. 'lee7_l4' for {'name': 'lee', 'size': 7, 'looks': 4}."""
+    name, size = spec['name'], spec.get('size', 7 if spec['name'] == 'lee' else 5)
+    if name == 'lee':
+        return f"lee{size}_l{spec.get('looks', 4.0):g}"
+    return f'{name}{size}'
+
+
+def filtered_path(s1_path: Union[str, Path], spec: dict) -> Path:
+    """Returns where the filtered variant of a SAR image is stored, ``<category>/s1_<tag>/<name>``."""
+    s1_path = Path(s1_path)
+    return s1_path.parent.with_name(f's1_{filter_tag(spec)}') / s1_path.name
+
+
+def apply_speckle_filter(images: np.ndarray, spec: Optional[dict]) -> np.ndarray:
+    """
+    Applies a filter spec to uint8 images.
+
+    Args:
+        images (np.ndarray): (H, W), (H, W, C), (N, H, W) or (N, H, W, C) uint8 images. 3D arrays
+            are read as a batch of single-channel images unless the last axis has 1 or 3 channels
+        spec (dict | None): Filter spec, None returns the images as is
+
+    Returns:
+        np.ndarray: Filtered uint8 images of the same shape
+    """
+    if not spec:
+        return images
+    if spec['name'] not in FILTERS:
+        raise ValueError(f"Unknown speckle filter {spec['name']}, use one of {FILTERS}")
+
+    shape = images.shape
+    if images.ndim == 2:
+        batch = images[None]
+    else:
+        if images.ndim == 3 and shape[-1] not in (1, 3): # (N, H, W)
+            images = images[..., None]
+        elif images.ndim == 3: # (H, W, C)
+            images = images[None]
+        # Channels are filtered independently, as images of their own
+        batch = np.moveaxis(images, -1, 1).reshape(-1, *images.shape[1:3])
+
+    if spec['name'] == 'lee':
+        filtered = lee_filter(batch, spec.get('size', 7), spec.get('looks', 4.0))
+    else:
+        filtered = median_filter(batch, spec.get('size', 5))
+    filtered = np.clip(np.rint(filtered), 0, 255).astype(np.uint8)
+
+    if len(shape) == 2:
+        return filtered[0]
+    filtered = np.moveaxis(filtered.reshape(images.shape[0], images.shape[-1], *images.shape[1:3]), 1, -1)
+    return filtered.reshape(shape)
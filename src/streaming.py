@@ -0,0 +1,260 @@
+import io
+import random
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, Iterator, List, Literal, Optional, Sequence, Tuple, Union
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision.transforms import v2
+from torchvision.transforms.v2 import functional as F
+
+from .catalog import sar_to_optical_name
+from .dataset import SplitType, open_image, random_split_indices, read_split, write_split
+
+# (archive index, member name, offset of the member in the archive, size of the member)
+Member = Tuple[int, str, int, int]
+
+
+def _is_uncompressed_tar(path: Path) -> bool:
+    """Returns True if `path` is a tar archive without compression."""
+    try:
+        with tarfile.open(path, 'r:'):
+            return True
+    except tarfile.TarError:
+        return False
+
+
+class StreamingSentinel(IterableDataset):
+    """
+    A streaming PyTorch Dataset that reads Sentinel-1&2 image pairs straight from zip or tar archives.
+
+    Archives only need to contain the usual ``<category>/s1|s2/<image>.png``
+    layout at any depth (e.g. the Kaggle ``v_2/`` archive), nothing is
+    extracted to disk. Pairs are matched with the same filename rule as
+    `Sentinel._collect_images`, keyed by their ``<category>/s1/<image>.png``
+    path and sorted by key like `Sentinel`, so random and predefined splits
+    select the same pairs as `Sentinel` and split files are interchangeable.
+
+    The selected pairs are read in archive order, grouped into shards of
+    `shard_size` consecutive pairs. Every DataLoader worker (of every
+    distributed rank) owns a disjoint set of shards, and a bounded shuffle
+    buffer replaces global shuffling. Call `set_epoch` before every epoch to
+    reshuffle the shard assignment and the buffer.
+
+    Args:
+        archives (Sequence[str | Path]): zip or uncompressed tar archives
+        split_type (str | None): Which split to use ('train', 'val', 'test') or None for full dataset
+        input_transform (callable, optional): Transform to apply to the SAR images
+        target_transform (callable, optional): Transform to apply to the optical images
+        split_mode (str, optional): How to split the dataset ('random', 'split')
+        split_ratio (Tuple[float, float, float], optional): Ratio for train/val/test splits
+        split_file (str | Path, optional): predefined the splits
+        seed (int, optional): Random seed for reproducible splitting and shuffling
+        shard_size (int, optional): Number of consecutive pairs read by a worker at once. Default is 256.
+        shuffle_buffer (int, optional): Size of the shuffle buffer, 0 keeps the archive order. Default is 0.
+        sar_channels (int, optional): Channels of the decoded SAR images (1 or 3). Default is 3.
+    """
+    def __init__(self,
+                 archives: Sequence[Union[str, Path]],
+                 split_type: Optional[str] = None,
+                 input_transform: Optional[Callable] = None,
+                 target_transform: Optional[Callable] = None,
+                 split_mode: Literal['random', 'split'] = 'random',
+                 split_ratio: Tuple[float, float, float] = (0.7, 0.15, 0.15),
+                 split_file: Optional[Union[str, Path]] = None,
+                 seed: int = 42,
+                 shard_size: int = 256,
+                 shuffle_buffer: int = 0,
+                 sar_channels: int = 3):
+        super(StreamingSentinel, self).__init__()
+        self.archives = [Path(archive) for archive in archives]
+        for archive in self.archives:
+            if not archive.exists():
+                raise FileNotFoundError(f"Dataset archive not found: {archive}")
+            if not zipfile.is_zipfile(archive) and not _is_uncompressed_tar(archive):
+                # Members are read by offset, a compressed stream would be decompressed again
+                # from the start for every backward seek
+                raise ValueError(f"{archive} is not a zip or uncompressed tar archive, decompress it first")
+
+        self.split_type = SplitType(split_type) if split_type else None
+        self.input_transform = input_transform if input_transform else v2.Compose([
+            v2.ToImage(),
+            v2.ToDtype(torch.float32, scale=True)
+        ])
+        self.target_transform = target_transform if target_transform else self.input_transform
+        self.seed = seed
+        self.shard_size = shard_size
+        self.shuffle_buffer = shuffle_buffer
+        self.sar_channels = sar_channels
+        self.epoch = 0
+        self._handles = {} # opened lazily, per process
+
+        # Collect image pairs, sorted by key so splits do not depend on the archive order
+        self.all_image_pairs = sorted(self._collect_members().items())
+
+        # Apply split if specified
+        if split_type:
+            if split_mode == 'split' and split_file:
+                split_filenames = read_split(split_file, self.split_type)
+                # Split files may list either the SAR or the optical image of a pair, as for `Sentinel`
+                self.image_pairs = [pair for pair in self.all_image_pairs
+                                    if pair[0] in split_filenames or self._optical_key(pair[0]) in split_filenames]
+            elif split_mode == 'random':
+                split_indices = random_split_indices(len(self.all_image_pairs), split_ratio, seed, self.split_type)
+                self.image_pairs = [self.all_image_pairs[i] for i in split_indices]
+            else:
+                raise ValueError("Invalid split configuration. Use either 'split' with a split_file or 'random' with split_ratio")
+        else:
+            self.image_pairs = self.all_image_pairs
+
+        # Read the split sequentially, in archive order
+        self.image_pairs = sorted(self.image_pairs, key=lambda pair: (pair[1][0][0], pair[1][0][2]))
+
+        print(f'Total image pairs found: {len(self.image_pairs)}')
+
+    def _list_members(self, archive_idx: int) -> Iterator[Member]:
+        """Yields every file of an archive."""
+        archive = self.archives[archive_idx]
+        if zipfile.is_zipfile(archive):
+            with zipfile.ZipFile(archive) as f:
+                for info in f.infolist():
+                    if not info.is_dir():
+                        yield archive_idx, info.filename, info.header_offset, info.file_size
+        else:
+            with tarfile.open(archive, 'r:') as f:
+                for info in f:
+                    if info.isfile():
+                        yield archive_idx, info.name, info.offset_data, info.size
+
+    def _collect_members(self) -> Dict[str, Tuple[Member, Member]]:
+        """
+        Collects paired SAR (s1) and optical (s2) archive members.
+
+        Returns:
+            Dict[str, Tuple[Member, Member]]: (SAR member, optical member) pairs keyed by
+                the relative SAR path, e.g. 'agri/s1/ROIs1970_fall_s1_13_p265.png'
+        """
+        members = {}
+        for archive_idx in range(len(self.archives)):
+            for member in self._list_members(archive_idx):
+                parts = PurePosixPath(member[1]).parts
+                if len(parts) < 3 or parts[-2] not in ('s1', 's2') or not member[1].endswith('.png'):
+                    continue
+                members['/'.join(parts[-3:])] = member
+
+        pairs = {}
+        for key, member in members.items():
+            category, modality, s1_name = key.split('/')
+            if modality != 's1':
+                continue
+            s2_member = members.get(f'{category}/s2/{sar_to_optical_name(s1_name)}')
+            if s2_member is None: # missing optical image
+                continue
+            pairs[key] = (member, s2_member)
+        return pairs
+
+    def _read(self, member: Member) -> bytes:
+        """Reads an archive member, opening the archive on first use."""
+        archive_idx, name, offset, size = member
+        if archive_idx not in self._handles:
+            archive = self.archives[archive_idx]
+            self._handles[archive_idx] = zipfile.ZipFile(archive) if zipfile.is_zipfile(archive) \
+                else tarfile.open(archive, 'r:')
+        handle = self._handles[archive_idx]
+        if isinstance(handle, zipfile.ZipFile):
+            return handle.read(name)
+        # Tar members are read by offset, looking them up by name is a linear search
+        handle.fileobj.seek(offset)
+        return handle.fileobj.read(size)
+
+    @staticmethod
+    def _optical_key(key: str) -> str:
+        """Returns the relative path of the optical image paired with a SAR key."""
+        category, _, s1_name = key.split('/')
+        return f'{category}/s2/{sar_to_optical_name(s1_name)}'
+
+    def _load_pair(self, pair: Tuple[Member, Member]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Decodes a pair of archive members into uint8 (C, H, W) tensors."""
+        s1_member, s2_member = pair
+        s1_mode = 'L' if self.sar_channels == 1 else 'RGB'
+        s1_image = F.pil_to_tensor(open_image(io.BytesIO(self._read(s1_member)), s1_mode))
+        s2_image = F.pil_to_tensor(open_image(io.BytesIO(self._read(s2_member)), 'RGB'))
+        return s1_image, s2_image
+
+    @staticmethod
+    def _consumer() -> Tuple[int, int, int, int]:
+        """Returns the (rank, world size, worker id, number of workers) of the calling DataLoader worker."""
+        worker_info = get_worker_info()
+        num_workers, worker_id = (worker_info.num_workers, worker_info.id) if worker_info else (1, 0)
+        world_size, rank = (dist.get_world_size(), dist.get_rank()) \
+            if dist.is_available() and dist.is_initialized() else (1, 0)
+        return rank, world_size, worker_id, num_workers
+
+    def _rank_shards(self) -> List[List[Tuple[Member, Member]]]:
+        """Returns the shards read by the workers of the calling rank."""
+        shards = [[pair for _, pair in self.image_pairs[i:i + self.shard_size]]
+                  for i in range(0, len(self.image_pairs), self.shard_size)]
+        # Same permutation in every worker and rank, so the assignment stays disjoint
+        order = list(range(len(shards)))
+        random.Random(self.seed + self.epoch).shuffle(order)
+        rank, world_size, _, _ = self._consumer()
+        return [shards[i] for i in sorted(order[rank::world_size])]
+
+    def _owned_shards(self) -> List[List[Tuple[Member, Member]]]:
+        """Returns the shards read by the calling worker of the calling rank."""
+        # The shards of a rank are split across its workers, so the rank reads the same
+        # pairs whatever its number of workers
+        _, _, worker_id, num_workers = self._consumer()
+        rank_shards = self._rank_shards()
+        # Owned shards are read front to back, the shuffle buffer mixes them
+        return [rank_shards[i] for i in sorted(range(worker_id, len(rank_shards), num_workers))]
+
+    def set_epoch(self, epoch: int):
+        """Sets the epoch used to reshuffle shards and the shuffle buffer."""
+        self.epoch = epoch
+
+    def save_split(self, output_file: Union[str, Path], is_exists: bool = False):
+        """
+        Saves the current split configuration to a JSON file.
+
+        Args:
+            output_file: Path to save the split configuration
+            is_exists: If file exist, add new split data
+        """
+        if self.split_type:
+            write_split(output_file, self.split_type, [key for key, _ in self.image_pairs], is_exists)
+
+    def __len__(self):
+        """Returns the number of image pairs read by the calling rank this epoch, over all its workers."""
+        return sum(len(shard) for shard in self._rank_shards())
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        rng = random.Random(hash((self.seed, self.epoch, self._consumer())))
+        buffer = []
+        for shard in self._owned_shards():
+            for pair in shard:
+                sample = self._load_pair(pair)
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                if buffer: # yield a random buffered sample and keep the new one
+                    i = rng.randrange(len(buffer))
+                    sample, buffer[i] = buffer[i], sample
+                yield self._transform(sample)
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._transform(sample)
+
+    def _transform(self, sample: Tuple[torch.Tensor, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        s1_image, s2_image = sample
+        return self.input_transform(s1_image), self.target_transform(s2_image)
+
+    def __getstate__(self):
+        # Archive handles are reopened in each DataLoader worker instead of being pickled
+        state = self.__dict__.copy()
+        state['_handles'] = {}
+        return state
@@ -0,0 +1,106 @@
+"""
+Lightweight timers of the phases of the training steps.
+
+`PhaseTimer.phase` times a block of code. On CPU it reads the clock
+around the block. On CUDA, where kernels run asynchronously, it records a
+pair of CUDA events instead, so timing a step never waits for the device:
+the events are only read by `summary`, once per epoch. The cost is a few
+microseconds per phase, low enough to keep the timers on.
+
+The throughput only counts the time spent inside `steps`, e.g. the step
+loop of an epoch, not the validation or checkpoints around it.
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict
+
+import numpy as np
+import torch
+
+
+class PhaseTimer:
+    """
+    Durations of named phases (data wait, transfer, generator forward, ...) and the samples processed.
+
+    Args:
+        device (torch.device): Device the timed phases run on
+        enabled (bool, optional): If False, `phase` is a no-op. Default is True.
+    """
+    def __init__(self, device: torch.device, enabled: bool = True):
+        self.enabled = enabled
+        self.use_events = enabled and device.type == 'cuda'
+        self.reset()
+
+    def reset(self):
+        """Clears the durations, samples and step time."""
+        self.durations = defaultdict(list) # seconds, or (start, end) CUDA events
+        self.num_samples = 0
+        self.step_time = 0.0
+
+    @contextmanager
+    def steps(self):
+        """Context whose duration counts towards the throughput, e.g. the step loop of an epoch."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.use_events:
+                torch.cuda.synchronize() # the steps are done when their kernels are
+            self.step_time += time.perf_counter() - start
+
+    @contextmanager
+    def _phase(self, name: str):
+        if self.use_events:
+            start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+            start.record()
+            yield
+            end.record()
+            self.durations[name].append((start, end))
+        else:
+            start = time.perf_counter()
+            yield
+            self.durations[name].append(time.perf_counter() - start)
+
+    def phase(self, name: str):
+        """Context timing a block of code as one occurrence of the phase `name`."""
+        return self._phase(name) if self.enabled else nullcontext()
+
+    def add(self, name: str, seconds: float):
+        """Records a duration measured on the host, e.g. the wait for the next batch."""
+        if self.enabled:
+            self.durations[name].append(seconds)
+
+    def add_samples(self, count: int):
+        """Counts samples processed, for the throughput."""
+        self.num_samples += count
+
+    def summary(self, percentiles=(50, 90, 99)) -> Dict[str, float]:
+        """
+        Returns the throughput over `steps` and the duration statistics of every phase since the last reset.
+
+        Reading CUDA events waits for the device, call it once per epoch.
+
+        Args:
+            percentiles (Sequence[int], optional): Percentiles of the phase durations. Default is (50, 90, 99).
+
+        Returns:
+            Dict[str, float]: 'samples_per_sec', and per phase '<phase>_total_s' and '<phase>_p<q>_ms'
+        """
+        if self.use_events:
+            torch.cuda.synchronize()
+        stats = {'samples_per_sec': self.num_samples / max(self.step_time, 1e-9)}
+        for name, durations in self.durations.items():
+            seconds = np.array([_seconds(duration) for duration in durations])
+            stats[f'{name}_total_s'] = float(seconds.sum())
+            for q, value in zip(percentiles, np.percentile(seconds, percentiles)):
+                stats[f'{name}_p{q}_ms'] = float(value * 1000)
+        return stats
+
+
+def _seconds(duration) -> float:
+    """Seconds of a host-measured duration or of a (start, end) pair of CUDA events."""
+    if isinstance(duration, float):
+        return duration
+    start, end = duration
+    return start.elapsed_time(end) / 1000 # milliseconds
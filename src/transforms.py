@@ -0,0 +1,199 @@
+from numbers import Number
+from typing import Optional, Sequence, Tuple, Union
+
+import torch
+from torch.utils.data import get_worker_info
+
+
+def _stack(samples: Sequence):
+    """Stacks the same field of every sample, tensors are written straight into shared memory in workers."""
+    elem = samples[0]
+    if isinstance(elem, Number):
+        return torch.tensor(samples)
+
+    out = None
+    if get_worker_info() is not None:
+        # Same trick as `default_collate`: stacking into shared memory
+        # avoids an extra copy when the batch is sent to the main process
+        numel = sum(sample.numel() for sample in samples)
+        storage = elem._typed_storage()._new_shared(numel, device=elem.device)
+        out = elem.new(storage).resize_(len(samples), *elem.shape)
+    return torch.stack(samples, out=out)
+
+
+def collate_uint8(batch: Sequence[tuple]) -> tuple:
+    """
+    Collates (SAR image, optical image, ...) samples without changing their dtype.
+
+    Used with datasets returning uint8 (C, H, W) tensors, so workers send
+    1 byte per pixel to the main process instead of 4; the scaling to
+    [-1, 1] is deferred to `BatchNormalize` on the training device.
+
+    Args:
+        batch: List of samples, each a tuple of tensors or numbers
+
+    Returns:
+        tuple: One batched tensor per sample field
+    """
+    return tuple(_stack(field) for field in zip(*batch))
+
+
+class BatchNormalize:
+    """
+    Scales a whole uint8 batch to normalized floats in one vectorized step.
+
+    Computes ``(x / 255 - mean) / std`` as a single multiply-add on the target
+    device, after the uint8 batch has been copied there.
+
+    Args:
+        mean (Sequence[float], optional): Per-channel (or single) mean of [0, 1] images. Default is [0.5].
+        std (Sequence[float], optional): Per-channel (or single) std of [0, 1] images. Default is [0.5].
+        device (str | torch.device, optional): Device to normalize on. Default is 'cpu'.
+    """
+    def __init__(self,
+                 mean: Sequence[float] = (0.5,),
+                 std: Sequence[float] = (0.5,),
+                 device: Optional[Union[str, torch.device]] = None):
+        mean = torch.as_tensor(mean, dtype=torch.float32, device=device).view(1, -1, 1, 1)
+        std = torch.as_tensor(std, dtype=torch.float32, device=device).view(1, -1, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.bias = -mean / std
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        images = images.to(self.scale.device, non_blocking=True)
+        if images.dtype != torch.uint8: # already normalized by per-sample transforms
+            return images
+        return torch.addcmul(self.bias, images.float(), self.scale)
+
+
+class PairedBatchAugment:
+    """
+    Random paired augmentation of whole (SAR, optical) batches on the training device.
+
+    Flips, 90° rotations and crops (resized back to the input size) are
+    folded into one affine matrix per sample and applied to the SAR and
+    optical images together with a single `grid_sample` call, so both
+    images of a pair always get the same geometry. Flips and rotations map
+    pixel centers onto pixel centers and stay exact. Batches that are not
+    square are not rotated, a 90° rotation would not fit their shape. The
+    intensity jitter (random gain and offset per sample) is applied to the
+    SAR images only, unless `jitter_target` is set.
+
+    Random parameters are drawn from a seeded CPU generator, so the
+    augmentation is reproducible on any device; `state_dict` and
+    `load_state_dict` save and restore its position.
+
+    Args:
+        hflip (float, optional): Probability of a horizontal flip. Default is 0.5.
+        vflip (float, optional): Probability of a vertical flip. Default is 0.5.
+        rot90 (bool, optional): Rotate square batches by a random multiple of 90°. Default is True.
+        crop_scale (Sequence[float], optional): (min, max) side of the random crop relative
+            to the image, None disables cropping. Default is None.
+        brightness (float, optional): Max random offset added to the normalized images. Default is 0.
+        contrast (float, optional): Max relative random gain of the normalized images. Default is 0.
+        jitter_target (bool, optional): Also jitter the intensity of the optical images. Default is False.
+        seed (int, optional): Random seed. Default is 0.
+    """
+    def __init__(self,
+                 hflip: float = 0.5,
+                 vflip: float = 0.5,
+                 rot90: bool = True,
+                 crop_scale: Optional[Sequence[float]] = None,
+                 brightness: float = 0.0,
+                 contrast: float = 0.0,
+                 jitter_target: bool = False,
+                 seed: int = 0):
+        if crop_scale is not None and not 0 < crop_scale[0] <= crop_scale[1] <= 1:
+            raise ValueError("crop_scale must satisfy 0 < min <= max <= 1")
+        self.hflip = hflip
+        self.vflip = vflip
+        self.rot90 = rot90
+        self.crop_scale = crop_scale
+        self.brightness = brightness
+        self.contrast = contrast
+        self.jitter_target = jitter_target
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def _uniform(self, n: int, low: float, high: float) -> torch.Tensor:
+        return torch.rand(n, generator=self.generator) * (high - low) + low
+
+    def _affine(self, n: int, square: bool = True) -> Optional[torch.Tensor]:
+        """Draws one (2, 3) sampling matrix per sample, or None if no sample moves.
+
+        The rotations are drawn but not applied when the images are not `square`,
+        in the [-1, 1] coordinates of `affine_grid` they would stretch them.
+        """
+        theta = torch.eye(2).repeat(n, 1, 1)
+        # Flips negate a column of the sampling matrix
+        flips = torch.ones(n, 2)
+        flips[torch.rand(n, generator=self.generator) < self.hflip, 0] = -1
+        flips[torch.rand(n, generator=self.generator) < self.vflip, 1] = -1
+        theta = theta * flips.unsqueeze(1)
+        if self.rot90:
+            k = torch.randint(4, (n,), generator=self.generator)
+            if not square:
+                k = torch.zeros_like(k)
+            cos = torch.tensor([1., 0., -1., 0.])[k]
+            sin = torch.tensor([0., 1., 0., -1.])[k]
+            rotation = torch.stack([torch.stack([cos, -sin], 1), torch.stack([sin, cos], 1)], 1)
+            theta = rotation @ theta
+
+        offset = torch.zeros(n, 2)
+        if self.crop_scale is not None:
+            # Side of the crop and its center, kept inside the image
+            scale = self._uniform(n, *self.crop_scale)
+            theta = theta * scale.view(n, 1, 1)
+            offset = (torch.rand(n, 2, generator=self.generator) * 2 - 1) * (1 - scale).unsqueeze(1)
+
+        theta = torch.cat([theta, offset.unsqueeze(2)], dim=2)
+        identity = torch.tensor([[1., 0., 0.], [0., 1., 0.]])
+        if torch.equal(theta, identity.expand_as(theta)):
+            return None
+        return theta
+
+    def _jitter(self, n: int) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """Draws a per-sample (gain, offset), or None if the jitter is disabled."""
+        if not self.brightness and not self.contrast:
+            return None
+        gain = self._uniform(n, 1 - self.contrast, 1 + self.contrast).view(n, 1, 1, 1)
+        offset = self._uniform(n, -self.brightness, self.brightness).view(n, 1, 1, 1)
+        return gain, offset
+
+    def __call__(self, real_images: torch.Tensor, target_images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Augments a batch of (SAR, optical) pairs.
+
+        Args:
+            real_images (torch.Tensor): Normalized float SAR batch of shape (N, C_in, H, W)
+            target_images (torch.Tensor): Normalized float optical batch of shape (N, C_out, H, W)
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: The augmented batches
+        """
+        n, c_in, height, width = real_images.shape
+        # Draw every parameter up front, in a fixed order, so the stream does not depend on the data
+        theta = self._affine(n, square=height == width)
+        jitter = self._jitter(n)
+
+        if theta is not None:
+            images = torch.cat([real_images, target_images], dim=1)
+            grid = torch.nn.functional.affine_grid(theta.to(images.device, images.dtype), list(images.shape),
+                                                   align_corners=False)
+            images = torch.nn.functional.grid_sample(images, grid, mode='bilinear', padding_mode='border',
+                                                     align_corners=False)
+            real_images, target_images = images[:, :c_in], images[:, c_in:]
+
+        if jitter is not None:
+            gain, offset = (t.to(real_images.device, real_images.dtype) for t in jitter)
+            real_images = torch.addcmul(offset, real_images, gain)
+            if self.jitter_target:
+                target_images = torch.addcmul(offset, target_images, gain)
+        return real_images, target_images
+
+    def state_dict(self) -> dict:
+        """Returns the state of the random generator, to resume the augmentation stream."""
+        return {'generator': self.generator.get_state()}
+
+    def load_state_dict(self, state: dict):
+        """Restores a state returned by `state_dict`."""
+        self.generator.set_state(state['generator'])
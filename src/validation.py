@@ -0,0 +1,126 @@
+"""
+Validation in a separate process, overlapping the training.
+
+`ValidationWorker.submit` snapshots the model weights to CPU memory and
+hands them to a worker process, which validates them with its own model
+and DataLoader while the training continues. Finished results are
+collected with `poll`, tagged with the epoch of the weights they belong
+to. If the worker falls behind, `submit` waits for it rather than
+queueing more snapshots, which bounds the memory held by pending ones.
+"""
+import queue
+import time
+import traceback
+from typing import Callable, List, Tuple
+
+import torch.multiprocessing as mp
+
+from .checkpoint import snapshot
+
+
+def _work(setup: Callable[..., Callable[[dict], dict]], args: tuple, tasks: mp.Queue, results: mp.Queue):
+    """Worker process loop: builds the validation function, then validates the submitted states in order."""
+    try:
+        validate = setup(*args)
+    except Exception:
+        results.put((None, traceback.format_exc()))
+        return
+    while True:
+        try:
+            task = tasks.get(timeout=5)
+        except queue.Empty:
+            if not mp.parent_process().is_alive(): # the training process died without closing the worker
+                return
+            continue
+        if task is None:
+            return
+        epoch, state = task
+        try:
+            results.put((epoch, validate(state)))
+        except Exception:
+            results.put((epoch, traceback.format_exc()))
+
+
+class ValidationWorker:
+    """
+    Validates snapshots of the model weights in a separate process.
+
+    The worker calls `setup(*args)` once, in its own process, to build
+    its model and DataLoader; `setup` returns the function validating a
+    submitted state, which returns a dict of metrics. `setup` must be
+    importable (a module-level function) as the worker is spawned.
+
+    Args:
+        setup (Callable[..., Callable[[dict], dict]]): Builds the validation function in the worker
+        *args: Picklable arguments of `setup`, e.g. the config
+        max_pending (int, optional): Number of submitted validations not yet finished above which
+            `submit` waits for the worker. Default is 1.
+    """
+    def __init__(self, setup: Callable[..., Callable[[dict], dict]], *args, max_pending: int = 1):
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.max_pending = max_pending
+        context = mp.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._done = []
+        self._pending = 0
+        # Not a daemon: its DataLoader may start worker processes
+        self._process = context.Process(target=_work, args=(setup, args, self._tasks, self._results),
+                                        name='validation-worker')
+        self._process.start()
+
+    def _collect(self, block: bool):
+        """Moves the finished results to `_done`, waiting for one if `block`."""
+        while self._pending:
+            try:
+                epoch, result = self._results.get(timeout=1) if block else self._results.get_nowait()
+            except queue.Empty:
+                if not self._process.is_alive() and self._results.empty(): # results of a worker that failed are read first
+                    raise RuntimeError(f"The validation worker exited with code {self._process.exitcode}")
+                if block:
+                    continue
+                return
+            if isinstance(result, str): # traceback of the worker
+                if epoch is None:
+                    raise RuntimeError(f"The validation worker could not start:\n{result}")
+                raise RuntimeError(f"Validation of epoch {epoch} failed in the worker:\n{result}")
+            self._pending -= 1
+            self._done.append((epoch, result))
+            block = False
+
+    def submit(self, epoch: int, state: dict) -> float:
+        """
+        Validates a state of the model in the worker, e.g. {'gen': ..., 'disc': ...} state dicts.
+
+        Args:
+            epoch (int): Epoch the state belongs to, returned with its metrics
+            state (dict): State to snapshot and hand to the validation function
+
+        Returns:
+            float: Seconds spent waiting for the worker to catch up
+        """
+        start = time.perf_counter()
+        self._collect(block=False)
+        while self._pending >= self.max_pending:
+            self._collect(block=True)
+        waited = time.perf_counter() - start
+        self._tasks.put((epoch, snapshot(state)))
+        self._pending += 1
+        return waited
+
+    def poll(self) -> List[Tuple[int, dict]]:
+        """Returns the (epoch, metrics) of the validations finished since the last call, in submission order."""
+        self._collect(block=False)
+        done, self._done = self._done, []
+        return done
+
+    def close(self) -> List[Tuple[int, dict]]:
+        """Waits for the pending validations, stops the worker and returns the remaining (epoch, metrics)."""
+        try:
+            while self._pending:
+                self._collect(block=True)
+        finally:
+            self._tasks.put(None)
+            self._process.join()
+        return self.poll()
@@ -11,9 +11,12 @@ from torchvision import models
 import numpy as np
 
 from utils.config import Config
+from utils.dataset_stats import config_normalization
 from src.dataset import Sentinel
+from src.scenes import SceneSentinel
 from src.pix2pix import Pix2Pix
 from src.metric import extract_features, calculate_fid
+from src.transforms import collate_uint8
 
 def main():
     # Load configuration
@@ -32,20 +35,58 @@ def main():
         v2.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
     ])
 
-    dataset = Sentinel(
-        root_dir=config['dataset']['root_dir'],
+    # In uint8 mode the dataset returns raw pixels and `Pix2Pix.generate` scales the whole batch
+    uint8_batches = config['dataset'].get('uint8_batches', False)
+    input_mean, input_std = config_normalization(config)
+    if uint8_batches:
+        input_transform = v2.ToImage()
+    else:
+        # Same SAR normalization as in training, [-1, 1] or the dataset statistics
+        input_transform = v2.Compose([
+            v2.ToImage(),
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize(mean=input_mean, std=input_std),
+        ])
+
+    split = dict(
         split_type="test",
+        input_transform=input_transform,
+        # Targets stay in [0, 255] (uint8) or [0, 1] whatever the SAR normalization
+        target_transform=v2.ToImage() if uint8_batches else v2.Compose([v2.ToImage(), v2.ToDtype(torch.float32, scale=True)]),
         split_mode=config['dataset']['split_mode'],
         split_ratio=config['dataset']['split_ratio'],
         split_file=config['dataset']['split_file'],
-        seed=config['dataset']['seed']
+        seed=config['dataset']['seed'],
+        sar_channels=config['model']['c_in'],
+        speckle_filter=config['dataset'].get('speckle_filter')
     )
+    scene_config = config.get('scenes', {})
+    if scene_config.get('dir'):
+        # Grid windows of the test scenes
+        dataset = SceneSentinel(
+            scene_dir=scene_config['dir'],
+            **split,
+            patch_size=scene_config.get('patch_size', 256),
+            sampling='grid',
+            block=scene_config.get('block', 32),
+            min_valid=scene_config.get('min_valid', 0.99),
+            nodata=scene_config.get('nodata', 0),
+            value_range=scene_config.get('value_range'),
+            optical_bands=scene_config.get('optical_bands')
+        )
+    else:
+        dataset = Sentinel(
+            root_dir=config['dataset']['root_dir'],
+            use_catalog=config['dataset'].get('use_catalog', False),
+            **split
+        )
     
     dataloader = DataLoader(
         dataset,
         batch_size=config['training']['batch_size'],
         shuffle=config['dataset']['shuffle'],
-        num_workers=config['training']['num_workers']
+        num_workers=config['training']['num_workers'],
+        collate_fn=collate_uint8 if uint8_batches else None
     )
 
     # Create model
@@ -55,6 +96,7 @@ def main():
         is_train=False,
         use_upsampling=config['model']['use_upsampling'],
         mode=config['model']['mode'],
+        precision=config['training'].get('precision', 'fp32'),
     ).to(device).eval()
 
     gen_checkpoint = Path(config['training']['gen_checkpoint'])
@@ -70,11 +112,15 @@ def main():
     for real_images, target_images in dataloader:
         real_images, target_images = real_images.to(device), target_images.to(device)
         
-        # Pix2Pix.generate() gets a scaled tensor ([0,1]) returns a uint8 tensor ([0,255])
-        fake_images = model.generate(real_images, is_scaled=True, to_uint8=True) 
-
-        # Get target features
-        target_images = (target_images * 255).to(dtype=torch.uint8)
+        if uint8_batches:
+            # Pix2Pix.generate() gets a uint8 tensor ([0,255]), scales it and returns a uint8 tensor ([0,255])
+            fake_images = model.generate(real_images, is_scaled=False, to_uint8=True, mean=input_mean, std=input_std)
+        else:
+            # Pix2Pix.generate() gets a normalized tensor returns a uint8 tensor ([0,255])
+            fake_images = model.generate(real_images, is_scaled=True, to_uint8=True) 
+
+            # Get target features
+            target_images = (target_images * 255).to(dtype=torch.uint8)
         target_images = transform(target_images)
         target_feats = extract_features(target_images, inception)
         target_features.append(target_feats.cpu().numpy())
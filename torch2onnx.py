@@ -1,8 +1,11 @@
+import json
 from pathlib import Path
 
+import onnx
 import torch
 
 from utils.config import Config
+from utils.dataset_stats import config_normalization
 from src.pix2pix import Pix2Pix
 
 
@@ -37,7 +40,8 @@ def main():
     output_name = "output"
 
     output_path = config["export"]["export_path"]
-    input_shape = config["export"]["input_shape"]
+    input_shape = list(config["export"]["input_shape"])
+    input_shape[1] = config["model"]["c_in"]  # the exported input always matches the model's channels
 
     dummy_input = torch.randn(input_shape, requires_grad=True)
     _ = model(dummy_input)
@@ -70,6 +74,15 @@ def main():
             output_names=[output_name],  # the model's output names
         )
 
+    # Store the input preprocessing in the model, so ONNX runtimes prepare inputs like training did
+    input_mean, input_std = config_normalization(config)
+    speckle_filter = config["dataset"].get("speckle_filter")
+    onnx_model = onnx.load(output_path)
+    for key, value in (("input_mean", input_mean), ("input_std", input_std), ("speckle_filter", speckle_filter)):
+        entry = onnx_model.metadata_props.add()
+        entry.key, entry.value = key, json.dumps(value)
+    onnx.save(onnx_model, output_path)
+
 
 if __name__ == "__main__":
     main()
@@ -1,168 +1,390 @@
 # train.py
+import logging
+import os
+import time
 from pathlib import Path
 
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
 from torchvision.transforms import v2
 
 from tqdm import tqdm
 
 from utils.config import Config
-from utils.utils import setup_logging, init_comet, log_metrics
-from src.dataset import Sentinel
+from utils.utils import setup_logging, init_comet, log_metrics, log_jsonl, MetricsAccumulator
+from utils.dataset_stats import config_normalization, load_report
+from src.dataset import Sentinel, ShardedSentinel
+from src.streaming import StreamingSentinel
+from src.scenes import SceneSentinel
+from src.samplers import CategoryBatchSampler, HardExampleSampler, SampleLossTable
 from src.pix2pix import Pix2Pix
+from src.distributed import (init_distributed, launch_local, data_parallel, average_buffers,
+                             even_batches, gather_objects, is_distributed, is_main_process, get_rank, get_world_size)
+from src.checkpoint import AsyncCheckpointer, snapshot, rng_state, set_rng_state
+from src.compilation import enable_compile_cache, compile_train_step, compile_report
+from src.validation import ValidationWorker
+from src.timing import PhaseTimer
+from src.prefetch import DevicePrefetcher
+from src.transforms import collate_uint8, BatchNormalize, PairedBatchAugment
+
+def log_compile_report(seconds: float):
+    """Logs the compile time, graph breaks and cache use of the training step, see `compile_train_step`."""
+    report = compile_report()
+    logging.info(f"First training step took {seconds:.1f} s with compilation: {report['graphs']} graphs, "
+                 f"{sum(report['graph_breaks'].values())} graph breaks, "
+                 f"{report['cache_hits']} kernels loaded from the cache, {report['cache_misses']} compiled")
+    for reason, count in report['graph_breaks'].items():
+        logging.info(f"Graph break ({count}x): {reason.strip().splitlines()[0]}")
+
 
 def save_checkpoint(
         model: Pix2Pix, 
         epoch: int, 
         config: Config,
+        checkpointer: AsyncCheckpointer,
+        hard_sampler: HardExampleSampler = None,
+        sampler=None,
+        augment: PairedBatchAugment = None,
         ):
-    """Save model checkpoint"""
+    """Save model checkpoint and training state, written in the background by rank 0
+
+    The training state holds the optimizers, the epoch and, for every rank, the RNG states and
+    the positions of the sampler and augmentation (any of them with a `state_dict`), so a resumed
+    run continues as if it had not stopped. The loop only waits for the copy to CPU memory.
+    """
+    # Every rank has its own random streams, rank 0 saves them all
+    ranks = gather_objects(snapshot({
+        'rng': rng_state(),
+        'sampler': sampler.state_dict() if hasattr(sampler, 'state_dict') else None,
+        'augment': augment.state_dict() if augment is not None else None,
+    }))
+    if not is_main_process():
+        return
     checkpoint_dir = Path(config['training']['checkpoint_dir'])
     checkpoint_dir.mkdir(parents=True, exist_ok=True)
 
-    # Save generator
-    gen_filename = f"generator_epoch_{epoch}.pth"
-    gen_path = checkpoint_dir / gen_filename
-    
-    # Save discriminator
-    disc_filename = f"discriminator_epoch_{epoch}.pth"
-    disc_path = checkpoint_dir / disc_filename
-    
-    model.save_model(str(gen_path), str(disc_path))
+    # Generator and discriminator weights, as written by `Pix2Pix.save_model`
+    files = {
+        checkpoint_dir / f"generator_epoch_{epoch}.pth": model.gen.state_dict(),
+        checkpoint_dir / f"discriminator_epoch_{epoch}.pth": model.disc.state_dict(),
+        checkpoint_dir / f"training_state_epoch_{epoch}.pth": {
+            'epoch': epoch,
+            'gen_optimizer': model.gen_optimizer.state_dict(),
+            'disc_optimizer': model.disc_optimizer.state_dict(),
+            'ranks': ranks,
+        },
+    }
+
+    # Save the per-sample losses of the hard-example sampler
+    if hard_sampler is not None:
+        files[checkpoint_dir / f"sample_losses_epoch_{epoch}.pth"] = {
+            'table': hard_sampler.table.state_dict(), 'sampler': hard_sampler.state_dict()}
+    checkpointer.save(files)
     
     # Save config with model files
     config.save(checkpoint_dir / "config.yaml")
 
-def load_checkpoint(model: Pix2Pix, config: Config):
-    """Load model checkpoint"""
+def load_checkpoint(model: Pix2Pix, config: Config, hard_sampler: HardExampleSampler = None,
+                    sampler=None, augment: PairedBatchAugment = None):
+    """Load model checkpoint, and the training state if `training.state_checkpoint` is set
+
+    Returns:
+        The epoch to resume from, after the one of the training state, or None without a training state
+    """
     gen_checkpoint = Path(config['training']['gen_checkpoint'])
     disc_checkpoint = Path(config['training']['disc_checkpoint'])
 
     if not gen_checkpoint.exists():
         raise FileNotFoundError(f"Generator checkpoint file not found: {gen_checkpoint}\nPlease check config.yaml")
     if not disc_checkpoint.exists():
-        raise FileNotFoundError(f"Generator checkpoint file not found: {disc_checkpoint}\nPlease check config.yaml")
+        raise FileNotFoundError(f"Discriminator checkpoint file not found: {disc_checkpoint}\nPlease check config.yaml")
     
     model.load_model(gen_path=gen_checkpoint, disc_path=disc_checkpoint)
 
+    loss_table_checkpoint = config['training'].get('loss_table_checkpoint')
+    if hard_sampler is not None and loss_table_checkpoint:
+        if not Path(loss_table_checkpoint).exists():
+            raise FileNotFoundError(f"Loss table checkpoint file not found: {loss_table_checkpoint}\nPlease check config.yaml")
+        state = torch.load(loss_table_checkpoint, weights_only=True)
+        hard_sampler.table.load_state_dict(state['table'])
+        hard_sampler.load_state_dict(state['sampler'])
+
+    state_checkpoint = config['training'].get('state_checkpoint')
+    if not state_checkpoint:
+        return None
+    if not Path(state_checkpoint).exists():
+        raise FileNotFoundError(f"Training state file not found: {state_checkpoint}\nPlease check config.yaml")
+    # The RNG and sampler states are numpy and Python objects, only load training states you wrote
+    state = torch.load(state_checkpoint, map_location='cpu', weights_only=False)
+    model.gen_optimizer.load_state_dict(state['gen_optimizer'])
+    model.disc_optimizer.load_state_dict(state['disc_optimizer'])
+
+    ranks = state['ranks']
+    if len(ranks) != get_world_size():
+        logging.warning(f"The training state was saved by {len(ranks)} ranks, not {get_world_size()}, "
+                        "the random streams and sampler positions are not restored")
+    else:
+        rank_state = ranks[get_rank()]
+        set_rng_state(rank_state['rng'])
+        if rank_state['sampler'] is not None and hasattr(sampler, 'load_state_dict'):
+            sampler.load_state_dict(rank_state['sampler'])
+        if rank_state['augment'] is not None and augment is not None:
+            augment.load_state_dict(rank_state['augment'])
+    return state['epoch'] + 1
+
 def create_dataloader(config, split_type: str, input_transform, target_transform=None):
     """Create dataset and dataloader based on split type"""
-    dataset = Sentinel(
-        root_dir=config['dataset']['root_dir'],
+    split = dict(
         split_type=split_type,
         input_transform=input_transform,
         target_transform=target_transform,
         split_mode=config['dataset']['split_mode'],
         split_ratio=config['dataset']['split_ratio'],
         split_file=config['dataset']['split_file'],
-        seed=config['dataset']['seed']
+        seed=config['dataset']['seed'],
+        sar_channels=config['model']['c_in'],
     )
+    hard_examples = config.get('hard_examples', {}).get('enabled', False) and split_type == 'train'
+    batch_size = config['training']['batch_size'] // get_world_size() # the batch is split across the ranks
+    if config['dataset'].get('archives'):
+        if hard_examples:
+            raise ValueError("The hard-example sampler needs a map-style dataset, it cannot be used with `archives`")
+        if config['dataset'].get('speckle_filter'):
+            raise ValueError("Speckle-filtered images are read from root_dir, they cannot be used with `archives`")
+        # Stream pairs out of zip/tar archives, the shuffle buffer replaces global shuffling.
+        # Every rank streams its own shards of the archives
+        dataset = StreamingSentinel(
+            archives=config['dataset']['archives'],
+            shuffle_buffer=config['dataset'].get('shuffle_buffer', 0) if config['dataset']['shuffle'] else 0,
+            **split
+        )
+        shuffle = False
+    elif config.get('scenes', {}).get('dir'):
+        # Windows of large scenes, validation and test always read the same grid windows
+        scene_config = config['scenes']
+        sampling = scene_config.get('sampling', 'random') if split_type == 'train' else 'grid'
+        if hard_examples and sampling != 'grid':
+            raise ValueError("The hard-example sampler needs fixed windows, set scenes.sampling to 'grid'")
+        dataset = SceneSentinel(
+            scene_dir=scene_config['dir'],
+            **split,
+            patch_size=scene_config.get('patch_size', 256),
+            sampling=sampling,
+            windows_per_epoch=scene_config.get('windows_per_epoch'),
+            block=scene_config.get('block', 32),
+            min_valid=scene_config.get('min_valid', 0.99),
+            nodata=scene_config.get('nodata', 0),
+            value_range=scene_config.get('value_range'),
+            optical_bands=scene_config.get('optical_bands'),
+            return_index=hard_examples,
+            speckle_filter=config['dataset'].get('speckle_filter')
+        )
+        shuffle = config['dataset']['shuffle']
+    else:
+        if config['dataset'].get('shard_dir'):
+            # Packed shards written by utils/pack_shards.py
+            dataset_cls, location = ShardedSentinel, {'shard_dir': config['dataset']['shard_dir']}
+        else:
+            dataset_cls, location = Sentinel, {'root_dir': config['dataset']['root_dir']}
+        dataset = dataset_cls(
+            **location,
+            **split,
+            cache_bytes=int(config['dataset'].get('cache_mb', 0) * 2**20),
+            use_catalog=config['dataset'].get('use_catalog', False),
+            return_index=hard_examples, # sample ids for the per-sample loss table
+            speckle_filter=config['dataset'].get('speckle_filter')
+        )
+        shuffle = config['dataset']['shuffle']
+
+    collate_fn = collate_uint8 if config['dataset'].get('uint8_batches', False) else None
+    if hard_examples:
+        if is_distributed():
+            raise ValueError("The hard-example sampler does not support distributed training yet")
+        if config['dataset'].get('sampler') == 'category':
+            raise ValueError("Use either the category sampler or the hard-example sampler")
+        # Oversample the pairs with the highest recorded loss, see `hard_examples` in config.yaml
+        hard_config = config['hard_examples']
+        sampler = HardExampleSampler(
+            SampleLossTable(len(dataset), momentum=hard_config.get('momentum', 0.5)),
+            loss=hard_config.get('loss', 'l1'),
+            alpha=hard_config.get('alpha', 1.0),
+            uniform_mix=hard_config.get('uniform_mix', 0.2),
+            epoch_fraction=hard_config.get('epoch_fraction', 1.0),
+            seed=config['dataset']['seed']
+        )
+        return DataLoader(
+            dataset,
+            batch_size=batch_size,
+            sampler=sampler,
+            num_workers=config['training']['num_workers'],
+            collate_fn=collate_fn
+        )
+    if config['dataset'].get('sampler') == 'category' and split_type == 'train':
+        if isinstance(dataset, StreamingSentinel):
+            raise ValueError("The category sampler needs a map-style dataset, it cannot be used with `archives`")
+        # Category-balanced (or weighted) batches, see dataset.category_weights, the ids are split across the ranks
+        categories, category_ids = dataset.categories()
+        batch_sampler = CategoryBatchSampler(
+            category_ids,
+            batch_size=batch_size,
+            categories=categories,
+            weights=config['dataset'].get('category_weights'),
+            epoch_fraction=config['dataset'].get('epoch_fraction', 1.0),
+            seed=config['dataset']['seed']
+        )
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=config['training']['num_workers'],
+            collate_fn=collate_fn
+        )
+    if is_distributed() and not isinstance(dataset, StreamingSentinel):
+        # Every rank reads its own shard of the (shuffled) indices, padded to the same number of batches
+        sampler = DistributedSampler(dataset, shuffle=shuffle, seed=config['dataset']['seed'])
+        return DataLoader(
+            dataset,
+            batch_size=batch_size,
+            sampler=sampler,
+            num_workers=config['training']['num_workers'],
+            collate_fn=collate_fn
+        )
     return DataLoader(
         dataset,
-        batch_size=config['training']['batch_size'],
-        shuffle=config['dataset']['shuffle'],
-        num_workers=config['training']['num_workers']
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=config['training']['num_workers'],
+        collate_fn=collate_fn
     )
 
-def train_epoch(model, train_loader, device, epoch, experiment):
-    """Train for one epoch"""
+def train_epoch(model, train_loader, device, epoch, experiment, batch_transforms=None, augment=None,
+                loss_table=None, log_interval=50, timer=None):
+    """Train for one epoch
+
+    `batch_transforms`, if given, is a (SAR, optical) pair of transforms applied to the image batches
+    after they are moved to `device`, then `augment`, if given, augments the (SAR, optical) batch pairs.
+    `loss_table`, if given, records the per-sample losses of (SAR, optical, index) batches.
+    The losses are summed on the device, the host only reads them every `log_interval` steps to
+    update the progress bar (0 updates it at the end of the epoch only), and once for the epoch log.
+    `timer`, if given, times the wait for every batch, its transfer (with the batch transforms and
+    augmentation) and counts the samples over the step loop, the model times the phases of its steps.
+    With a `DevicePrefetcher` the batches arrive on the device, the wait ('prefetch_wait') includes
+    the copies the prefetcher did not hide, and only the augmentation ('augment') is left to time.
+    In a distributed run, the losses are averaged over the ranks and the BatchNorm running
+    statistics are averaged at the end of the epoch.
+    """
     model.train()
-    total_lossD, total_lossG = 0.0, 0.0
-    total_lossG_GAN, total_lossG_L1 = 0.0, 0.0
-
-    with tqdm(train_loader, desc=f"Epoch {epoch}") as pbar:
-        for real_images, target_images in pbar:
-            real_images, target_images = real_images.to(device), target_images.to(device)
-            losses = model.train_step(real_images, target_images)
-            total_lossD += losses['loss_D']
-            total_lossG += losses['loss_G']
-            total_lossG_GAN += losses['loss_G_GAN']
-            total_lossG_L1 += losses['loss_G_L1']
-            pbar.set_postfix({"loss_D": losses['loss_D'], "loss_G": losses['loss_G']})
-
-    num_steps = len(train_loader)
-    loss_D = total_lossD / num_steps
-    loss_G = total_lossG / num_steps
-    loss_G_GAN = total_lossG_GAN / num_steps
-    loss_G_L1 = total_lossG_L1 / num_steps
-
-    losses = {
-        'loss_D' : loss_D,
-        'loss_G' : loss_G,
-        'loss_G_GAN' : loss_G_GAN, 
-        'loss_G_L1' : loss_G_L1,
-    }
+    epoch_metrics, interval_metrics = MetricsAccumulator(), MetricsAccumulator()
+    timer = timer or PhaseTimer(device, enabled=False)
+
+    batches = train_loader
+    if is_distributed() and isinstance(train_loader.dataset, StreamingSentinel):
+        batches = even_batches(train_loader) # streamed shards may hold a different number of batches
+    prefetched = isinstance(train_loader, DevicePrefetcher)
+    wait_phase, transfer_phase = ('prefetch_wait', 'augment') if prefetched else ('data_wait', 'transfer')
+    with tqdm(batches, desc=f"Epoch {epoch}", total=len(train_loader), disable=not is_main_process()) as pbar, \
+            timer.steps():
+        wait_start = time.perf_counter()
+        for real_images, target_images, *indices in pbar:
+            timer.add(wait_phase, time.perf_counter() - wait_start) # loading, decoding and collating
+            with timer.phase(transfer_phase):
+                real_images, target_images = real_images.to(device), target_images.to(device)
+                if batch_transforms is not None:
+                    real_images, target_images = batch_transforms[0](real_images), batch_transforms[1](target_images)
+                if augment is not None:
+                    real_images, target_images = augment(real_images, target_images)
+            losses = model.train_step(real_images, target_images, per_sample=loss_table is not None)
+            timer.add_samples(len(real_images))
+            if loss_table is not None:
+                loss_table.update(indices[0], losses.pop('sample_L1'), losses.pop('sample_GAN'))
+            epoch_metrics.update(losses)
+            interval_metrics.update(losses)
+            if log_interval and len(interval_metrics) == log_interval:
+                # Mean losses since the last update, the only host sync of the steps
+                means = interval_metrics.compute(reduce=False)
+                pbar.set_postfix({"loss_D": means['loss_D'], "loss_G": means['loss_G']})
+                interval_metrics.reset()
+            wait_start = time.perf_counter()
+
+    # Log metrics for the epoch, averaged over the ranks of a distributed run
+    log_metrics(experiment, epoch_metrics, epoch)
+
+    # Unsynchronized BatchNorm layers drift apart on every rank
+    average_buffers(model)
+
+    if model.micro_batch_size is not None: # the 'auto' size may shrink during training
+        log_metrics(experiment, {'micro_batch_size': model.micro_batch_size}, epoch)
+
+    if prefetched:
+        log_metrics(experiment, train_loader.stats(), epoch)
+        train_loader.reset_stats()
+
+    if loss_table is not None:
+        log_metrics(experiment, loss_table.stats(), epoch)
 
-    # Log metrics for the epoch
-    log_metrics(experiment, losses, epoch)
+    cache = getattr(train_loader.dataset, 'cache', None)
+    if cache is not None:
+        log_metrics(experiment, cache.stats(), epoch)
+        cache.reset_stats()
 
-def validate(model: Pix2Pix, val_loader: DataLoader, device: torch.device, epoch, experiment):
-    """Validate the model"""
+def validate(model: Pix2Pix, val_loader: DataLoader, device: torch.device, batch_transforms=None) -> dict:
+    """Validate the model, returns the mean validation losses"""
     model.eval()
-    total_lossD, total_lossG = 0.0, 0.0
-    total_lossG_GAN, total_lossG_L1 = 0.0, 0.0
+    metrics = MetricsAccumulator() # summed on the device, read once
         
     for real_images, target_images in val_loader:
         real_images, target_images = real_images.to(device), target_images.to(device)
-        losses = model.validation_step(real_images, target_images)
-        total_lossD += losses['loss_D']
-        total_lossG += losses['loss_G']
-        total_lossG_GAN += losses['loss_G_GAN']
-        total_lossG_L1 += losses['loss_G_L1']
-    
-    num_steps = len(val_loader)
-    loss_D = total_lossD / num_steps
-    loss_G = total_lossG / num_steps
-    loss_G_GAN = total_lossG_GAN / num_steps
-    loss_G_L1 = total_lossG_L1 / num_steps
-
-    losses = {
-        'Val loss_D' : loss_D,
-        'Val loss_G' : loss_G,
-        'Val loss_G_GAN' : loss_G_GAN, 
-        'Val loss_G_L1' : loss_G_L1,
-    }
-    # Log metrics for the epoch
-    log_metrics(experiment, losses, epoch)
+        if batch_transforms is not None:
+            real_images, target_images = batch_transforms[0](real_images), batch_transforms[1](target_images)
+        metrics.update(model.validation_step(real_images, target_images))
 
-def main():
-    # Load configuration
-    config = Config('config.yaml')
-    use_validation = config['training']['use_validation']
-    
-    # Setup logging
-    setup_logging(config)
-    experiment = init_comet(config)
-    if experiment:
-        experiment.log_parameters(config['model'])
-        experiment.log_parameters(config['training'])
-        experiment.log_parameters(config['dataset'])
-    
-    # Set device
-    device = torch.device(config['training']['device'])
+    return {f'Val {key}': value for key, value in metrics.compute().items()}
 
-    # Create transforms
-    train_transforms = v2.Compose([
-        v2.ToImage(),
-        v2.ToDtype(torch.float32, scale=True),
-        v2.Normalize(mean=[0.5], std=[0.5]),
-    ])
-    
-    # Create dataloaders
-    train_loader = create_dataloader(config, "train", train_transforms)
+def validation_worker(config: Config, device: str):
+    """
+    Builds the model and validation DataLoader of a `ValidationWorker` process.
+
+    Returns the function validating a submitted {'gen': ..., 'disc': ...} snapshot of the weights,
+    the discriminator is needed for the adversarial losses.
+    """
+    device = torch.device(device)
+    train_transforms, target_transforms, batch_transforms = create_transforms(config, device)
+    val_loader = create_dataloader(config, "val", train_transforms, target_transforms)
+    model = create_model(config, device)
+
+    def validate_snapshot(state: dict) -> dict:
+        model.gen.load_state_dict(state['gen'])
+        model.disc.load_state_dict(state['disc'])
+        return validate(model, val_loader, device, batch_transforms)
+    return validate_snapshot
 
-    # use validation
-    if use_validation:
-        val_transforms = v2.Compose([
+def create_transforms(config: Config, device: torch.device):
+    """Returns the SAR and optical transforms of the dataset, and the (SAR, optical) batch transforms
+    applied on `device` (None when the workers normalize the images)"""
+    # SAR inputs are standardized with the dataset statistics if available, the optical targets
+    # stay in [-1, 1] to match the generator's Tanh output
+    input_mean, input_std = config_normalization(config)
+    if config['dataset'].get('uint8_batches', False):
+        # Workers only decode to uint8, the normalization runs once per batch on the device
+        train_transforms = target_transforms = v2.ToImage()
+        batch_transforms = (BatchNormalize(mean=input_mean, std=input_std, device=device),
+                            BatchNormalize(mean=[0.5], std=[0.5], device=device))
+    else:
+        train_transforms = v2.Compose([
+            v2.ToImage(),
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize(mean=input_mean, std=input_std),
+        ])
+        target_transforms = v2.Compose([
             v2.ToImage(),
             v2.ToDtype(torch.float32, scale=True),
             v2.Normalize(mean=[0.5], std=[0.5]),
         ])
-        val_loader = create_dataloader(config, "val", val_transforms)
-    
-    # Create model
-    model = Pix2Pix(
+        batch_transforms = None
+    return train_transforms, target_transforms, batch_transforms
+
+def create_model(config: Config, device: torch.device) -> Pix2Pix:
+    """Creates the Pix2Pix model of the config on `device`"""
+    return Pix2Pix(
         c_in=config['model']['c_in'],
         c_out=config['model']['c_out'],
         netD=config['model']['netD'],
@@ -172,38 +394,193 @@ def main():
         mode=config['model']['mode'],
         c_hid=config['model']['c_hid'],
         n_layers=config['model']['n_layers'],
+        checkpoint=config['model'].get('checkpoint'),
+        fused_disc=config['model'].get('fused_disc', False),
         lr=config['training']['lr'],
         beta1=config['training']['beta1'],
-        beta2=config['training']['beta2']
+        beta2=config['training']['beta2'],
+        precision=config['training'].get('precision', 'fp32'),
+        micro_batch_size=config['training'].get('micro_batch_size'),
+        memory_fraction=config['training'].get('memory_fraction', 0.8)
     ).to(device)
 
+def run(config: Config):
+    """Trains the model, in one process or as one rank of a distributed run."""
+    use_validation = config['training']['use_validation']
+
+    # Join the process group of a distributed run (spawned by `main` or started by torchrun)
+    dist_config = config.get('distributed', {})
+    rank, world_size, local_rank = init_distributed(
+        backend=dist_config.get('backend', 'gloo'),
+        threads_per_rank=dist_config.get('threads_per_rank')
+    )
+    if config['training']['batch_size'] % world_size:
+        raise ValueError(f"training.batch_size must be a multiple of the {world_size} ranks")
+    
+    # Setup logging
+    setup_logging(config)
+    experiment = init_comet(config) if is_main_process() else None
+    if experiment:
+        experiment.log_parameters(config['model'])
+        experiment.log_parameters(config['training'])
+        experiment.log_parameters(config['dataset'])
+        experiment.log_parameters(config.get('augmentation', {}), prefix='augmentation')
+    
+    # Set device, one GPU per local rank
+    device = torch.device(config['training']['device'])
+    if world_size > 1 and device.type == 'cuda':
+        device = torch.device('cuda', local_rank)
+    if world_size > 1:
+        # Different dropout masks and random scene windows on every rank, the weights are copied from rank 0
+        torch.manual_seed(torch.initial_seed() + rank)
+
+    if config['dataset'].get('stats_file'):
+        input_mean, input_std = config_normalization(config)
+        logging.info(f"Normalizing SAR inputs with mean={input_mean}, std={input_std}")
+        problems = load_report(config['dataset']['stats_file'])['problems']
+        if problems:
+            logging.warning(f"{len(problems)} unusable image pairs listed in {config['dataset']['stats_file']}, "
+                            "run `python -m utils.dataset_stats` for details")
+
+    # Create transforms
+    train_transforms, target_transforms, batch_transforms = create_transforms(config, device)
+
+    # Paired augmentation of whole training batches on the device (never applied to validation)
+    augment = None
+    if config.get('augmentation', {}).get('enabled', False):
+        aug_config = config['augmentation']
+        augment = PairedBatchAugment(
+            hflip=aug_config.get('hflip', 0.5),
+            vflip=aug_config.get('vflip', 0.5),
+            rot90=aug_config.get('rot90', True),
+            crop_scale=aug_config.get('crop_scale'),
+            brightness=aug_config.get('brightness', 0.0),
+            contrast=aug_config.get('contrast', 0.0),
+            jitter_target=aug_config.get('jitter_target', False),
+            seed=aug_config.get('seed', config['dataset']['seed'])
+        )
+    
+    # Create dataloaders
+    train_loader = create_dataloader(config, "train", train_transforms, target_transforms)
+    train_sampler = train_loader.sampler
+    hard_sampler = train_loader.sampler if isinstance(train_loader.sampler, HardExampleSampler) else None
+    # Sampler whose position is saved in the training state (category or hard-example sampler)
+    resumable_sampler = next((s for s in (train_loader.batch_sampler, train_loader.sampler) if hasattr(s, 'state_dict')), None)
+    # Kept on the training device, the steps update it without a host sync
+    loss_table = hard_sampler.table.to(device) if hard_sampler is not None else None
+
+    # use validation, every `eval_freq` epochs and after the last one, on rank 0
+    eval_freq = config['training'].get('eval_freq', 1)
+    async_validation = config['training'].get('async_validation', True)
+    validator = None
+    if use_validation and async_validation and is_main_process():
+        # A worker process validates snapshots of the weights with its own DataLoader while training continues
+        validator = ValidationWorker(validation_worker, config,
+                                     config['training'].get('validation_device') or str(device),
+                                     max_pending=config['training'].get('max_pending_validations', 1))
+    elif use_validation and not async_validation:
+        val_transforms = train_transforms # the pipeline is deterministic, reuse it
+        val_loader = create_dataloader(config, "val", val_transforms, target_transforms)
+
+    # Stage batches on the device in a background thread, overlapping loading and copies with the steps
+    prefetch_depth = config['training'].get('prefetch_depth', 0)
+    if prefetch_depth > 0:
+        train_loader = DevicePrefetcher(train_loader, device, prefetch_depth, batch_transforms)
+        if use_validation and not async_validation:
+            val_loader = DevicePrefetcher(val_loader, device, prefetch_depth, batch_transforms)
+        batch_transforms = None # applied by the prefetchers
+    
+    # Create model
+    model = create_model(config, device)
+
     # Load checkpoint for resuming training
     start_epoch: int = 1
     end_epoch: int = config['training']['num_epochs'] + 1
     if config['training']['resume']:
-        load_checkpoint(model, config)
-        start_epoch = config['training'].get('resume_epoch', 1)
+        resume_epoch = load_checkpoint(model, config, hard_sampler, resumable_sampler, augment)
+        start_epoch = resume_epoch or config['training'].get('resume_epoch', 1)
+
+    if world_size > 1:
+        # Rank 0's weights on every rank, averaged gradients and synchronized BatchNorm layers
+        data_parallel(model, sync_batchnorm=dist_config.get('sync_batchnorm', 'all'),
+                      bucket_mb=dist_config.get('bucket_mb', 25))
     
-    model = torch.compile(model) # compile model for possible performance boost
+    if config['training'].get('compile', True):
+        # Compiled kernels are reused across restarts with the same model settings and torch version
+        cache_dir = enable_compile_cache(config['training'].get('compile_cache_dir', './models/compile_cache'), {
+            'model': config['model'],
+            'precision': config['training'].get('precision', 'fp32'),
+            'micro_batch_size': config['training'].get('micro_batch_size'),
+        })
+        if compile_train_step(model, config['training'].get('compile_mode'), log_compile_report):
+            logging.info(f"Compiling the training step on the first batch, cache in {cache_dir}")
+        else:
+            logging.warning("torch.compile is not supported on this platform, training in eager mode")
+
+    # Checkpoints are written by a background thread while training continues
+    checkpointer = AsyncCheckpointer()
+
+    # Per-phase step timings and throughput of every epoch, logged and appended to a JSONL file
+    timing = config['training'].get('timing', True)
+    timer = PhaseTimer(device, enabled=timing)
+    model.timer = timer if timing else None
+    timing_file = config['training'].get('timing_file') or Path(config['training']['results_dir']) / 'timing.jsonl'
 
     # Training loop
     for epoch in range(start_epoch, end_epoch):
+        if hasattr(train_loader.dataset, 'set_epoch'):
+            train_loader.dataset.set_epoch(epoch)
+        if isinstance(train_sampler, DistributedSampler):
+            train_sampler.set_epoch(epoch)
+
         # Train
-        train_epoch(model, train_loader, device, epoch, experiment)
+        timer.reset()
+        train_epoch(model, train_loader, device, epoch, experiment, batch_transforms, augment, loss_table,
+                    config['training'].get('log_interval', 50), timer)
         
         # Validate
-        if use_validation:
-            validate(model, val_loader, device, epoch, experiment)
+        if use_validation and (epoch % eval_freq == 0 or epoch == end_epoch - 1):
+            if validator is not None:
+                # Waits if the worker is still busy with earlier epochs
+                waited = validator.submit(epoch, {'gen': model.gen.state_dict(), 'disc': model.disc.state_dict()})
+                log_metrics(experiment, {'validation_wait_s': waited}, epoch)
+            elif not async_validation:
+                log_metrics(experiment, validate(model, val_loader, device, batch_transforms), epoch)
+        if validator is not None:
+            for val_epoch, val_losses in validator.poll(): # logged with the epoch of the validated weights
+                log_metrics(experiment, val_losses, val_epoch)
         
         # Regular checkpoint saving
         if epoch % config['training']['save_freq'] == 0:
-            save_checkpoint(model, epoch, config)
+            start = time.perf_counter() # the training loop only waits for the snapshot and the previous write
+            save_checkpoint(model, epoch, config, checkpointer, hard_sampler, resumable_sampler, augment)
+            timer.add('checkpoint', time.perf_counter() - start)
+
+        if timing:
+            timings = timer.summary()
+            log_metrics(experiment, timings, epoch)
+            log_jsonl(timing_file, {'epoch': epoch, **timings})
     
     # Save final model
-    save_checkpoint(model, config['training']['num_epochs'], config)
+    save_checkpoint(model, config['training']['num_epochs'], config, checkpointer, hard_sampler, resumable_sampler, augment)
+    checkpointer.close() # wait for the last checkpoint
+    if validator is not None:
+        for val_epoch, val_losses in validator.close():
+            log_metrics(experiment, val_losses, val_epoch)
     
-    if config['logging']['comet']['enabled']:
+    if experiment:
         experiment.finish()
 
+def main():
+    # Load configuration
+    config = Config('config.yaml')
+
+    dist_config = config.get('distributed', {})
+    if dist_config.get('enabled', False) and 'RANK' not in os.environ:
+        # Spawn the ranks on this machine, torchrun starts them itself (and spans machines)
+        launch_local(run, dist_config.get('world_size', 2), config, master_port=dist_config.get('master_port', 29500))
+    else:
+        run(config)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+Converts checkpoints trained on 3-channel (RGB-replicated) SAR input into
+single-channel (c_in: 1) checkpoints.
+
+Sentinel-1 images are single-channel, so the RGB input of existing models is
+the same image three times. A convolution over three identical channels
+equals a convolution over one channel with the three kernels summed, so
+folding the SAR input kernels of the first layer gives an equivalent model:
+
+    python -m utils.convert_checkpoint --gen pix2pix_gen_180.pth --gen-out pix2pix_gen_180_c1.pth
+"""
+import argparse
+
+import torch
+
+# First convolution of `UnetGenerator` (encoder.enc1) and of `PatchGAN` (both discriminator types)
+GEN_INPUT_KEY = 'encoder.enc1.conv_block.0.weight'
+DISC_INPUT_KEY = 'model.model.0.conv_block.0.weight'
+
+
+def fold_input_channels(weight: torch.Tensor, start: int = 0, count: int = 3) -> torch.Tensor:
+    """
+    Replaces `count` input channels of a convolution weight, starting at `start`, by their sum.
+
+    Args:
+        weight (torch.Tensor): Convolution weight of shape (C_out, C_in, kH, kW)
+        start (int, optional): First input channel to fold. Default is 0.
+        count (int, optional): Number of input channels to fold. Default is 3.
+
+    Returns:
+        torch.Tensor: Weight of shape (C_out, C_in - count + 1, kH, kW)
+    """
+    folded = weight[:, start:start + count].sum(dim=1, keepdim=True)
+    return torch.cat([weight[:, :start], folded, weight[:, start + count:]], dim=1)
+
+
+def convert_checkpoint(in_path: str, out_path: str, key: str, c_in: int = 3):
+    """
+    Folds the SAR input channels of a checkpoint's first convolution.
+
+    Args:
+        in_path (str): Path of the 3-channel state dict
+        out_path (str): Path to save the 1-channel state dict to
+        key (str): State dict key of the first convolution weight
+        c_in (int, optional): Number of SAR channels in the checkpoint. Default is 3.
+    """
+    state_dict = torch.load(in_path, map_location='cpu', weights_only=True)
+    if key not in state_dict:
+        raise KeyError(f"{key} not found in {in_path}, is it the right checkpoint type?")
+    # SAR channels come first in both the generator and the conditional discriminator input
+    state_dict[key] = fold_input_channels(state_dict[key], start=0, count=c_in)
+    torch.save(state_dict, out_path)
+    print(f"Saved single-channel checkpoint to {out_path} ({key}: {tuple(state_dict[key].shape)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert 3-channel SAR checkpoints to single-channel (c_in: 1).")
+    parser.add_argument("--gen", type=str, help="Generator checkpoint to convert")
+    parser.add_argument("--gen-out", type=str, help="Path to save the converted generator checkpoint")
+    parser.add_argument("--disc", type=str, help="Discriminator checkpoint to convert (conditional GANs only)")
+    parser.add_argument("--disc-out", type=str, help="Path to save the converted discriminator checkpoint")
+    args = parser.parse_args()
+
+    if not args.gen and not args.disc:
+        parser.error("Nothing to convert, pass --gen and/or --disc")
+    if args.gen:
+        if not args.gen_out:
+            parser.error("--gen needs --gen-out")
+        convert_checkpoint(args.gen, args.gen_out, GEN_INPUT_KEY)
+    if args.disc:
+        if not args.disc_out:
+            parser.error("--disc needs --disc-out")
+        convert_checkpoint(args.disc, args.disc_out, DISC_INPUT_KEY)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,17 @@
+import argparse
 from pathlib import Path
 import shutil
 from kaggle.api.kaggle_api_extended import KaggleApi
 
-def download_and_organize_dataset(dataset_name: str, local_data_path: Path):
+def download_and_organize_dataset(dataset_name: str, local_data_path: Path, extract: bool = True):
     """
     Download Kaggle dataset and organize it in the specified local data folder.
     
     Args:
         dataset_name (str): Kaggle dataset name in format 'owner/dataset'
         local_data_path (Path): Local path where dataset will be downloaded and organized
+        extract (bool, optional): If False, keep the zip archive as is, to be read by
+            `StreamingSentinel` (see `dataset.archives` in config.yaml). Default is True.
     """
     # Initialize Kaggle API
     api = KaggleApi()
@@ -20,11 +23,18 @@ def download_and_organize_dataset(dataset_name: str, local_data_path: Path):
     
     # Download dataset
     try:
-        api.dataset_download_files(dataset_name, path=temp_download_dir, unzip=True)
+        api.dataset_download_files(dataset_name, path=temp_download_dir, unzip=extract)
     except Exception as e:
         print(f"Error downloading dataset: {e}")
         return
     
+    if not extract:
+        for archive in temp_download_dir.glob('*.zip'):
+            shutil.move(str(archive), str(local_data_path / archive.name))
+            print(f"Dataset archive downloaded to {local_data_path / archive.name}")
+        shutil.rmtree(temp_download_dir)
+        return
+    
     # Move and organize files
     v2_source = temp_download_dir / 'v_2'
     if v2_source.exists():
@@ -36,11 +46,16 @@ def download_and_organize_dataset(dataset_name: str, local_data_path: Path):
     print(f"Dataset downloaded and organized in {local_data_path / 'v_2'}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Download the Sentinel-1&2 image pairs from Kaggle.")
+    parser.add_argument("--no-extract", action="store_true",
+                        help="Keep the zip archive instead of extracting it, for streaming")
+    args = parser.parse_args()
+
     # Configuration
     DATASET_NAME = 'requiemonk/sentinel12-image-pairs-segregated-by-terrain'
     LOCAL_DATA_PATH = Path('data') # /SAR2OPTICAL/data
     
-    download_and_organize_dataset(DATASET_NAME, LOCAL_DATA_PATH)
+    download_and_organize_dataset(DATASET_NAME, LOCAL_DATA_PATH, extract=not args.no_extract)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,262 @@
+"""
+Profiles a Sentinel dataset: per-category and per-channel statistics, image
+sizes, no-data fractions, and undecodable or mismatched image pairs.
+
+Pairs are decoded by a process pool. The report is cached next to the
+dataset and keyed by the pair catalog (`src.catalog.PairCatalog`), so a
+rerun on an unchanged dataset returns immediately and a rerun after adding
+or editing files only decodes the changed pairs:
+
+    python -m utils.dataset_stats --root-dir ./data/v_2/
+
+Set `dataset.stats_file` in config.yaml to the report to normalize the SAR
+input with its statistics instead of mean=0.5, std=0.5.
+"""
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from tqdm import tqdm
+
+from src.catalog import PairCatalog
+from src.dataset import open_image
+
+REPORT_VERSION = 2 # 2: 16-bit images are rescaled instead of clipped
+REPORT_FILE = '.sentinel_stats.json'
+MODALITIES = ('s1', 's2')
+
+
+def _profile_image(path: Path) -> dict:
+    """Decodes an image and returns its per-channel sums (of [0, 1] pixels), size and no-data pixel count.
+
+    Images are decoded like the dataset loaders decode them, 16-bit images are
+    rescaled to their full range and float images raise (see `src.dataset.open_image`).
+    """
+    pixels = np.asarray(open_image(path), dtype=np.float64) / 255.0
+    if pixels.ndim == 2:
+        pixels = pixels[..., None]
+    height, width, channels = pixels.shape
+    flat = pixels.reshape(-1, channels)
+    return {
+        'height': height,
+        'width': width,
+        'sum': flat.sum(axis=0).tolist(),
+        'sumsq': np.square(flat).sum(axis=0).tolist(),
+        'nodata': int(np.count_nonzero(flat.max(axis=1) == 0)), # black in every channel
+    }
+
+
+def _profile_pair(task: Tuple[str, str, str]) -> Tuple[str, dict]:
+    """Profiles a (SAR, optical) pair, recording why it is unusable instead of raising."""
+    root_dir, s1_rel, s2_rel = task
+    entry = {'error': None}
+    for modality, rel in zip(MODALITIES, (s1_rel, s2_rel)):
+        try:
+            entry[modality] = _profile_image(Path(root_dir) / rel)
+        except Exception as e: # corrupt or truncated files raise all kinds of errors
+            entry['error'] = f'{modality} could not be decoded: {type(e).__name__}: {e}'
+            return s1_rel, entry
+    s1, s2 = entry['s1'], entry['s2']
+    if (s1['height'], s1['width']) != (s2['height'], s2['width']):
+        entry['error'] = f"size mismatch: s1 is {s1['width']}x{s1['height']}, s2 is {s2['width']}x{s2['height']}"
+    return s1_rel, entry
+
+
+def _summarize(entries: Sequence[dict]) -> dict:
+    """Aggregates pair profiles into per-modality mean/std, sizes and no-data fractions."""
+    summary = {'num_pairs': len(entries)}
+    for modality in MODALITIES:
+        profiles = [entry[modality] for entry in entries]
+        if not profiles:
+            continue
+        channels = max(len(profile['sum']) for profile in profiles)
+        sums, sumsqs = np.zeros(channels), np.zeros(channels)
+        pixels, nodata = 0, 0
+        sizes = Counter()
+        for profile in profiles:
+            # Single-channel images count for every channel, as `Sentinel` replicates them to RGB
+            sums += np.broadcast_to(profile['sum'], channels)
+            sumsqs += np.broadcast_to(profile['sumsq'], channels)
+            num_pixels = profile['height'] * profile['width']
+            pixels += num_pixels
+            nodata += profile['nodata']
+            sizes[f"{profile['width']}x{profile['height']}"] += 1
+        mean = sums / pixels
+        std = np.sqrt(np.maximum(sumsqs / pixels - np.square(mean), 0))
+        summary[modality] = {
+            'mean': mean.tolist(),
+            'std': std.tolist(),
+            'nodata_fraction': nodata / pixels,
+            'sizes': dict(sizes.most_common()),
+        }
+    return summary
+
+
+def catalog_digest(records: Sequence[tuple]) -> str:
+    """Returns a digest of the catalog records (paths, sizes and modification times)."""
+    return hashlib.sha1(json.dumps(sorted(records)).encode()).hexdigest()
+
+
+def scan_dataset(root_dir: Union[str, Path],
+                 report_file: Optional[Union[str, Path]] = None,
+                 num_workers: int = 4,
+                 force: bool = False) -> dict:
+    """
+    Profiles every image pair of a dataset and writes the report, reusing the profiles of unchanged pairs.
+
+    Args:
+        root_dir (str | Path): Root directory of the dataset (see `Sentinel`)
+        report_file (str | Path, optional): Where to store the report. Defaults to ``root_dir/.sentinel_stats.json``
+        num_workers (int, optional): Number of decoding processes, 0 decodes in the calling process. Default is 4.
+        force (bool, optional): Decode every pair again. Default is False.
+
+    Returns:
+        dict: The report, with the keys 'total', 'categories' (summaries, see `_summarize`),
+            'problems' (unusable pairs) and 'pairs' (per-pair profiles)
+    """
+    root_dir = Path(root_dir)
+    report_file = Path(report_file) if report_file else root_dir / REPORT_FILE
+
+    catalog = PairCatalog(root_dir)
+    catalog.refresh()
+    digest = catalog_digest(catalog.records)
+
+    cached = {}
+    if report_file.exists() and not force:
+        try:
+            report = load_report(report_file)
+            if report['catalog_digest'] == digest:
+                return report
+            cached = report['pairs']
+        except (OSError, ValueError, KeyError) as e:
+            print(f'Could not read the stats report, rebuilding it\n\t{e}')
+
+    # A pair is profiled again if any of its files changed size or modification time
+    pairs, todo = {}, []
+    for s1_rel, s2_rel, category, *stats in catalog.records:
+        entry = cached.get(s1_rel)
+        if entry is not None and entry['s2_path'] == s2_rel and entry['stats'] == stats:
+            pairs[s1_rel] = entry
+        else:
+            pairs[s1_rel] = {'s2_path': s2_rel, 'category': category, 'stats': stats}
+            todo.append((str(root_dir), s1_rel, s2_rel))
+
+    if todo:
+        print(f'Profiling {len(todo)} of {len(pairs)} image pairs')
+        if num_workers > 0:
+            with Pool(num_workers) as pool:
+                results = list(tqdm(pool.imap_unordered(_profile_pair, todo, chunksize=16),
+                                    total=len(todo), desc='Profiling'))
+        else:
+            results = [_profile_pair(task) for task in tqdm(todo, desc='Profiling')]
+        for s1_rel, entry in results:
+            pairs[s1_rel].update(entry)
+
+    # Problems: undecodable or mismatched pairs, and pairs that do not have the dataset's usual size
+    problems = [{'s1': s1_rel, 's2': entry['s2_path'], 'error': entry['error']}
+                for s1_rel, entry in pairs.items() if entry['error']]
+    valid = {s1_rel: entry for s1_rel, entry in pairs.items() if not entry['error']}
+    sizes = Counter((entry['s1']['height'], entry['s1']['width']) for entry in valid.values())
+    if len(sizes) > 1:
+        (height, width), _ = sizes.most_common(1)[0]
+        for s1_rel, entry in list(valid.items()):
+            if (entry['s1']['height'], entry['s1']['width']) != (height, width):
+                problems.append({'s1': s1_rel, 's2': entry['s2_path'],
+                                 'error': f"unexpected size {entry['s1']['width']}x{entry['s1']['height']}, "
+                                          f"most pairs are {width}x{height}"})
+                del valid[s1_rel]
+
+    by_category: Dict[str, List[dict]] = {}
+    for entry in valid.values():
+        by_category.setdefault(entry['category'], []).append(entry)
+
+    report = {
+        'version': REPORT_VERSION,
+        'catalog_digest': digest,
+        'total': _summarize(list(valid.values())),
+        'categories': {category: _summarize(entries) for category, entries in sorted(by_category.items())},
+        'problems': sorted(problems, key=lambda problem: problem['s1']),
+        'pairs': pairs,
+    }
+    tmp_file = report_file.with_name(f'{report_file.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(report, f)
+        os.replace(tmp_file, report_file)
+    except OSError as e:
+        print(f'Could not save the stats report to {report_file}\n\t{e}')
+    return report
+
+
+def load_report(report_file: Union[str, Path]) -> dict:
+    """Loads a report written by `scan_dataset`."""
+    with open(report_file, 'r') as f:
+        report = json.load(f)
+    if report.get('version') != REPORT_VERSION:
+        raise ValueError(f'Unsupported stats report version in {report_file}, rerun utils.dataset_stats')
+    return report
+
+
+def input_normalization(report: Union[dict, str, Path], channels: int) -> Tuple[List[float], List[float]]:
+    """
+    Returns the (mean, std) of the SAR images of a report, to normalize `channels`-channel model inputs.
+
+    Args:
+        report (dict | str | Path): Report returned by `scan_dataset`, or its path
+        channels (int): Number of model input channels (model.c_in)
+
+    Returns:
+        Tuple[List[float], List[float]]: Per-channel mean and std of [0, 1] images
+    """
+    if not isinstance(report, dict):
+        report = load_report(report)
+    stats = report['total'].get('s1')
+    if stats is None:
+        raise ValueError('The stats report has no valid image pairs')
+    mean, std = np.asarray(stats['mean']), np.asarray(stats['std'])
+    if len(mean) != channels:
+        # Grayscale statistics of RGB-replicated SAR images are the same for every channel
+        variance = np.mean(np.square(std) + np.square(mean)) - np.square(np.mean(mean))
+        mean, std = np.full(channels, mean.mean()), np.full(channels, np.sqrt(variance))
+    return mean.tolist(), np.maximum(std, 1e-6).tolist()
+
+
+def config_normalization(config) -> Tuple[List[float], List[float]]:
+    """Returns the SAR input (mean, std) set by `dataset.stats_file` in the config, or the default 0.5, 0.5."""
+    stats_file = config['dataset'].get('stats_file')
+    if not stats_file:
+        return [0.5], [0.5]
+    return input_normalization(stats_file, config['model']['c_in'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile a Sentinel dataset and report unusable image pairs.")
+    parser.add_argument("--root-dir", type=str, required=True, help="Root directory of the PNG dataset")
+    parser.add_argument("--report", type=str, default=None, help=f"Report path (default: <root-dir>/{REPORT_FILE})")
+    parser.add_argument("--num-workers", type=int, default=4, help="Number of decoding processes")
+    parser.add_argument("--force", action="store_true", help="Profile every pair again")
+    args = parser.parse_args()
+
+    report = scan_dataset(args.root_dir, args.report, args.num_workers, args.force)
+
+    total = report['total']
+    print(f"{total['num_pairs']} valid image pairs, {len(report['problems'])} problems")
+    for name, summary in [('all', total), *report['categories'].items()]:
+        for modality in MODALITIES:
+            if modality in summary:
+                stats = summary[modality]
+                print(f"{name:>12} {modality}: mean={np.round(stats['mean'], 4).tolist()} "
+                      f"std={np.round(stats['std'], 4).tolist()} nodata={stats['nodata_fraction']:.4f} "
+                      f"sizes={stats['sizes']}")
+    for problem in report['problems']:
+        print(f"  {problem['s1']}: {problem['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Finds near-duplicate image pairs with perceptual hashes and writes a
+deduplicated split file.
+
+Tiles of overlapping ROIs contain many near-identical patches. Every pair
+gets a 64-bit pHash of its SAR and of its optical image. Two pairs are near
+duplicates when both hashes are within `radius` bits of each other. Near
+duplicates are clustered, and the training split keeps `keep` pairs per
+cluster. By default, training pairs that duplicate a validation or test pair
+are dropped too. The validation and test splits are kept as they are:
+
+    python -m utils.dedup --root-dir ./data/v_2/ --output ./data/split_dedup.json
+
+Then set `split_mode: "split"` and `split_file` in config.yaml. The hashes
+are cached next to the dataset and keyed by the pair catalog, so new
+categories or changed files are the only ones hashed on a rerun.
+"""
+import argparse
+import json
+import os
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from src.catalog import PairCatalog
+from src.dataset import Sentinel, SplitType, open_image, read_split
+
+INDEX_VERSION = 1
+INDEX_FILE = '.sentinel_phash.json'
+HASH_SIZE = 8 # 8x8 DCT coefficients, 64-bit hashes
+DCT_SIZE = 32
+
+# Number of set bits of every byte value, numpy 1.x has no popcount
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix, the 2D DCT of `x` is ``D @ x @ D.T``."""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def phash(path: Path) -> int:
+    """
+    Computes the 64-bit perceptual hash of an image.
+
+    The image is reduced to 32x32 grayscale. Each bit tells whether one of
+    the 8x8 lowest-frequency DCT coefficients is above their median.
+
+    Args:
+        path (Path): Image file
+
+    Returns:
+        int: The hash as an unsigned 64-bit integer
+    """
+    pixels = np.asarray(open_image(path, 'L').resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:]) # the DC term only holds the mean brightness
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def _hash_pair(task: Tuple[str, str, str]) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """Hashes both images of a pair, None if either cannot be decoded."""
+    root_dir, s1_rel, s2_rel = task
+    try:
+        return s1_rel, (phash(Path(root_dir) / s1_rel), phash(Path(root_dir) / s2_rel))
+    except Exception: # corrupt files, see utils/dataset_stats.py
+        return s1_rel, None
+
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Element-wise Hamming distance of two uint64 arrays."""
+    xor = np.ascontiguousarray(np.bitwise_xor(a, b), dtype=np.uint64)
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PHashIndex:
+    """
+    Multi-index hashing over the (SAR, optical) hashes of image pairs.
+
+    For a radius `r`, the SAR hash is split into ``r + 1`` disjoint bit
+    chunks. Two hashes within `r` bits agree exactly on at least one chunk,
+    so only pairs sharing a chunk value are compared. The index therefore
+    costs a few dictionary lookups per query instead of a linear scan.
+
+    Args:
+        keys (Sequence[str]): Relative SAR path of every pair
+        s1_hashes (np.ndarray): SAR hashes, uint64
+        s2_hashes (np.ndarray): Optical hashes, uint64
+        radius (int): Maximum Hamming distance of near duplicates, for both hashes
+    """
+    def __init__(self, keys: Sequence[str], s1_hashes: np.ndarray, s2_hashes: np.ndarray, radius: int):
+        if not 0 <= radius < 64:
+            raise ValueError("radius must be in [0, 64)")
+        self.keys = list(keys)
+        self.s1_hashes = np.asarray(s1_hashes, dtype=np.uint64)
+        self.s2_hashes = np.asarray(s2_hashes, dtype=np.uint64)
+        self.radius = radius
+
+        # Pairs with identical hashes are indexed once, the tables hold ids of unique (SAR, optical) hashes
+        unique, self.first, inverse = np.unique(np.stack([self.s1_hashes, self.s2_hashes], axis=1), axis=0,
+                                                return_index=True, return_inverse=True)
+        self.unique_s1, self.unique_s2 = unique[:, 0], unique[:, 1]
+        self.inverse = inverse.ravel() # unique hash of every pair, self.first is the first pair of every unique hash
+
+        # (shift, mask) of every chunk, the chunks cover the 64 bits
+        bounds = np.linspace(0, 64, radius + 2).astype(int)
+        self.chunks = [(int(start), (1 << int(end - start)) - 1) for start, end in zip(bounds[:-1], bounds[1:])]
+        self.tables: List[Dict[int, np.ndarray]] = []
+        for shift, mask in self.chunks:
+            values = (self.unique_s1 >> np.uint64(shift)) & np.uint64(mask)
+            order = np.argsort(values, kind='stable')
+            values, starts = np.unique(values[order], return_index=True)
+            self.tables.append(dict(zip(values.tolist(), np.split(order, starts[1:]))))
+
+    def _query_unique(self, s1_hash: int, s2_hash: int) -> np.ndarray:
+        """Returns the ids of the unique hashes within `radius` of the given (SAR, optical) hashes."""
+        candidates = [table.get((s1_hash >> shift) & mask) for (shift, mask), table in zip(self.chunks, self.tables)]
+        candidates = [ids for ids in candidates if ids is not None]
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        ids = np.unique(np.concatenate(candidates))
+        close = (hamming(self.unique_s1[ids], np.uint64(s1_hash)) <= self.radius) \
+            & (hamming(self.unique_s2[ids], np.uint64(s2_hash)) <= self.radius)
+        return ids[close]
+
+    def query(self, s1_hash: int, s2_hash: int) -> np.ndarray:
+        """Returns the ids of the pairs within `radius` of the given (SAR, optical) hashes."""
+        return np.flatnonzero(np.isin(self.inverse, self._query_unique(s1_hash, s2_hash)))
+
+    def near_duplicates(self) -> np.ndarray:
+        """
+        Returns edges (i, j), i < j, whose connected components are the near-duplicate clusters, as an (E, 2) array.
+
+        Pairs with identical hashes are linked to the first of them rather
+        than to each other, so a large group of identical tiles (e.g. blank
+        ones) costs one edge per pair. Distinct hashes are compared one
+        query at a time, which bounds the memory by the largest bucket
+        instead of its number of pairs.
+        """
+        edges = [np.stack([self.first[self.inverse], np.arange(len(self.keys))], axis=1)]
+        for u, (s1_hash, s2_hash) in enumerate(zip(self.unique_s1.tolist(), self.unique_s2.tolist())):
+            close = self._query_unique(s1_hash, s2_hash)
+            close = close[close > u] # every pair of unique hashes once
+            edges.append(np.stack([np.full(len(close), self.first[u]), self.first[close]], axis=1))
+        edges = np.sort(np.concatenate(edges), axis=1)
+        return edges[edges[:, 0] != edges[:, 1]]
+
+    def clusters(self) -> np.ndarray:
+        """Returns the cluster id of every pair, the connected components of the near-duplicate graph."""
+        parent = np.arange(len(self.keys))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]] # path halving
+                i = parent[i]
+            return i
+
+        for i, j in self.near_duplicates().tolist():
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+        return np.array([find(i) for i in range(len(parent))])
+
+
+def update_hashes(root_dir: Union[str, Path],
+                  index_file: Optional[Union[str, Path]] = None,
+                  num_workers: int = 4) -> Dict[str, Tuple[int, int]]:
+    """
+    Hashes the pairs of a dataset, reusing the cached hashes of unchanged pairs.
+
+    Args:
+        root_dir (str | Path): Root directory of the dataset (see `Sentinel`)
+        index_file (str | Path, optional): Where to cache the hashes. Defaults to ``root_dir/.sentinel_phash.json``
+        num_workers (int, optional): Number of hashing processes, 0 hashes in the calling process. Default is 4.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: (SAR hash, optical hash) keyed by the relative SAR path,
+            undecodable pairs are left out
+    """
+    root_dir = Path(root_dir)
+    index_file = Path(index_file) if index_file else root_dir / INDEX_FILE
+
+    cached = {}
+    if index_file.exists():
+        try:
+            with open(index_file, 'r') as f:
+                content = json.load(f)
+            if content.get('version') == INDEX_VERSION:
+                cached = content['pairs']
+        except (OSError, ValueError) as e:
+            print(f'Could not read the hash index, rebuilding it\n\t{e}')
+
+    catalog = PairCatalog(root_dir)
+    catalog.refresh()
+
+    # A pair is hashed again if any of its files changed size or modification time
+    pairs, todo = {}, []
+    for s1_rel, s2_rel, _, *stats in catalog.records:
+        entry = cached.get(s1_rel)
+        if entry is not None and entry['stats'] == stats:
+            pairs[s1_rel] = entry
+        else:
+            pairs[s1_rel] = {'stats': stats, 'hashes': None}
+            todo.append((str(root_dir), s1_rel, s2_rel))
+
+    if todo:
+        print(f'Hashing {len(todo)} of {len(pairs)} image pairs')
+        if num_workers > 0:
+            with Pool(num_workers) as pool:
+                results = list(tqdm(pool.imap_unordered(_hash_pair, todo, chunksize=64),
+                                    total=len(todo), desc='Hashing'))
+        else:
+            results = [_hash_pair(task) for task in tqdm(todo, desc='Hashing')]
+        for s1_rel, hashes in results:
+            pairs[s1_rel]['hashes'] = [f'{h:016x}' for h in hashes] if hashes else None
+
+    if todo or pairs.keys() != cached.keys():
+        tmp_file = index_file.with_name(f'{index_file.name}.{os.getpid()}.tmp')
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'pairs': pairs}, f)
+            os.replace(tmp_file, index_file)
+        except OSError as e:
+            print(f'Could not save the hash index to {index_file}\n\t{e}')
+
+    return {s1_rel: (int(entry['hashes'][0], 16), int(entry['hashes'][1], 16))
+            for s1_rel, entry in pairs.items() if entry['hashes']}
+
+
+def dedup_split(root_dir: Union[str, Path],
+                output_file: Union[str, Path],
+                radius: int = 6,
+                keep: int = 1,
+                drop_leaks: bool = True,
+                split_file: Optional[Union[str, Path]] = None,
+                split_ratio: Tuple[float, float, float] = (0.7, 0.15, 0.15),
+                seed: int = 42,
+                num_workers: int = 4) -> dict:
+    """
+    Writes a split file whose training split keeps at most `keep` pairs per near-duplicate cluster.
+
+    Args:
+        root_dir (str | Path): Root directory of the dataset (see `Sentinel`)
+        output_file (str | Path): Split file to write, readable by `Sentinel` with ``split_mode='split'``
+        radius (int, optional): Maximum Hamming distance of near duplicates. Default is 6.
+        keep (int, optional): Training pairs kept per cluster. Default is 1.
+        drop_leaks (bool, optional): Drop training pairs that duplicate a validation or test pair. Default is True.
+        split_file (str | Path, optional): Split file to deduplicate. Defaults to the random split of `Sentinel`
+        split_ratio (Tuple[float, float, float], optional): Ratios of the random split. Default is (0.7, 0.15, 0.15).
+        seed (int, optional): Seed of the random split. Default is 42.
+        num_workers (int, optional): Number of hashing processes. Default is 4.
+
+    Returns:
+        dict: Summary of the deduplication
+    """
+    root_dir = Path(root_dir)
+    hashes = update_hashes(root_dir, num_workers=num_workers)
+    keys = sorted(hashes)
+    index = PHashIndex(keys, [hashes[key][0] for key in keys], [hashes[key][1] for key in keys], radius)
+    clusters = index.clusters()
+    cluster_of = dict(zip(keys, clusters.tolist()))
+
+    # The splits to deduplicate, as relative SAR paths
+    splits = {}
+    for split_type in SplitType:
+        if split_file:
+            splits[split_type.value] = sorted(read_split(split_file, split_type))
+        else:
+            dataset = Sentinel(root_dir, split_type=split_type.value, split_mode='random',
+                               split_ratio=split_ratio, seed=seed, use_catalog=True)
+            splits[split_type.value] = [s1.relative_to(root_dir).as_posix() for s1, _ in dataset.image_pairs]
+
+    # Clusters already covered by the held-out splits
+    held_out = {cluster_of[key] for name in ('val', 'test') for key in splits[name] if key in cluster_of}
+    kept, per_cluster = [], {}
+    for key in sorted(splits['train']):
+        cluster = cluster_of.get(key)
+        if cluster is None: # undecodable pair, left for the dataset to report
+            kept.append(key)
+            continue
+        if drop_leaks and cluster in held_out:
+            continue
+        if per_cluster.get(cluster, 0) < keep:
+            per_cluster[cluster] = per_cluster.get(cluster, 0) + 1
+            kept.append(key)
+
+    summary = {
+        'radius': radius,
+        'keep': keep,
+        'drop_leaks': drop_leaks,
+        'num_pairs': len(keys),
+        'num_clusters': len(np.unique(clusters)),
+        'train_before': len(splits['train']),
+        'train_after': len(kept),
+    }
+    with open(output_file, 'w') as f:
+        json.dump({'data': {**splits, 'train': kept}, 'dedup': summary}, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a split file without near-duplicate training pairs.")
+    parser.add_argument("--root-dir", type=str, required=True, help="Root directory of the PNG dataset")
+    parser.add_argument("--output", type=str, required=True, help="Split file to write")
+    parser.add_argument("--radius", type=int, default=6, help="Max Hamming distance (of 64 bits) of near duplicates")
+    parser.add_argument("--keep", type=int, default=1, help="Training pairs kept per near-duplicate cluster")
+    parser.add_argument("--keep-leaks", action="store_true",
+                        help="Keep training pairs that duplicate validation/test pairs")
+    parser.add_argument("--split-file", type=str, default=None, help="Split file to deduplicate (default: random split)")
+    parser.add_argument("--split-ratio", type=float, nargs=3, default=[0.7, 0.15, 0.15], help="Random split ratios")
+    parser.add_argument("--seed", type=int, default=42, help="Random split seed, as dataset.seed")
+    parser.add_argument("--num-workers", type=int, default=4, help="Number of hashing processes")
+    args = parser.parse_args()
+
+    summary = dedup_split(args.root_dir, args.output, args.radius, args.keep, not args.keep_leaks,
+                          args.split_file, tuple(args.split_ratio), args.seed, args.num_workers)
+    removed = summary['train_before'] - summary['train_after']
+    print(f"{summary['num_clusters']} clusters over {summary['num_pairs']} pairs, "
+          f"training split {summary['train_before']} -> {summary['train_after']} pairs "
+          f"({removed / max(summary['train_before'], 1):.1%} shorter epochs)")
+    print(f"Split file written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
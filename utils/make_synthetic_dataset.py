@@ -0,0 +1,213 @@
+"""
+Writes a synthetic Sentinel-1&2 dataset for offline scale and performance testing.
+
+The tree has the same ``<category>/s1|s2/ROIs<roi>_<season>_s<1|2>_<scene>_p<patch>.png``
+layout and pairing convention as the real dataset, so `Sentinel`, the
+packing, profiling and dedup tools, and the training and inference
+scripts all run on it unchanged (16-bit SAR images are rescaled to 8 bits
+when decoded, see `src.dataset.open_image`). Images are generated from a
+seed: each scene has a smooth random field and its patches are
+overlapping crops of it (so the dedup tools find near-duplicates), the
+optical image colors the crop, and the SAR image is the same crop under
+multiplicative speckle drawn per patch. Runs with the same arguments
+write identical files, whatever the number of processes:
+
+    python -m utils.make_synthetic_dataset --out-dir ./data/synthetic/ --pairs-per-category 10000
+
+Optional corrupt (truncated) files and pairs with a missing partner image
+mimic a damaged download.
+"""
+import argparse
+import json
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from src.catalog import sar_to_optical_name
+from src.dataset import open_image
+
+CATEGORIES = ('agri', 'barrenland', 'grassland', 'urban')
+ROIS = ('ROIs1158_spring', 'ROIs1868_summer', 'ROIs1970_fall', 'ROIs2017_winter')
+SCENE_GRID = 8 # a scene is cut into a SCENE_GRID x SCENE_GRID grid of overlapping patches
+PATCHES_PER_SCENE = SCENE_GRID ** 2 # patches sharing a scene, like the pXXX patches of a real ROI scene
+
+
+def _smooth_field(rng: np.random.Generator, size: Tuple[int, int], channels: int) -> np.ndarray:
+    """Random low-frequency field in [0, 1], of shape (H, W, channels)."""
+    coarse = rng.random((8, 8, channels))
+    fields = [np.asarray(Image.fromarray(coarse[..., c].astype(np.float32), mode='F')
+                         .resize((size[1], size[0]), Image.BICUBIC)) for c in range(channels)]
+    return np.clip(np.stack(fields, axis=-1), 0, 1)
+
+
+def _write_pair(task: dict) -> Dict[str, int]:
+    """Generates and writes one pair, returns what was written."""
+    rng = np.random.default_rng([task['seed'], task['category_id'], task['index']])
+    height, width = task['size']
+    # The patches of a scene are overlapping crops of its field, neighbours share 7/8 of their pixels
+    stride_y, stride_x = height // SCENE_GRID, width // SCENE_GRID
+    scene_rng = np.random.default_rng([task['seed'], task['category_id'], task['scene']])
+    field = _smooth_field(scene_rng, (height + (SCENE_GRID - 1) * stride_y, width + (SCENE_GRID - 1) * stride_x), 1)
+    row, col = divmod(task['patch'], SCENE_GRID)
+    scene = field[row * stride_y:row * stride_y + height, col * stride_x:col * stride_x + width]
+
+    # Optical: the scene colored by a per-category palette, plus a little texture
+    palette = np.random.default_rng([task['seed'], task['category_id']]).random((2, 3))
+    optical = palette[0] * scene + palette[1] * (1 - scene) + 0.05 * rng.standard_normal((height, width, 3))
+    optical = (np.clip(optical, 0, 1) * 255).astype(np.uint8)
+
+    # SAR: the same scene under multi-look gamma speckle
+    looks = 4
+    sar = scene[..., 0] * rng.gamma(looks, 1 / looks, (height, width))
+    sar = np.clip(sar / 2, 0, 1)
+    if task['bit_depth'] == 16:
+        sar = Image.fromarray((sar * 65535).astype(np.uint16))
+    else:
+        sar = Image.fromarray((sar * 255).astype(np.uint8))
+
+    s1_path, s2_path = Path(task['s1_path']), Path(task['s2_path'])
+    outcome = {'pairs': 1, 'corrupt': 0, 'missing': 0}
+    if task['missing']:
+        outcome['missing'] = 1
+        # Drop either the SAR or the optical image, both leave the pair unmatched
+        if rng.random() < 0.5:
+            s1_path = None
+        else:
+            s2_path = None
+    if s1_path is not None:
+        sar.save(s1_path, compress_level=1)
+    if s2_path is not None:
+        Image.fromarray(optical).save(s2_path, compress_level=1)
+
+    if task['corrupt'] and not task['missing']:
+        outcome['corrupt'] = 1
+        path = s1_path if rng.random() < 0.5 else s2_path
+        data = path.read_bytes()
+        path.write_bytes(data[:max(64, int(len(data) * rng.uniform(0.1, 0.9)))]) # truncated download
+    return outcome
+
+
+def _check_sar_decoding(out_dir: Path, categories: Sequence[str]):
+    """Makes sure a written 16-bit SAR image decodes to graded pixels through the dataset loaders, not clipped ones."""
+    path = next((path for category in categories for path in sorted((out_dir / category / 's1').glob('*.png'))), None)
+    if path is None:
+        return
+    try:
+        pixels = np.asarray(open_image(path, 'L'))
+    except Exception: # a truncated image, see `corrupt_fraction`
+        return
+    if pixels.max() == pixels.min() or np.mean(pixels == 255) > 0.5:
+        raise RuntimeError(f"{path} decodes to near-constant pixels, 16-bit SAR images are not read correctly")
+
+
+def make_dataset(out_dir: Union[str, Path],
+                 categories: Sequence[str] = CATEGORIES,
+                 pairs_per_category: Union[int, Sequence[int]] = 1000,
+                 size: Tuple[int, int] = (256, 256),
+                 bit_depth: int = 8,
+                 corrupt_fraction: float = 0.0,
+                 missing_fraction: float = 0.0,
+                 num_workers: int = 4,
+                 seed: int = 0) -> Dict[str, int]:
+    """
+    Writes a synthetic dataset.
+
+    Args:
+        out_dir (str | Path): Root directory of the dataset to write
+        categories (Sequence[str], optional): Category names. Defaults to the four SEN1-2 terrain categories.
+        pairs_per_category (int | Sequence[int], optional): Pairs per category, or one count per category.
+            Default is 1000.
+        size (Tuple[int, int], optional): (height, width) of the images. Default is (256, 256).
+        bit_depth (int, optional): 8 or 16 bits per SAR pixel. The optical images are always 8-bit
+            RGB, as PNG writers in PIL have no 16-bit RGB mode. Default is 8.
+        corrupt_fraction (float, optional): Fraction of pairs with a truncated image. Default is 0.
+        missing_fraction (float, optional): Fraction of pairs missing their SAR or optical image. Default is 0.
+        num_workers (int, optional): Number of writing processes, 0 writes in the calling process. Default is 4.
+        seed (int, optional): Random seed. Default is 0.
+
+    Returns:
+        Dict[str, int]: Number of pairs written, corrupt and missing
+    """
+    if bit_depth not in (8, 16):
+        raise ValueError("bit_depth must be 8 or 16")
+    out_dir = Path(out_dir)
+    counts = [pairs_per_category] * len(categories) if isinstance(pairs_per_category, int) \
+        else list(pairs_per_category)
+    if len(counts) != len(categories):
+        raise ValueError("Give one pair count per category")
+
+    rng = np.random.default_rng(seed)
+    tasks: List[dict] = []
+    for category_id, (category, count) in enumerate(zip(categories, counts)):
+        for modality in ('s1', 's2'):
+            (out_dir / category / modality).mkdir(parents=True, exist_ok=True)
+        damage = rng.random((count, 2))
+        for index in range(count):
+            scene, patch = divmod(index, PATCHES_PER_SCENE)
+            roi = ROIS[scene % len(ROIS)]
+            s1_name = f'{roi}_s1_{category_id * 1000 + scene}_p{patch}.png'
+            tasks.append({
+                'seed': seed,
+                'category_id': category_id,
+                'index': index,
+                'scene': scene,
+                'patch': patch,
+                'size': size,
+                'bit_depth': bit_depth,
+                's1_path': str(out_dir / category / 's1' / s1_name),
+                's2_path': str(out_dir / category / 's2' / sar_to_optical_name(s1_name)),
+                'missing': bool(damage[index, 0] < missing_fraction),
+                'corrupt': bool(damage[index, 1] < corrupt_fraction),
+            })
+
+    totals = {'pairs': 0, 'corrupt': 0, 'missing': 0}
+    if num_workers > 0:
+        with Pool(num_workers) as pool:
+            outcomes = tqdm(pool.imap_unordered(_write_pair, tasks, chunksize=32), total=len(tasks), desc='Writing')
+            for outcome in outcomes:
+                for key in totals:
+                    totals[key] += outcome[key]
+    else:
+        for task in tqdm(tasks, desc='Writing'):
+            for key, value in _write_pair(task).items():
+                totals[key] += value
+
+    if bit_depth == 16:
+        _check_sar_decoding(out_dir, categories)
+
+    # Summary of the generated data, next to it (category loaders skip plain files)
+    with open(out_dir / 'synthetic.json', 'w') as f:
+        json.dump({
+            'seed': seed, 'size': list(size), 'bit_depth': bit_depth,
+            'categories': dict(zip(categories, counts)), **totals,
+        }, f, indent=2)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic Sentinel-1&2 dataset.")
+    parser.add_argument("--out-dir", type=str, required=True, help="Root directory of the dataset to write")
+    parser.add_argument("--categories", type=str, nargs='+', default=list(CATEGORIES), help="Category names")
+    parser.add_argument("--pairs-per-category", type=int, nargs='+', default=[1000],
+                        help="Pairs per category, a single value or one per category")
+    parser.add_argument("--size", type=int, nargs=2, default=[256, 256], metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument("--bit-depth", type=int, default=8, choices=(8, 16), help="Bits per SAR pixel")
+    parser.add_argument("--corrupt-fraction", type=float, default=0.0, help="Fraction of pairs with a truncated image")
+    parser.add_argument("--missing-fraction", type=float, default=0.0, help="Fraction of pairs missing a partner image")
+    parser.add_argument("--num-workers", type=int, default=4, help="Number of writing processes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    counts = args.pairs_per_category[0] if len(args.pairs_per_category) == 1 else args.pairs_per_category
+    totals = make_dataset(args.out_dir, args.categories, counts, tuple(args.size), args.bit_depth,
+                          args.corrupt_fraction, args.missing_fraction, args.num_workers, args.seed)
+    print(f"Wrote {totals['pairs']} pairs to {args.out_dir} "
+          f"({totals['corrupt']} corrupt, {totals['missing']} missing a partner image)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Packs the Sentinel-1&2 image pairs of a dataset into uint8 shards.
+
+The shards are read by `src.dataset.ShardedSentinel`, which memory-maps them
+instead of decoding two PNGs per sample. Packing is a one-time step:
+
+    python -m utils.pack_shards --root-dir ./data/v_2/ --out-dir ./data/v_2_shards/
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from torch.utils.data import DataLoader
+from torchvision.transforms import v2
+from tqdm import tqdm
+
+from src.dataset import Sentinel, ShardedSentinel
+
+
+def pack_dataset(root_dir: Union[str, Path],
+                 out_dir: Union[str, Path],
+                 shard_size: int = 4096,
+                 num_workers: int = 4,
+                 sar_channels: int = 3,
+                 speckle_filter: Optional[dict] = None):
+    """
+    Decodes every image pair of `root_dir` and writes them into fixed-shape shards.
+
+    Args:
+        root_dir (str | Path): Root directory of the PNG dataset (see `Sentinel`)
+        out_dir (str | Path): Directory to write the shards and `index.json` into
+        shard_size (int, optional): Number of pairs per shard. Default is 4096.
+        num_workers (int, optional): Number of processes decoding PNGs. Default is 4.
+        sar_channels (int, optional): Channels of the packed SAR images (1 or 3). Default is 3.
+        speckle_filter (dict, optional): Pack the speckle-filtered SAR images (see utils/speckle_filter.py)
+    """
+    root_dir = Path(root_dir)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Keep the decoded uint8 CHW tensors, the shards store the raw pixels
+    dataset = Sentinel(root_dir, input_transform=v2.Identity(), target_transform=v2.Identity(),
+                       sar_channels=sar_channels, speckle_filter=speckle_filter)
+    if len(dataset) == 0:
+        raise ValueError(f"No image pairs found in {root_dir}")
+    loader = DataLoader(dataset, batch_size=None, shuffle=False, num_workers=num_workers)
+
+    shapes = {}
+    shards = []
+    arrays = {}
+    for i, (s1_image, s2_image) in enumerate(tqdm(loader, desc="Packing")):
+        shard, row = divmod(i, shard_size)
+        images = {'s1': s1_image.permute(1, 2, 0).numpy(), 's2': s2_image.permute(1, 2, 0).numpy()} # CHW -> HWC
+
+        if not shapes: # the first pair fixes the shape of every shard
+            shapes = {modality: list(image.shape) for modality, image in images.items()}
+        for modality, image in images.items():
+            if list(image.shape) != shapes[modality]:
+                raise ValueError(f"Image {dataset.image_pairs[i][0 if modality == 's1' else 1]} has shape "
+                                 f"{image.shape}, expected {tuple(shapes[modality])}. Shards need a fixed shape.")
+
+        if row == 0: # start a new shard
+            count = min(shard_size, len(dataset) - i)
+            shards.append({'s1': f's1_{shard:05d}.npy', 's2': f's2_{shard:05d}.npy', 'count': count})
+            for modality in ('s1', 's2'):
+                arrays[modality] = np.lib.format.open_memmap(
+                    out_dir / shards[-1][modality], mode='w+', dtype=np.uint8,
+                    shape=(count, *shapes[modality]))
+
+        for modality, image in images.items():
+            arrays[modality][row] = image
+    for array in arrays.values():
+        array.flush()
+
+    pairs = [[s1.relative_to(root_dir).as_posix(), s2.relative_to(root_dir).as_posix(), s1.parent.parent.name]
+             for s1, s2 in dataset.image_pairs]
+    index = {
+        'format': 1,
+        'shard_size': shard_size,
+        'shape': shapes,
+        'speckle_filter': speckle_filter,
+        'shards': shards,
+        'pairs': pairs, # (SAR path, optical path, category), relative to root_dir
+    }
+    # Written last, so an interrupted run never leaves a readable but incomplete index
+    with open(out_dir / ShardedSentinel.INDEX_FILE, 'w') as f:
+        json.dump(index, f)
+
+    print(f"Packed {len(pairs)} image pairs into {len(shards)} shards in {out_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack Sentinel image pairs into memory-mappable uint8 shards.")
+    parser.add_argument("--root-dir", type=str, required=True, help="Root directory of the PNG dataset")
+    parser.add_argument("--out-dir", type=str, required=True, help="Directory to write the shards into")
+    parser.add_argument("--shard-size", type=int, default=4096, help="Number of image pairs per shard")
+    parser.add_argument("--num-workers", type=int, default=4, help="Number of decoding processes")
+    parser.add_argument("--sar-channels", type=int, default=3, choices=(1, 3),
+                        help="Channels of the packed SAR images, should match model.c_in")
+    parser.add_argument("--speckle-filter", type=json.loads, default=None,
+                        help='Pack speckle-filtered SAR images, e.g. \'{"name": "lee", "size": 7, "looks": 4}\'')
+    args = parser.parse_args()
+
+    pack_dataset(args.root_dir, args.out_dir, args.shard_size, args.num_workers, args.sar_channels,
+                 args.speckle_filter)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Speckle-filters the SAR images of a dataset once, so training reads the filtered images.
+
+The filtered images are written next to the originals, in a directory
+named after the filter parameters (see `src.speckle.filter_tag`):
+root_dir/
+    category1/
+        s1/
+        s1_lee7_l4/
+        s2/
+
+Set `dataset.speckle_filter` in config.yaml to the same spec and
+`Sentinel` reads ``s1_<tag>`` instead of ``s1``, while inference applies
+the same filter on the fly. Reruns only filter new or changed images:
+
+    python -m utils.speckle_filter --root-dir ./data/v_2/ --filter lee --size 7 --looks 4
+"""
+import argparse
+import json
+import os
+from contextlib import nullcontext
+from multiprocessing import Pool
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from src.catalog import PairCatalog
+from src.dataset import open_image
+from src.speckle import FILTERS, apply_speckle_filter, filter_tag, filtered_path
+
+
+def _filter_images(task: Tuple[List[Tuple[str, str]], dict]) -> Tuple[int, List[Tuple[str, str]]]:
+    """Filters a chunk of (source, destination) images, returns the number processed and the errors."""
+    files, spec = task
+    errors = []
+    for src, dst in files:
+        try:
+            pixels = np.asarray(open_image(src))
+        except Exception as e: # corrupt files, see utils/dataset_stats.py
+            errors.append((src, f'{type(e).__name__}: {e}'))
+            continue
+        tmp = Path(f'{dst}.{os.getpid()}.tmp')
+        Image.fromarray(apply_speckle_filter(pixels, spec)).save(tmp, format='PNG')
+        os.replace(tmp, dst) # readers never see a partial image
+    return len(files), errors
+
+
+def filter_dataset(root_dir: Union[str, Path], spec: dict, num_workers: int = 4, force: bool = False) -> int:
+    """
+    Writes the filtered variant of every SAR image of a dataset, skipping up-to-date ones.
+
+    Args:
+        root_dir (str | Path): Root directory of the dataset (see `Sentinel`)
+        spec (dict): Filter spec, e.g. {'name': 'lee', 'size': 7, 'looks': 4}
+        num_workers (int, optional): Number of filtering processes, 0 filters in the calling process. Default is 4.
+        force (bool, optional): Filter every image again. Default is False.
+
+    Returns:
+        int: Number of images filtered
+    """
+    root_dir = Path(root_dir)
+    tag = filter_tag(spec)
+    manifest_file = root_dir / f'.speckle_{tag}.json'
+
+    done = {}
+    if manifest_file.exists() and not force: # the file name already encodes the filter parameters
+        with open(manifest_file, 'r') as f:
+            done = json.load(f)['files']
+
+    catalog = PairCatalog(root_dir)
+    catalog.refresh()
+
+    # An image is filtered again if its source changed size or modification time
+    files, todo = {}, []
+    for s1_rel, _, _, s1_size, s1_mtime, *_ in catalog.records:
+        dst = filtered_path(root_dir / s1_rel, spec)
+        files[s1_rel] = [s1_size, s1_mtime]
+        if done.get(s1_rel) != files[s1_rel] or not dst.exists():
+            dst.parent.mkdir(exist_ok=True)
+            todo.append((str(root_dir / s1_rel), str(dst)))
+
+    if todo:
+        print(f'Filtering {len(todo)} of {len(files)} SAR images into s1_{tag}/')
+        chunks = [(todo[i:i + 32], spec) for i in range(0, len(todo), 32)]
+        errors = []
+        with tqdm(total=len(todo), desc='Filtering') as pbar:
+            with Pool(num_workers) if num_workers > 0 else nullcontext() as pool:
+                results = pool.imap_unordered(_filter_images, chunks) if pool else map(_filter_images, chunks)
+                for count, chunk_errors in results:
+                    pbar.update(count)
+                    errors.extend(chunk_errors)
+        for src, error in errors:
+            print(f'Could not filter {src}: {error}')
+        # Undecodable images are retried on the next run
+        failed = {Path(src).relative_to(root_dir).as_posix() for src, _ in errors}
+        files = {s1_rel: stats for s1_rel, stats in files.items() if s1_rel not in failed}
+
+    with open(manifest_file, 'w') as f:
+        json.dump({'spec': spec, 'files': files}, f)
+    return len(todo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speckle-filter the SAR images of a dataset once.")
+    parser.add_argument("--root-dir", type=str, required=True, help="Root directory of the PNG dataset")
+    parser.add_argument("--filter", type=str, default="lee", choices=FILTERS, help="Speckle filter")
+    parser.add_argument("--size", type=int, default=None, help="Odd window size (default: 7 for lee, 5 for median)")
+    parser.add_argument("--looks", type=float, default=4.0, help="Equivalent number of looks, lee only")
+    parser.add_argument("--num-workers", type=int, default=4, help="Number of filtering processes")
+    parser.add_argument("--force", action="store_true", help="Filter every image again")
+    args = parser.parse_args()
+
+    spec = {'name': args.filter, 'size': args.size or (7 if args.filter == 'lee' else 5)}
+    if args.filter == 'lee':
+        spec['looks'] = args.looks
+    if spec['size'] % 2 == 0:
+        parser.error("--size must be odd")
+
+    filter_dataset(args.root_dir, spec, args.num_workers, args.force)
+    print(f"Filtered images are in <category>/s1_{filter_tag(spec)}/, set dataset.speckle_filter to {spec}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
+import json
 import logging
 from pathlib import Path
+from typing import Dict, Union
 
+import torch
+import torch.distributed as dist
+
+from src.distributed import is_distributed, is_main_process
 from .config import Config
 
 def setup_logging(config: Config):
-    """Setup logging configuration"""
+    """Setup logging configuration, the other ranks of a distributed run only log warnings to the console"""
+    if not is_main_process():
+        logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+        return
     results_dir = Path(config['training']['results_dir'])
     results_dir.mkdir(parents=True, exist_ok=True)
     logging.basicConfig(
@@ -39,12 +48,78 @@ def init_comet(config: Config):
         return experiment
     return None
 
-def log_metrics(experiment, metrics: dict, step: int, last: int = None):
-    """Log metrics to Comet if enabled, otherwise use local logging."""
+class MetricsAccumulator:
+    """
+    Running means of scalar metrics, summed on the device they are computed on.
+
+    `update` only queues additions on the device, so the training loop
+    never waits for the host to read a loss. `compute` syncs once, reading
+    all the means in a single transfer (after a single all-reduce in a
+    distributed run): call it at the logging interval or at the end of an
+    epoch, not every step.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forgets the accumulated values."""
+        self.sums: Dict[str, torch.Tensor] = {}
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def update(self, metrics: Dict[str, Union[torch.Tensor, float]]):
+        """Adds the scalar metrics of a step, e.g. the losses returned by `Pix2Pix.train_step`."""
+        for key, value in metrics.items():
+            value = torch.as_tensor(value).detach().double() # float64 sums stay exact over long epochs
+            self.sums[key] = self.sums[key] + value if key in self.sums else value
+        self.count += 1
+
+    def compute(self, reduce: bool = True) -> Dict[str, float]:
+        """
+        Returns the mean of every metric since the last reset, with a single host sync.
+
+        Args:
+            reduce (bool, optional): In a distributed run, average over the steps of all ranks.
+                This is a collective, every rank must call it. Default is True.
+
+        Returns:
+            Dict[str, float]: Mean of every metric
+        """
+        if not self.sums:
+            return {}
+        sums = list(self.sums.values())
+        totals = torch.stack([total.to(sums[0].device) for total in sums] +
+                             [torch.tensor(self.count, dtype=torch.float64, device=sums[0].device)])
+        if reduce and is_distributed():
+            dist.all_reduce(totals)
+        means = totals[:-1] / totals[-1]
+        return dict(zip(self.sums, means.tolist()))
+
+
+def log_metrics(experiment, metrics: Union[dict, MetricsAccumulator], step: int, last: int = None):
+    """Log metrics to Comet if enabled, otherwise use local logging. Only rank 0 of a distributed run logs.
+
+    `metrics` is a dict of scalars, or a `MetricsAccumulator` whose means are logged."""
+    if isinstance(metrics, MetricsAccumulator):
+        metrics = metrics.compute()
+    if not is_main_process():
+        return
     if experiment:
         experiment.log_metrics(metrics, epoch=step)
     else:
         if last:
             logging.info(f"Step {step}/{last} metrics: {metrics}")
         else:
-            logging.info(f"Step {step} metrics: {metrics}")
\ No newline at end of file
+            logging.info(f"Step {step} metrics: {metrics}")
+
+
+def log_jsonl(path: Union[str, Path], record: dict):
+    """Appends `record` to a local JSON Lines file, one object per line. Only rank 0 of a distributed run writes."""
+    if not is_main_process():
+        return
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')